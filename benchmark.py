@@ -0,0 +1,567 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+发票处理流水线性能测试
+
+功能：
+- 生成标准版式的模拟电子发票PDF（无需真实发票）
+- 在本地启动模拟的DeepSeek chat/completions接口，可设置响应延迟和错误率
+- 统计各阶段耗时：PDF解析、提示词构建、等待AI、JSON解析、写入表格、保存文件
+- 统计不同并发数下的吞吐量（文件/秒）
+
+使用方法：
+python benchmark.py                                   # 默认：50个文件，延迟1秒，并发 1,4,8
+python benchmark.py --files 200 --latency 2 --error-rate 0.05 --concurrency 1,4,8,16
+python benchmark.py --pdf-dir ./pdf_files             # 使用已有的PDF文件代替生成的文件
+python benchmark.py --parse-processes 8               # PDF读取放到8个进程中并行
+python benchmark.py --stream --stall-rate 0.1 --deadline 5   # 流式接收，10%的响应中途卡住
+python benchmark.py --route --local-extraction        # 按复杂度路由，并列出各路径的耗时和费用
+python benchmark.py --duplicate-rate 0.2              # 20%的发票以不同文件内容重复出现，查重后不再调用AI
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import re
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import entry
+from deepseek_client import DeepSeekClient
+from invoice_cache import JsonFileCache
+from invoice_export import InvoiceExporter, XlsxSink
+from invoice_index import InvoiceIndex
+from metrics import percentile
+from model_router import ModelRouter
+
+PAGE_WIDTH = 595
+PAGE_HEIGHT = 842
+
+SELLERS = [
+    ("苏州诚利恩服装科技有限公司", "91320506MA1MMRPX1T"),
+    ("上海明川电子商务有限公司", "91310115MA1H7XK23W"),
+    ("杭州青禾办公用品有限公司", "91330106MA2CFR4L8B"),
+]
+BUYERS = [
+    ("至信搏远（安徽）新材料科技有限公司", "91340700MA8P9Y7Y9D"),
+    ("南京远帆物流有限公司", "91320114MA1X8KQ62E"),
+]
+GOODS = [
+    ("*服装*净化服", "件"), ("*鞋*防砸鞋", "双"), ("*纸制品*复印纸", "箱"),
+    ("*办公设备*打印机", "台"), ("*日用杂品*劳保手套", "副"), ("*电子元件*电阻", "个"),
+]
+
+
+# ---------------------------------------------------------------- 模拟发票生成
+
+def _text_width(text: str, size: float) -> float:
+    return sum(0.5 if ord(c) < 128 else 1.0 for c in text) * size
+
+
+def _box(left, top, text, size=9):
+    return [left, top, int(left + _text_width(text, size)), top + size, text]
+
+
+def _right_box(right, top, text, size=9):
+    return [int(right - _text_width(text, size)), top, right, top + size, text]
+
+
+def synthetic_invoice(index: int, rng: random.Random):
+    """
+    生成一张标准版式电子发票的文字坐标和对应的标准答案
+
+    Returns:
+        (boxes, expected): boxes 为 [[left, top, right, bottom, text], ...]，
+        expected 为与AI返回结构一致的字典
+    """
+    seller_name, seller_tax_id = rng.choice(SELLERS)
+    buyer_name, buyer_tax_id = rng.choice(BUYERS)
+    invoice_number = f"2432200000{index:010d}"
+    invoice_date = f"2024年{rng.randint(1, 12)}月{rng.randint(1, 28)}日"
+    issuer = rng.choice(["沈辰虹", "李晓明", "王芳"])
+
+    boxes = [
+        _box(161, 22, "电子发票（增值税专用发票）", 20),
+        _box(438, 31, f"发票号码：{invoice_number}", 10),
+        _box(438, 48, f"开票日期：{invoice_date}", 10),
+        _box(32, 95, f"名称：{buyer_name}"),
+        _box(317, 95, f"名称：{seller_name}"),
+        _box(32, 125, f"统一社会信用代码/纳税人识别号：{buyer_tax_id}", 10),
+        _box(317, 125, f"统一社会信用代码/纳税人识别号：{seller_tax_id}", 10),
+    ]
+    for left, chars in ((16, "购买方信息"), (301, "销售方信息")):
+        for offset, char in enumerate(chars):
+            boxes.append(_box(left, 92 + offset * 10, char))
+    for left, label in ((45, "项目名称"), (119, "规格型号"), (446, "税率/征收率")):
+        boxes.append(_box(left, 151, label))
+    for left, label in ((189, "单位"), (263, "数量"), (334, "单价"), (406, "金额"), (551, "税额")):
+        boxes.append(_box(left, 151, label[0]))
+        boxes.append(_box(left + 19, 151, label[1]))
+
+    items = []
+    for row in range(rng.randint(1, 8)):
+        name, unit = rng.choice(GOODS)
+        quantity = rng.randint(1, 200)
+        unit_price = round(rng.uniform(1, 500), 6)
+        amount = round(quantity * unit_price, 2)
+        tax_amount = round(amount * 0.13, 2)
+        top = 160 + row * 12
+        boxes += [
+            _box(12, top, name),
+            _box(198, top, unit),
+            _right_box(290, top, str(quantity)),
+            _right_box(361, top, repr(unit_price)),
+            _right_box(433, top, f"{amount:.2f}"),
+            _box(465, top, "13%"),
+            _right_box(582, top, f"{tax_amount:.2f}"),
+        ]
+        items.append({
+            "name": name, "specification": "", "unit": unit, "quantity": quantity,
+            "unit_price": unit_price, "amount": amount, "tax_rate": "13%",
+            "tax_amount": tax_amount, "total_with_tax": round(amount + tax_amount, 2),
+        })
+
+    amount_sum = round(sum(item["amount"] for item in items), 2)
+    tax_sum = round(sum(item["tax_amount"] for item in items), 2)
+    boxes += [
+        _box(58, 261, "合"), _box(103, 261, "计"),
+        _right_box(435, 261, f"¥{amount_sum:.2f}"),
+        _right_box(582, 261, f"¥{tax_sum:.2f}"),
+        _box(47, 280, "价税合计（大写）"),
+        _box(406, 278, f"（小写）¥{amount_sum + tax_sum:.2f}", 11),
+        _box(31, 305, f"订单号：IB-{index:06d}"),
+        _box(17, 309, "备"), _box(17, 326, "注"),
+        _box(55, 367, f"开票人：{issuer}", 10),
+    ]
+
+    expected = {
+        "invoice_number": invoice_number,
+        "seller_tax_id": seller_tax_id, "seller_name": seller_name,
+        "buyer_tax_id": buyer_tax_id, "buyer_name": buyer_name,
+        "invoice_date": invoice_date,
+        "tax_classification_code": "", "special_business_type": "",
+        "items": items,
+        "invoice_source": "", "invoice_type": "电子发票（增值税专用发票）",
+        "invoice_status": "", "is_positive_invoice": True,
+        "invoice_risk_level": "", "issuer": issuer,
+        "remarks": f"订单号：IB-{index:06d}",
+    }
+    return boxes, expected
+
+
+def write_pdf(path: str, *pages):
+    """
+    将文字框写成PDF，每个参数为一页的文字框列表
+
+    使用PDF阅读器内置的 STSong-Light 中文字体（无需嵌入字体文件），
+    并按文字框宽度设置水平缩放，使 pdfplumber 读出的坐标与 boxes 一致。
+    """
+    streams = []
+    for boxes in pages:
+        ops = []
+        for left, top, right, bottom, text in boxes:
+            size = bottom - top
+            natural = _text_width(text, size)
+            scale = 100 * (right - left) / natural if natural else 100
+            baseline = PAGE_HEIGHT - top - size * 0.88
+            encoded = "".join(f"{ord(c):04X}" for c in text)
+            ops.append(f"BT /F1 {size} Tf {scale:.1f} Tz 1 0 0 1 {left} {baseline:.2f} Tm <{encoded}> Tj ET")
+        streams.append("\n".join(ops).encode("ascii"))
+
+    # 对象编号：1 目录，2 页面树，3-5 字体，之后每页占两个对象（页面、内容流）
+    page_ids = [6 + 2 * i for i in range(len(streams))]
+    kids = " ".join(f"{page_id} 0 R" for page_id in page_ids)
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        f"<< /Type /Pages /Kids [{kids}] /Count {len(streams)} >>".encode("ascii"),
+        b"<< /Type /Font /Subtype /Type0 /BaseFont /STSong-Light /Encoding /UniGB-UCS2-H "
+        b"/DescendantFonts [4 0 R] >>",
+        b"<< /Type /Font /Subtype /CIDFontType0 /BaseFont /STSong-Light "
+        b"/CIDSystemInfo << /Registry (Adobe) /Ordering (GB1) /Supplement 4 >> "
+        b"/FontDescriptor 5 0 R /DW 1000 /W [1 95 500] >>",
+        b"<< /Type /FontDescriptor /FontName /STSong-Light /Flags 6 /FontBBox [-25 -254 1000 880] "
+        b"/ItalicAngle 0 /Ascent 880 /Descent -120 /CapHeight 880 /StemV 93 >>",
+    ]
+    for page_id, stream in zip(page_ids, streams):
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {page_id + 1} 0 R >>".encode("ascii")
+        )
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+def generate_corpus(directory: str, count: int, seed: int = 0, per_file: int = 1):
+    """
+    生成 count 个模拟发票PDF，返回 {发票号码: 标准答案}
+
+    per_file 大于1时每个PDF是一页一张发票的合订文件
+    """
+    rng = random.Random(seed)
+    answers = {}
+    for index in range(count):
+        pages = []
+        for page in range(per_file):
+            boxes, expected = synthetic_invoice(index * per_file + page, rng)
+            pages.append(boxes)
+            answers[expected["invoice_number"]] = expected
+        write_pdf(os.path.join(directory, f"invoice_{index:05d}.pdf"), *pages)
+    return answers
+
+
+# ---------------------------------------------------------------- 模拟AI接口
+
+INVOICE_NUMBER_RE = re.compile(r"发票号码[:：]\s*(\d+)")
+BATCH_ID_RE = re.compile(r"发票 id=(\S+):")
+
+
+class MockDeepSeekServer:
+    """
+    本地模拟的 chat/completions 接口
+
+    按请求内容中的发票号码返回标准答案（支持批量识别格式），
+    每个请求等待 latency±jitter 秒，并按 error_rate 随机返回 429 或 500。
+    流式请求（stream=true）的响应在这段时间内分段发送，
+    按 stall_rate 随机在发送一半后卡住 STALL_SECONDS 秒（模拟失控的生成）。
+    """
+
+    STALL_SECONDS = 60.0
+    STREAM_CHUNKS = 20
+
+    def __init__(
+            self, answers, latency: float = 1.0, jitter: float = 0.2,
+            error_rate: float = 0.0, stall_rate: float = 0.0,
+    ):
+        self.answers = answers
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.stall_rate = stall_rate
+        self.requests = 0
+        self.errors = 0
+        self.stalls = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_port}"
+
+    def _lookup(self, content: str) -> dict:
+        """按发票号码查找标准答案；纠错请求中没有号码，按货物名称和金额查找"""
+        match = INVOICE_NUMBER_RE.search(content)
+        if match:
+            return self.answers.get(match.group(1), {})
+        for answer in self.answers.values():
+            items = answer.get("items") or []
+            if items and all(item["name"] in content and str(item["amount"]) in content for item in items):
+                return answer
+        return {}
+
+    def _answer(self, content: str) -> dict:
+        parts = BATCH_ID_RE.split(content)
+        if len(parts) == 1:
+            return self._lookup(content)
+        invoices = []
+        for invoice_id, part in zip(parts[1::2], parts[2::2]):
+            answer = dict(self._lookup(part))
+            answer["id"] = invoice_id
+            invoices.append(answer)
+        return {"invoices": invoices}
+
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                with mock._lock:
+                    mock.requests += 1
+                    failed = random.random() < mock.error_rate
+                    mock.errors += failed
+                latency = max(0.0, mock.latency + random.uniform(-mock.jitter, mock.jitter))
+
+                if failed:
+                    time.sleep(latency)
+                    status = random.choice([429, 500])
+                    self._send(status, {"error": {"message": "mock error"}}, {"Retry-After": "0.1"})
+                    return
+
+                content = json.dumps(mock._answer(body["messages"][-1]["content"]), ensure_ascii=False)
+                prompt_chars = sum(len(m["content"]) for m in body["messages"])
+                usage = {
+                    "prompt_tokens": int(prompt_chars * 0.6),
+                    "completion_tokens": int(len(content) * 0.6),
+                    "total_tokens": int((prompt_chars + len(content)) * 0.6),
+                }
+                if body.get("stream"):
+                    try:
+                        self._stream(body, content, usage, latency)
+                    except (BrokenPipeError, ConnectionResetError):
+                        pass  # 客户端到达截止时间后关闭了连接
+                    return
+
+                time.sleep(latency)
+                self._send(200, {
+                    "id": "mock", "object": "chat.completion", "created": int(time.time()),
+                    "model": body.get("model", "deepseek-chat"),
+                    "choices": [{
+                        "index": 0, "finish_reason": "stop",
+                        "message": {"role": "assistant", "content": content},
+                    }],
+                    "usage": usage,
+                })
+
+            def _stream(self, body, content, usage, latency):
+                """以 server-sent events 分段发送，第一段在延迟的 1/5 后到达，其余均匀分布"""
+                with mock._lock:
+                    stalled = random.random() < mock.stall_rate
+                    mock.stalls += stalled
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.end_headers()
+
+                def event(choices, usage=None):
+                    chunk = {
+                        "id": "mock", "object": "chat.completion.chunk", "created": int(time.time()),
+                        "model": body.get("model", "deepseek-chat"), "choices": choices,
+                    }
+                    if usage:
+                        chunk["usage"] = usage
+                    self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+
+                size = max(1, -(-len(content) // mock.STREAM_CHUNKS))
+                pieces = [content[i:i + size] for i in range(0, len(content), size)]
+                time.sleep(latency * 0.2)
+                for number, piece in enumerate(pieces):
+                    if stalled and number == len(pieces) // 2:
+                        time.sleep(mock.STALL_SECONDS)
+                    event([{"index": 0, "delta": {"content": piece}, "finish_reason": None}])
+                    time.sleep(latency * 0.8 / len(pieces))
+                event([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+                event([], usage)
+                self.wfile.write(b"data: [DONE]\n\n")
+
+            def _send(self, status, payload, headers=None):
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def __enter__(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+# ---------------------------------------------------------------- 测试流程
+
+def measure_stages(pdf_paths, output_dir: str):
+    """逐个文件（单线程、不使用缓存）统计各阶段耗时，返回 {阶段: [秒, ...]}"""
+    stages = {name: [] for name in ("PDF解析", "提示词构建", "等待AI", "JSON解析", "写入表格", "保存文件")}
+    wb, ws = entry.create_summary_workbook(entry.SUMMARY_HEADERS, streaming=True)
+    exporter = InvoiceExporter(XlsxSink(ws))
+
+    for pdf_path in pdf_paths:
+        start = time.perf_counter()
+        rs, _ = entry.pdf_read_text(pdf_path)
+        stages["PDF解析"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        content = entry.encode_prompt_content(rs)
+        stages["提示词构建"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        response = entry.ask_deep_seek(content)
+        stages["等待AI"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        invoice_info = entry.invoice_from_dict(json.loads(response))
+        stages["JSON解析"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        exporter.write(pdf_path, [invoice_info], None)
+        stages["写入表格"].append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    wb.save(os.path.join(output_dir, "stage_benchmark.xlsx"))
+    stages["保存文件"].append(time.perf_counter() - start)
+    return stages
+
+
+def measure_throughput(
+        pdf_dir: str, max_workers: int, batch_size: int, work_dir: str, parse_processes: int = 0
+) -> float:
+    """使用空缓存和空索引完整运行一次 process_directory_to_xlsx，返回耗时（秒）"""
+    cache_dir = tempfile.mkdtemp(dir=work_dir)
+    entry.invoice_cache = JsonFileCache(cache_dir=cache_dir)
+    entry.invoice_index = InvoiceIndex(os.path.join(cache_dir, "index.db"))
+    start = time.perf_counter()
+    entry.process_directory_to_xlsx(
+        pdf_dir,
+        max_workers=max_workers,
+        batch_size=batch_size,
+        streaming=True,
+        parse_processes=parse_processes,
+    )
+    elapsed = time.perf_counter() - start
+    entry.invoice_index.close()
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    return elapsed
+
+
+def add_duplicates(pdf_paths, rate: float, seed: int = 0) -> int:
+    """
+    为一部分PDF生成内容不同的副本（在文件末尾追加注释，哈希不同、票面相同），
+    模拟同一张发票以不同文件名重复收到的情况；返回副本数
+
+    副本文件名以"副本_"开头，排在全部原文件之后，处理到副本时原文件已写入索引
+    """
+    rng = random.Random(seed)
+    count = 0
+    for pdf_path in pdf_paths:
+        if rng.random() >= rate:
+            continue
+        with open(pdf_path, "rb") as f:
+            data = f.read()
+        copy_path = os.path.join(os.path.dirname(pdf_path), f"副本_{os.path.basename(pdf_path)}")
+        with open(copy_path, "wb") as f:
+            f.write(data + f"\n% copy {count}\n".encode("ascii"))
+        count += 1
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="发票处理流水线性能测试（使用模拟AI接口）")
+    parser.add_argument("--files", type=int, default=50, help="生成的模拟发票数量")
+    parser.add_argument("--per-file", type=int, default=1,
+                        help="每个模拟PDF包含的发票数量（一页一张的合订文件）")
+    parser.add_argument("--pdf-dir", help="使用已有的PDF目录（模拟接口对未知发票返回空结果）")
+    parser.add_argument("--latency", type=float, default=1.0, help="模拟接口的平均响应延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.2, help="响应延迟的随机波动（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="模拟接口返回429/500的比例")
+    parser.add_argument("--concurrency", default="1,4,8", help="要测试的并发数，逗号分隔")
+    parser.add_argument("--batch-size", type=int, default=1, help="每次AI请求包含的发票数量")
+    parser.add_argument("--parse-processes", type=int, default=0, help="读取PDF的进程数（0 表示在解析线程中读取）")
+    parser.add_argument("--stage-files", type=int, default=10, help="用于分阶段计时的文件数")
+    parser.add_argument("--local-extraction", action="store_true", help="允许本地版式识别（默认关闭，全部走AI接口）")
+    parser.add_argument("--stream", action="store_true", help="流式接收AI响应（STREAM_RESPONSES）")
+    parser.add_argument("--route", action="store_true", help="按发票复杂度选择识别路径（model_router.py）")
+    parser.add_argument("--compact-threshold", type=float, default=1.5,
+                        help="路由时走紧凑提示词路径的最高复杂度分数")
+    parser.add_argument("--deadline", type=float, default=entry.INVOICE_DEADLINE,
+                        help="流式接收时每张发票的截止时间（秒）")
+    parser.add_argument("--stall-rate", type=float, default=0.0,
+                        help="模拟接口流式响应中途卡住的比例")
+    parser.add_argument("--duplicate-rate", type=float, default=0.0,
+                        help="以不同文件内容重复出现的发票比例（测试调用AI前的查重）")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="invoice_bench_")
+    original_cache = entry.invoice_cache
+    original_index = entry.invoice_index
+    # 模拟发票写入临时索引，不混入用户的查询索引
+    entry.invoice_index = InvoiceIndex(os.path.join(work_dir, "index.db"))
+    try:
+        pdf_dir = os.path.join(work_dir, "pdf")
+        if args.pdf_dir:
+            # 复制到临时目录，避免在原目录生成汇总表格
+            shutil.copytree(args.pdf_dir, pdf_dir)
+            answers = {}
+        else:
+            os.makedirs(pdf_dir)
+            start = time.perf_counter()
+            answers = generate_corpus(pdf_dir, args.files, per_file=args.per_file)
+            print(f"生成 {args.files} 个模拟发票PDF，耗时 {time.perf_counter() - start:.2f} 秒")
+        if args.duplicate_rate:
+            originals = sorted(os.path.join(pdf_dir, f) for f in os.listdir(pdf_dir) if f.lower().endswith(".pdf"))
+            print(f"生成 {add_duplicates(originals, args.duplicate_rate)} 个内容不同的重复发票副本")
+        pdf_paths = sorted(
+            os.path.join(pdf_dir, f) for f in os.listdir(pdf_dir) if f.lower().endswith(".pdf")
+        )
+
+        entry.LOCAL_EXTRACTION = args.local_extraction
+        entry.STREAM_RESPONSES = args.stream
+        if args.route:
+            entry.model_router = ModelRouter(
+                compact_threshold=args.compact_threshold, local=args.local_extraction
+            )
+        entry.INVOICE_DEADLINE = args.deadline
+        entry.deep_seek_client = DeepSeekClient(requests_per_minute=100000, tokens_per_minute=10 ** 9)
+
+        with MockDeepSeekServer(answers, args.latency, args.jitter, args.error_rate, args.stall_rate) as server:
+            entry.DEEP_SEEK_KEY = "sk-benchmark"
+            entry.DEEP_SEEK_API_HOST = server.base_url
+
+            print(f"\n== 分阶段耗时（{min(args.stage_files, len(pdf_paths))} 个文件，单线程）==")
+            with contextlib.redirect_stdout(io.StringIO()):
+                stages = measure_stages(pdf_paths[:args.stage_files], work_dir)
+            print(f"{'阶段':<10}{'平均(ms)':>12}{'p50(ms)':>12}{'p95(ms)':>12}")
+            for name, values in stages.items():
+                print(
+                    f"{name:<10}{statistics.mean(values) * 1000:>12.1f}"
+                    f"{percentile(values, 0.5) * 1000:>12.1f}{percentile(values, 0.95) * 1000:>12.1f}"
+                )
+
+            print(f"\n== 吞吐量（{len(pdf_paths)} 个文件，延迟 {args.latency}s，错误率 {args.error_rate:.0%}）==")
+            print(f"{'并发数':<8}{'耗时(s)':>10}{'文件/秒':>10}{'加速比':>10}")
+            baseline = None
+            for workers in [int(c) for c in args.concurrency.split(",") if c.strip()]:
+                requests_before, stalls_before = server.requests, server.stalls
+                with contextlib.redirect_stdout(io.StringIO()):
+                    elapsed = measure_throughput(
+                        pdf_dir, workers, args.batch_size, work_dir, args.parse_processes
+                    )
+                baseline = baseline or elapsed
+                print(
+                    f"{workers:<8}{elapsed:>10.2f}{len(pdf_paths) / elapsed:>10.2f}"
+                    f"{baseline / elapsed:>10.2f}   （AI请求 {server.requests - requests_before} 次"
+                    + (f"，卡住 {server.stalls - stalls_before} 次）" if args.stream else "）")
+                )
+                if args.route:
+                    # 运行汇总最后几行为各路径的统计
+                    lines = entry.run_metrics.format_summary().splitlines()
+                    print("\n".join(lines[next(i for i, line in enumerate(lines) if line.startswith("路径")):]))
+    finally:
+        entry.invoice_cache = original_cache
+        entry.invoice_index.close()
+        entry.invoice_index = original_index
+        entry.model_router = None
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -38,6 +38,20 @@ a = Analysis(
         'openpyxl',
         'pdfplumber',
         'openai',
+        'deepseek_client',
+        'invoice_cache',
+        'invoice_export',
+        'invoice_index',
+        'local_extractor',
+        'model_router',
+        'invoice_pages',
+        'invoice_validation',
+        'stream_json',
+        'prompt_encoding',
+        'metrics',
+        'job_journal',
+        'file_discovery',
+        'sqlite3',
         'tkinter',
         'tkinter.ttk',
         'tkinter.filedialog',
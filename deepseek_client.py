@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+DeepSeek 接口客户端
+
+功能：
+- 同步/异步两套客户端共用同一组配置，各自复用一个HTTP连接池
+- 令牌桶限流：同时限制每分钟请求数（RPM）和每分钟token数（TPM）
+- 遇到 429 / 5xx / 网络错误时指数退避重试，并遵循服务端返回的 Retry-After
+- 流式调用（chat_stream）：边生成边交给调用方，并可设置截止时间取消生成过久的请求
+"""
+
+import asyncio
+import random
+import threading
+import time
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Optional
+
+from openai import (
+    APIConnectionError,
+    APIStatusError,
+    APITimeoutError,
+    AsyncOpenAI,
+    OpenAI,
+)
+
+# 默认限流参数（可按账号额度调整）
+DEFAULT_REQUESTS_PER_MINUTE = 60
+DEFAULT_TOKENS_PER_MINUTE = 1_000_000
+
+# 单次请求超时时间（秒）与最大重试次数
+DEFAULT_TIMEOUT = 120.0
+DEFAULT_MAX_RETRIES = 5
+
+# 退避参数（秒）
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+
+# 为补全内容预留的token数，用于限流预估
+COMPLETION_TOKEN_RESERVE = 1500
+
+# 需要重试的HTTP状态码
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """线程安全的令牌桶，容量为每分钟额度，按秒匀速补充"""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, amount: float) -> float:
+        """
+        预订 amount 个令牌，返回调用方需要等待的秒数
+
+        令牌可以透支，透支部分由后续调用方按顺序等待补足，
+        因此并发调用方会被自然地排队，而不是同时醒来争抢。
+        """
+        if self.capacity <= 0:
+            return 0.0
+        amount = min(float(amount), self.capacity)
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated_at) * self.rate
+            )
+            self.updated_at = now
+            self.tokens -= amount
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+
+class RateLimiter:
+    """同时按请求数和token数限流"""
+
+    def __init__(
+        self,
+        requests_per_minute: float = DEFAULT_REQUESTS_PER_MINUTE,
+        tokens_per_minute: float = DEFAULT_TOKENS_PER_MINUTE,
+    ):
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+
+    def reserve(self, tokens: int) -> float:
+        return max(
+            self.request_bucket.reserve(1), self.token_bucket.reserve(tokens)
+        )
+
+    def acquire(self, tokens: int):
+        """同步等待直到额度可用"""
+        delay = self.reserve(tokens)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def acquire_async(self, tokens: int):
+        """异步等待直到额度可用"""
+        delay = self.reserve(tokens)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class DeadlineExceeded(TimeoutError):
+    """流式请求超过截止时间被取消，partial_content 为取消前已收到的内容"""
+
+    def __init__(self, message: str, partial_content: str = ""):
+        super().__init__(message)
+        self.partial_content = partial_content
+
+
+def estimate_tokens(messages: List[Dict[str, str]]) -> int:
+    """
+    粗略估算一次请求消耗的token数（提示词 + 预留的补全长度）
+
+    DeepSeek 约 1 个中文字符 ≈ 0.6 token，1 个英文字符 ≈ 0.3 token，
+    这里统一按 0.6 估算，宁可多预留也不触发限流。
+    """
+    chars = sum(len(m.get("content") or "") for m in messages)
+    return int(chars * 0.6) + COMPLETION_TOKEN_RESERVE
+
+
+def retry_delay(error: Exception, attempt: int) -> Optional[float]:
+    """
+    计算第 attempt 次失败后的等待时间，返回 None 表示不应重试
+
+    优先使用服务端的 Retry-After 头，否则使用带抖动的指数退避。
+    """
+    if isinstance(error, APIStatusError):
+        if error.status_code not in RETRYABLE_STATUS_CODES:
+            return None
+        retry_after = error.response.headers.get("retry-after")
+        if retry_after:
+            try:
+                return min(float(retry_after), BACKOFF_MAX)
+            except ValueError:
+                pass
+    elif not isinstance(error, (APIConnectionError, APITimeoutError)):
+        return None
+
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt))
+    return delay * (0.5 + random.random() / 2)
+
+
+class DeepSeekClient:
+    """
+    带限流与重试的 DeepSeek 客户端
+
+    同步客户端和异步客户端都在首次使用时创建，并在之后的所有请求中复用
+    （各自持有一个HTTP连接池）；API密钥或地址变化时会自动重建。
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float = DEFAULT_REQUESTS_PER_MINUTE,
+        tokens_per_minute: float = DEFAULT_TOKENS_PER_MINUTE,
+        timeout: float = DEFAULT_TIMEOUT,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+    ):
+        self.limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self._lock = threading.Lock()
+        self._config = None
+        self._sync_client = None
+        self._async_client = None
+
+    def _clients(self, api_key: str, base_url: str):
+        config = (api_key, base_url)
+        with self._lock:
+            if config != self._config:
+                # max_retries=0：重试由本类统一处理，避免与SDK内置重试叠加
+                self._sync_client = OpenAI(
+                    api_key=api_key,
+                    base_url=base_url,
+                    timeout=self.timeout,
+                    max_retries=0,
+                )
+                self._async_client = AsyncOpenAI(
+                    api_key=api_key,
+                    base_url=base_url,
+                    timeout=self.timeout,
+                    max_retries=0,
+                )
+                self._config = config
+            return self._sync_client, self._async_client
+
+    def chat(self, api_key: str, base_url: str, messages, **kwargs):
+        """同步调用 chat.completions.create，返回完整的响应对象"""
+        client, _ = self._clients(api_key, base_url)
+        tokens = estimate_tokens(messages)
+        attempt = 0
+        while True:
+            self.limiter.acquire(tokens)
+            try:
+                return client.chat.completions.create(messages=messages, **kwargs)
+            except Exception as e:
+                delay = retry_delay(e, attempt)
+                if delay is None or attempt >= self.max_retries:
+                    raise
+                print(f"DeepSeek请求失败，{delay:.1f}秒后重试 ({attempt + 1}/{self.max_retries}): {e}")
+                time.sleep(delay)
+                attempt += 1
+
+    async def achat(self, api_key: str, base_url: str, messages, **kwargs):
+        """异步调用 chat.completions.create，返回完整的响应对象"""
+        _, client = self._clients(api_key, base_url)
+        tokens = estimate_tokens(messages)
+        attempt = 0
+        while True:
+            await self.limiter.acquire_async(tokens)
+            try:
+                return await client.chat.completions.create(
+                    messages=messages, **kwargs
+                )
+            except Exception as e:
+                delay = retry_delay(e, attempt)
+                if delay is None or attempt >= self.max_retries:
+                    raise
+                print(f"DeepSeek请求失败，{delay:.1f}秒后重试 ({attempt + 1}/{self.max_retries}): {e}")
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    def chat_stream(
+        self,
+        api_key: str,
+        base_url: str,
+        messages,
+        on_delta: Optional[Callable[[str], None]] = None,
+        deadline: Optional[float] = None,
+        **kwargs,
+    ):
+        """
+        流式调用 chat.completions.create，每收到一段内容就调用 on_delta(text)
+
+        Args:
+            on_delta: 收到内容时的回调（在调用线程中执行）
+            deadline: time.monotonic() 的截止时刻；到期时关闭连接、取消生成，
+                抛出 DeadlineExceeded（带已收到的内容）。连接挂起、一直收不到数据时同样会被取消
+
+        只有在还没有收到任何内容时才会重试（已交给 on_delta 的内容无法撤回），
+        重试的等待时间超过截止时间时直接放弃。
+
+        Returns:
+            与 chat 结构相同的响应对象（choices[0].message.content、finish_reason、usage）
+        """
+        client, _ = self._clients(api_key, base_url)
+        tokens = estimate_tokens(messages)
+        attempt = 0
+        while True:
+            self.limiter.acquire(tokens)
+            parts: List[str] = []
+            try:
+                return self._consume_stream(client, messages, parts, on_delta, deadline, kwargs)
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                delay = retry_delay(e, attempt)
+                if parts or delay is None or attempt >= self.max_retries:
+                    raise
+                if deadline is not None and time.monotonic() + delay >= deadline:
+                    raise DeadlineExceeded(f"等待重试将超过截止时间: {e}")
+                print(f"DeepSeek请求失败，{delay:.1f}秒后重试 ({attempt + 1}/{self.max_retries}): {e}")
+                time.sleep(delay)
+                attempt += 1
+
+    def _consume_stream(self, client, messages, parts: List[str], on_delta, deadline, kwargs):
+        timeout = self.timeout
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise DeadlineExceeded("请求开始前已超过截止时间")
+            timeout = min(timeout, remaining)
+
+        stream = client.chat.completions.create(
+            messages=messages,
+            stream=True,
+            stream_options={"include_usage": True},
+            timeout=timeout,
+            **kwargs,
+        )
+        # 到期时从另一个线程关闭连接，中断正在等待数据的读取
+        timer = None
+        if deadline is not None:
+            timer = threading.Timer(max(0.0, deadline - time.monotonic()), stream.close)
+            timer.daemon = True
+            timer.start()
+
+        finish_reason, usage = None, None
+        try:
+            for chunk in stream:
+                if getattr(chunk, "usage", None):
+                    usage = chunk.usage
+                for choice in chunk.choices:
+                    delta = choice.delta.content if choice.delta else None
+                    if delta:
+                        parts.append(delta)
+                        if on_delta is not None:
+                            on_delta(delta)
+                    if choice.finish_reason:
+                        finish_reason = choice.finish_reason
+                if deadline is not None and time.monotonic() >= deadline:
+                    break
+        except Exception:
+            if deadline is not None and time.monotonic() >= deadline:
+                raise DeadlineExceeded("生成超过截止时间，已取消", "".join(parts))
+            raise
+        finally:
+            if timer is not None:
+                timer.cancel()
+            stream.close()
+
+        if finish_reason is None and deadline is not None and time.monotonic() >= deadline:
+            raise DeadlineExceeded("生成超过截止时间，已取消", "".join(parts))
+        message = SimpleNamespace(role="assistant", content="".join(parts))
+        return SimpleNamespace(
+            choices=[SimpleNamespace(index=0, message=message, finish_reason=finish_reason)],
+            usage=usage,
+        )
@@ -1,17 +1,86 @@
 import os
 import pdfplumber
-from openai import OpenAI
-from dataclasses import dataclass
-from typing import List, Optional, Union
+from dataclasses import asdict, dataclass
+from typing import Dict, List, Optional, Tuple, Union
+import ast
+import copy
+import itertools
 import json
+from collections import deque
+from contextlib import nullcontext
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
 
-from openpyxl import Workbook
-from openpyxl.styles import Font, PatternFill, Alignment
-from openpyxl.cell import Cell
 from datetime import datetime
 
+from deepseek_client import DeadlineExceeded, DeepSeekClient
+from file_discovery import iter_pdf_files
+from invoice_cache import create_cache, file_digest
+# 汇总表的生成与写入（见 invoice_export.py），其他模块仍可通过 entry 使用
+from invoice_export import (
+    DUPLICATE_FLAG,
+    SUMMARY_HEADERS,
+    InvoiceExporter,
+    XlsxSink,
+    create_summary_workbook,
+    open_export,
+)
+from invoice_index import InvoiceIndex
+from invoice_pages import invoice_segments, page_invoice_number
+from invoice_validation import (
+    CORRECTION_PROMPT,
+    JSON_REPAIR_PROMPT,
+    apply_correction,
+    build_correction,
+    repair_json,
+    validate_invoice,
+)
+from job_journal import JobJournal
+from local_extractor import extract_invoice_locally
+from metrics import RunMetrics
+from model_router import LOCAL_ROUTE, ModelRouter, Route, RouteDecision
+from prompt_encoding import encode_boxes_compact
+from stream_json import JsonObjectStream
+
 DEEP_SEEK_KEY = ""
 DEEP_SEEK_API_HOST = "https://api.deepseek.com"
+DEEP_SEEK_MODEL = "deepseek-chat"
+
+# 批量处理时同时进行的发票解析数量（受DeepSeek接口限流约束）
+DEFAULT_MAX_WORKERS = 4
+
+# 读取PDF文字坐标的进程数，0 表示在解析线程中读取
+# pdfplumber 是纯Python实现，受GIL限制无法在线程间并行；
+# 设为CPU核数时PDF读取在多个进程中并行，读取完成后再交给线程调用AI
+DEFAULT_PARSE_PROCESSES = 0
+
+# 批量识别模式下每次AI请求包含的发票数量（1 表示逐张识别），
+# 以及批量请求允许的最大输出token数
+DEFAULT_BATCH_SIZE = 1
+BATCH_MAX_TOKENS = 8192
+
+# 递归查找PDF时预先列出子目录的线程数（网络共享盘上列目录较慢），1 表示逐个目录扫描
+DEFAULT_SCAN_WORKERS = 4
+
+# 一个PDF包含多张发票（合订的扫描件）时，同时进行AI识别的发票数量
+# 各张发票的识别并行进行，整个PDF的耗时接近其中最慢的一张
+PAGE_WORKERS = 4
+
+# AI识别结果未通过校验（金额合计、识别号格式等，见 invoice_validation.py）时，
+# 只针对出错字段发送纠错请求的最大次数；0 表示不发送，只打印校验问题
+MAX_CORRECTIONS = 1
+
+# 流式接收AI响应：边生成边解析JSON（见 stream_json.py），记录首个字段到达的时间；
+# 每张发票的识别最多等待 INVOICE_DEADLINE 秒，超时取消生成，
+# 已收到的字段只用于本次结果（标为不完整，不写入缓存和查询索引），
+# 缺失的货物由纠错请求补全（None 表示不限时）
+STREAM_RESPONSES = False
+INVOICE_DEADLINE = 90.0
+
+# 标准版式的电子发票优先在本地按坐标识别（见 local_extractor.py），
+# 校验不通过时才调用AI接口
+LOCAL_EXTRACTION = True
 
 SYSTEM_PROMPT = """你是一个发票识别助手，请根据描述的发票内容，识别出发票的各项信息。返回一个符合json格式的字符串。
 
@@ -105,10 +174,81 @@ SYSTEM_PROMPT = """你是一个发票识别助手，请根据描述的发票内
 ```
 """
 
-client = OpenAI(
-    api_key=DEEP_SEEK_KEY, base_url=DEEP_SEEK_API_HOST  # 替换为代理地址[5,6](@ref)
+# SYSTEM_PROMPT 示例中的发票坐标列表
+EXAMPLE_BOXES = ast.literal_eval(
+    SYSTEM_PROMPT[SYSTEM_PROMPT.index("[[161"):SYSTEM_PROMPT.index("]]\n```") + 2]
 )
 
+# 紧凑输入格式（见 prompt_encoding.py）使用的提示词：规则和输出示例不变，
+# 只替换输入格式说明和输入示例
+COMPACT_SYSTEM_PROMPT = SYSTEM_PROMPT.replace(
+    "输入格式为 : [[left,top,right,bottom,text], ...] 其中每一个元素是[left,top,right,bottom,text]。",
+    "输入格式为按行排列的文本，每行形如 : top|left@text left@text ...\n"
+    "其中 top 是该行文字的纵坐标，每个 left@text 是一段文字及其横坐标，"
+    "横坐标相近的文字位于同一列。",
+).replace(str(EXAMPLE_BOXES), encode_boxes_compact(EXAMPLE_BOXES))
+
+# 发送给AI的发票内容格式："list" 为原始坐标列表，"compact" 为紧凑的按行文本
+PROMPT_FORMAT = "list"
+
+# 纠错请求中票面文字的格式说明
+INPUT_FORMAT_NOTES = {
+    "list": "票面文字的格式为 [[left,top,right,bottom,text], ...]。",
+    "compact": "票面文字按行排列，每行形如 top|left@text left@text ...，横坐标相近的文字位于同一列。",
+}
+
+BATCH_PROMPT_SUFFIX = """
+批量识别模式：
+本次输入包含多张发票，每张发票以"发票 id=编号:"开头，之后是该发票的内容。
+请按上面的规则分别识别每一张发票，返回如下JSON对象：
+{
+  "invoices": [
+    {"id": "编号", ...该发票的全部字段...}
+  ]
+}
+每张输入发票必须恰好对应一个结果，id 必须与输入中的编号一致，不同发票的信息不要混在一起。
+"""
+BATCH_SYSTEM_PROMPT = SYSTEM_PROMPT + BATCH_PROMPT_SUFFIX
+
+# 全局共享的DeepSeek客户端：复用连接池，统一限流与重试
+# 每次请求时读取 DEEP_SEEK_KEY / DEEP_SEEK_API_HOST（可替换为代理地址），
+# 因此GUI在运行时设置密钥后立即生效
+deep_seek_client = DeepSeekClient()
+
+# 全局识别结果缓存（按PDF内容哈希存放，见 invoice_cache.py）
+# "json"：每条记录一个文件；"sqlite"：单个数据库文件，适合大型归档
+CACHE_BACKEND = "json"
+invoice_cache = create_cache(CACHE_BACKEND)
+
+# 批量处理时每次批量查询缓存的文件数量：第一批只取 CACHE_LOOKUP_FIRST_BATCH 个文件，
+# 之后逐批加倍到 CACHE_LOOKUP_BATCH，边扫描边处理时不必等凑满一大批才开始识别
+CACHE_LOOKUP_FIRST_BATCH = 8
+CACHE_LOOKUP_BATCH = 500
+
+# 已识别发票的查询索引（见 invoice_index.py）：识别完成或命中缓存时写入，
+# 可按销方/购方识别号、开票日期和金额查询；设为 None 时不写入。
+# 数据库文件在第一次读写时才创建，导入本模块不会创建文件
+invoice_index: Optional[InvoiceIndex] = InvoiceIndex()
+
+# 同一张发票常以不同文件名多次出现（内容不同，缓存无法命中）：
+# REUSE_INDEXED_INVOICES 为 True 时，调用AI前先从票面读取发票号码查询 invoice_index，
+# 已识别过的发票直接使用索引中的结果，同一号码正在由其他文件识别时等待其结果。
+# 带 warning（如校验未通过）的结果不写入索引，也不会被复用。
+# DUPLICATE_INVOICES 为汇总表中重复发票的写法
+# （"keep" 照常写入、"flag" 标为黄色、"skip" 不写入，见 invoice_export.DUPLICATE_POLICIES）
+REUSE_INDEXED_INVOICES = True
+DUPLICATE_INVOICES = DUPLICATE_FLAG
+
+# 运行指标：各文件的分阶段耗时和token用量（见 metrics.py）
+# process_directory_to_xlsx 每次运行前清空，结束时打印汇总
+run_metrics = RunMetrics()
+
+# 按复杂度选择识别路径（见 model_router.py）：None 表示所有发票先尝试本地识别
+# （LOCAL_EXTRACTION），再按 PROMPT_FORMAT 调用 DEEP_SEEK_MODEL；
+# 设为 ModelRouter() 时简单发票走本地识别或紧凑提示词，复杂发票才使用完整提示词，
+# 各路径的耗时、失败数和费用在运行汇总中列出
+model_router: Optional[ModelRouter] = None
+
 
 @dataclass
 class InvoiceItem:
@@ -145,6 +285,7 @@ class InvoiceInfo:
     invoice_risk_level: str = ""  # 发票风险等级
     issuer: str = ""  # 开票人
     remarks: str = ""  # 备注
+    warning: str = ""  # 识别结果的问题（如校验未通过），有问题的结果不写入缓存和查询索引
 
     def __post_init__(self):
         if self.items is None:
@@ -161,441 +302,1289 @@ class InvoiceInfo:
 """
 
 
-def ask_deep_seek(content: str):
-    response = client.chat.completions.create(
-        model="deepseek-chat",
-        messages=[
-            {"role": "system", "content": SYSTEM_PROMPT},
-            {"role": "user", "content": content},
-        ],
-        response_format={"type": "json_object"},
-    )
+def encode_prompt_content(rs, prompt_format: Optional[str] = None) -> str:
+    """
+    将 pdf_read_text 的坐标数据转换为发送给AI的文本
+
+    Args:
+        rs: [[left, top, right, bottom, text], ...]
+        prompt_format: "list" 或 "compact"，默认使用 PROMPT_FORMAT
+    """
+    prompt_format = prompt_format or PROMPT_FORMAT
+    if prompt_format == "compact":
+        return encode_boxes_compact(rs)
+    if prompt_format == "list":
+        return str(rs)
+    raise ValueError(f"未知的提示词格式: {prompt_format}")
+
+
+def _system_prompt(prompt_format: Optional[str] = None, batch: bool = False) -> str:
+    prompt_format = prompt_format or PROMPT_FORMAT
+    prompt = COMPACT_SYSTEM_PROMPT if prompt_format == "compact" else SYSTEM_PROMPT
+    return prompt + BATCH_PROMPT_SUFFIX if batch else prompt
+
+
+def _build_messages(content: str, prompt_format: Optional[str] = None):
+    return [
+        {"role": "system", "content": _system_prompt(prompt_format)},
+        {"role": "user", "content": content},
+    ]
+
+
+def _deadline(invoice_count: int = 1) -> Optional[float]:
+    return time.monotonic() + INVOICE_DEADLINE * invoice_count if INVOICE_DEADLINE else None
+
+
+def ask_deep_seek(content: str, prompt_format: Optional[str] = None, on_field=None, model: Optional[str] = None):
+    """
+    调用AI识别一张发票，返回响应文本
+
+    Args:
+        on_field: 流式接收时（STREAM_RESPONSES）每个顶层字段完整到达后调用 on_field(key, value)
+        model: 使用的模型，默认 DEEP_SEEK_MODEL
+    """
+    messages = _build_messages(content, prompt_format)
+    model = model or DEEP_SEEK_MODEL
+    if STREAM_RESPONSES:
+        return _ask_deep_seek_streaming(messages, on_field, model)
+
+    started = time.perf_counter()
+    with run_metrics.stage("ask_deep_seek"):
+        response = deep_seek_client.chat(
+            DEEP_SEEK_KEY,
+            DEEP_SEEK_API_HOST,
+            messages,
+            model=model,
+            response_format={"type": "json_object"},
+        )
+    run_metrics.record_response(response, time.perf_counter() - started)
 
     return response.choices[0].message.content
 
 
-def parse_invoice_from_pdf(file_path: str) -> InvoiceInfo:
+def _ask_deep_seek_streaming(messages, on_field=None, model: Optional[str] = None) -> str:
     """
-    从PDF文件解析发票信息，支持缓存机制
+    流式调用AI，边接收边解析
+
+    超过 INVOICE_DEADLINE 时取消生成：已经解析出字段的返回这些字段
+    （正在生成的货物列表只保留已完整的货物），之后由 _checked_result 校验并补全；
+    返回的结果在 warning 字段中标为不完整，只用于本次处理，不写入缓存和查询索引，
+    下次处理时重新识别。一个字段都没有收到时抛出 DeadlineExceeded
+    """
+    stream = JsonObjectStream()
+    started = time.perf_counter()
+    first_field = True
+
+    def on_delta(delta: str):
+        nonlocal first_field
+        for key, value in stream.feed(delta):
+            if first_field:
+                run_metrics.observe("first_field", time.perf_counter() - started)
+                first_field = False
+            if on_field is not None:
+                on_field(key, value)
+
+    with run_metrics.stage("ask_deep_seek"):
+        try:
+            response = deep_seek_client.chat_stream(
+                DEEP_SEEK_KEY,
+                DEEP_SEEK_API_HOST,
+                messages,
+                on_delta=on_delta,
+                deadline=_deadline(),
+                model=model or DEEP_SEEK_MODEL,
+                response_format={"type": "json_object"},
+            )
+        except DeadlineExceeded:
+            # 被取消的请求同样计入请求数和耗时（服务端不再返回用量）
+            run_metrics.record_response(None, time.perf_counter() - started)
+            partial = stream.partial()
+            if not partial:
+                raise
+            print(f"AI识别超过 {INVOICE_DEADLINE:g} 秒，已取消生成，保留已收到的 {len(partial)} 个字段")
+            partial["warning"] = f"AI识别超过 {INVOICE_DEADLINE:g} 秒被取消，结果不完整"
+            return json.dumps(partial, ensure_ascii=False)
+    run_metrics.record_response(response, time.perf_counter() - started)
+
+    return response.choices[0].message.content
+
+
+async def ask_deep_seek_async(content: str, prompt_format: Optional[str] = None):
+    """ask_deep_seek 的异步版本，与同步版本共用连接配置和限流额度"""
+    started = time.perf_counter()
+    with run_metrics.stage("ask_deep_seek"):
+        response = await deep_seek_client.achat(
+            DEEP_SEEK_KEY,
+            DEEP_SEEK_API_HOST,
+            _build_messages(content, prompt_format),
+            model=DEEP_SEEK_MODEL,
+            response_format={"type": "json_object"},
+        )
+    run_metrics.record_response(response, time.perf_counter() - started)
+
+    return response.choices[0].message.content
+
+
+def ask_deep_seek_followup(system_prompt: str, content: str):
+    """
+    发送纠错或JSON修复请求
+
+    只包含出错的字段和相关的票面文字（或格式有误的响应），不带完整的识别提示词
+    """
+    started = time.perf_counter()
+    with run_metrics.stage("ask_deep_seek"):
+        response = deep_seek_client.chat(
+            DEEP_SEEK_KEY,
+            DEEP_SEEK_API_HOST,
+            [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": content},
+            ],
+            model=DEEP_SEEK_MODEL,
+            response_format={"type": "json_object"},
+        )
+    run_metrics.record_response(response, time.perf_counter() - started)
+
+    return response.choices[0].message.content
+
+
+def _load_ai_json(response: Optional[str]) -> dict:
+    """
+    解析AI返回的JSON
+
+    格式有误时先在本地修复（去掉代码块标记和前后的说明文字），
+    仍然失败时把响应发回AI只修复格式；都失败时抛出原来的 JSONDecodeError
+    """
+    if response is None:
+        raise ValueError("AI响应为空")
+    try:
+        return json.loads(response)
+    except json.JSONDecodeError as error:
+        invoice_data = repair_json(response)
+        if invoice_data is None and MAX_CORRECTIONS > 0:
+            print(f"AI响应不是合法的JSON，请求修复格式: {error}")
+            try:
+                invoice_data = repair_json(ask_deep_seek_followup(JSON_REPAIR_PROMPT, response) or "")
+            except Exception as e:
+                print(f"修复JSON失败: {e}")
+        if invoice_data is None:
+            raise error
+        return invoice_data
+
+
+def _checked_result(file_path: str, rs: list, invoice_data: dict, prompt_format: Optional[str] = None) -> dict:
+    """
+    校验AI的识别结果，未通过时只针对出错的字段发送纠错请求（最多 MAX_CORRECTIONS 次）
+
+    纠错后问题没有减少时保留原结果；仍未通过校验时结果照常返回，
+    但在 warning 字段中注明问题：_save_invoices 不会缓存和索引这样的结果，
+    汇总表中该发票的备注列写明问题并标为红色
 
     Args:
-        file_path: PDF文件路径
+        prompt_format: 纠错请求中票面文字的格式，默认 PROMPT_FORMAT
+    """
+    file_name = os.path.basename(file_path)
+    prompt_format = prompt_format or PROMPT_FORMAT
+    problems = validate_invoice(invoice_data, rs)
+    for _ in range(MAX_CORRECTIONS):
+        if not problems:
+            break
+        fields, content = build_correction(
+            invoice_data, rs, problems, lambda boxes: encode_prompt_content(boxes, prompt_format)
+        )
+        print(f"识别结果未通过校验，重新识别 {', '.join(fields)} (文件: {file_name})")
+        try:
+            system_prompt = CORRECTION_PROMPT + INPUT_FORMAT_NOTES[prompt_format]
+            corrected = _load_ai_json(ask_deep_seek_followup(system_prompt, content))
+        except Exception as e:
+            print(f"纠错请求失败 (文件: {file_name}): {e}")
+            break
+        corrected = apply_correction(invoice_data, corrected, fields)
+        corrected_problems = validate_invoice(corrected, rs)
+        if len(corrected_problems) >= len(problems):
+            break
+        invoice_data, problems = corrected, corrected_problems
+
+    if problems:
+        message = "; ".join(p.message for p in problems)
+        print(f"识别结果校验未通过 (文件: {file_name}): {message}")
+        # 保留已有的问题（如超时未生成完），两者都写明
+        warning = invoice_data.get("warning")
+        invoice_data = dict(invoice_data, warning=f"{warning}; 校验未通过: {message}" if warning else f"校验未通过: {message}")
+    return invoice_data
+
+
+def invoice_from_dict(invoice_data: dict) -> InvoiceInfo:
+    """
+    从AI返回的JSON字典（或缓存记录）构建InvoiceInfo对象
+
+    Args:
+        invoice_data: 与 SYSTEM_PROMPT 中字段一致的字典
 
     Returns:
-        InvoiceInfo: 解析后的发票信息对象
+        InvoiceInfo: 发票信息对象
     """
-    # 生成缓存文件路径
+    # 创建InvoiceInfo对象
+    invoice_info = InvoiceInfo()
+
+    # 填充基本信息
+    invoice_info.invoice_number = invoice_data.get("invoice_number", "")
+    invoice_info.seller_tax_id = invoice_data.get("seller_tax_id", "")
+    invoice_info.seller_name = invoice_data.get("seller_name", "")
+    invoice_info.buyer_tax_id = invoice_data.get("buyer_tax_id", "")
+    invoice_info.buyer_name = invoice_data.get("buyer_name", "")
+    invoice_info.invoice_date = invoice_data.get("invoice_date", "")
+    invoice_info.tax_classification_code = invoice_data.get(
+        "tax_classification_code", ""
+    )
+    invoice_info.special_business_type = invoice_data.get(
+        "special_business_type", ""
+    )
+    invoice_info.invoice_source = invoice_data.get("invoice_source", "")
+    invoice_info.invoice_type = invoice_data.get("invoice_type", "")
+    invoice_info.invoice_status = invoice_data.get("invoice_status", "")
+    invoice_info.is_positive_invoice = invoice_data.get("is_positive_invoice", True)
+    invoice_info.invoice_risk_level = invoice_data.get("invoice_risk_level", "")
+    invoice_info.issuer = invoice_data.get("issuer", "")
+    invoice_info.remarks = invoice_data.get("remarks", "")
+    invoice_info.warning = invoice_data.get("warning", "")
+
+    # 填充货物信息
+    items_data = invoice_data.get("items", [])
+    for item_data in items_data:
+        item = InvoiceItem(
+            name=item_data.get("name", ""),
+            specification=item_data.get("specification", ""),
+            unit=item_data.get("unit", ""),
+            quantity=item_data.get("quantity", 0),
+            unit_price=item_data.get("unit_price", 0.0),
+            amount=item_data.get("amount", 0.0),
+            tax_rate=item_data.get("tax_rate", ""),
+            tax_amount=item_data.get("tax_amount", 0.0),
+            total_with_tax=item_data.get("total_with_tax", 0.0),
+        )
+        # 确保items不为None（通过__post_init__已经初始化）
+        assert invoice_info.items is not None
+        invoice_info.items.append(item)
+
+    return invoice_info
+
+
+def invoice_to_dict(invoice_info: InvoiceInfo) -> dict:
+    """将InvoiceInfo对象转换为可写入缓存的字典（字段与AI返回的JSON一致）"""
+    return asdict(invoice_info)
+
+
+def invoices_from_record(record: dict) -> List[InvoiceInfo]:
+    """
+    从缓存或任务日志中的记录构建一个PDF文件的全部发票
+
+    单张发票的PDF记录为该发票的字典（与旧版本缓存兼容），
+    包含多张发票的PDF记录为 {"invoices": [发票字典, ...]}
+    """
+    if isinstance(record.get("invoices"), list):
+        return [invoice_from_dict(invoice_data) for invoice_data in record["invoices"]]
+    return [invoice_from_dict(record)]
+
+
+def invoices_to_record(invoices: List[InvoiceInfo]) -> dict:
+    """invoices_from_record 的逆操作"""
+    if len(invoices) == 1:
+        return invoice_to_dict(invoices[0])
+    return {"invoices": [invoice_to_dict(invoice_info) for invoice_info in invoices]}
+
+
+def _read_legacy_cache(file_path: str) -> Optional[dict]:
+    """读取旧版本保存在PDF同目录下的 cache_res_{文件名}.json 缓存"""
     file_dir = os.path.dirname(file_path)
     file_name = os.path.basename(file_path)
     cache_file = os.path.join(file_dir, f"cache_res_{file_name}.json")
-    
-    # 检查缓存文件是否存在
-    if os.path.exists(cache_file):
-        print(f"发现缓存文件，直接读取: {cache_file}")
+    if not os.path.exists(cache_file):
+        return None
+    try:
+        with open(cache_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"读取旧缓存文件失败 (文件: {file_name}): {e}")
+        return None
+
+
+def _load_cached_invoices(file_path: str, cache_key: str) -> Optional[List[InvoiceInfo]]:
+    """查询缓存（含旧版本的同目录缓存文件），未命中或读取失败时返回 None"""
+    file_name = os.path.basename(file_path)
+
+    # 检查缓存是否存在
+    cached_data = invoice_cache.get(cache_key)
+    if cached_data is None:
+        # 兼容旧版本的同目录缓存文件，读取后迁移到全局缓存
+        cached_data = _read_legacy_cache(file_path)
+        if cached_data is not None:
+            try:
+                invoice_cache.put(cache_key, cached_data)
+            except Exception as e:
+                print(f"迁移旧缓存失败 (文件: {file_name}): {e}")
+
+    if cached_data is not None:
+        print(f"发现缓存，直接读取: {file_name}")
         try:
-            with open(cache_file, 'r', encoding='utf-8') as f:
-                cached_data = json.load(f)
-            
-            # 从缓存数据重建InvoiceInfo对象
-            invoice_info = InvoiceInfo()
-            invoice_info.invoice_number = cached_data.get("invoice_number", "")
-            invoice_info.seller_tax_id = cached_data.get("seller_tax_id", "")
-            invoice_info.seller_name = cached_data.get("seller_name", "")
-            invoice_info.buyer_tax_id = cached_data.get("buyer_tax_id", "")
-            invoice_info.buyer_name = cached_data.get("buyer_name", "")
-            invoice_info.invoice_date = cached_data.get("invoice_date", "")
-            invoice_info.tax_classification_code = cached_data.get("tax_classification_code", "")
-            invoice_info.special_business_type = cached_data.get("special_business_type", "")
-            invoice_info.invoice_source = cached_data.get("invoice_source", "")
-            invoice_info.invoice_type = cached_data.get("invoice_type", "")
-            invoice_info.invoice_status = cached_data.get("invoice_status", "")
-            invoice_info.is_positive_invoice = cached_data.get("is_positive_invoice", True)
-            invoice_info.invoice_risk_level = cached_data.get("invoice_risk_level", "")
-            invoice_info.issuer = cached_data.get("issuer", "")
-            invoice_info.remarks = cached_data.get("remarks", "")
-            
-            # 重建货物信息
-            items_data = cached_data.get("items", [])
-            for item_data in items_data:
-                item = InvoiceItem(
-                    name=item_data.get("name", ""),
-                    specification=item_data.get("specification", ""),
-                    unit=item_data.get("unit", ""),
-                    quantity=item_data.get("quantity", 0),
-                    unit_price=item_data.get("unit_price", 0.0),
-                    amount=item_data.get("amount", 0.0),
-                    tax_rate=item_data.get("tax_rate", ""),
-                    tax_amount=item_data.get("tax_amount", 0.0),
-                    total_with_tax=item_data.get("total_with_tax", 0.0),
-                )
-                assert invoice_info.items is not None
-                invoice_info.items.append(item)
-            
-            return invoice_info
-            
+            invoices = invoices_from_record(cached_data)
         except Exception as e:
-            print(f"读取缓存文件失败 (文件: {os.path.basename(file_path)}): {e}，将重新解析PDF")
-    
-    # 如果没有缓存或缓存读取失败，则解析PDF
-    print(f"开始解析PDF文件: {file_path}")
-    
-    # 读取PDF文件
-    rs, simple = pdf_read_text(file_path)
+            print(f"读取缓存失败 (文件: {file_name}): {e}，将重新解析PDF")
+        else:
+            _index_invoices([(cache_key, file_path, invoices)])
+            return invoices
+    return None
+
+
+def _save_invoices(file_path: str, cache_key: str, invoices_data: List[dict]) -> List[InvoiceInfo]:
+    """
+    将一个PDF文件的识别结果转换为InvoiceInfo对象并写入缓存
 
-    # 将坐标文本数据转换为字符串格式
-    content = str(rs)
+    有发票带 warning（如校验未通过）时只返回本次的结果，不写入缓存和查询索引，
+    下次处理该文件时重新识别
+    """
+    file_name = os.path.basename(file_path)
+    invoices = [invoice_from_dict(invoice_data) for invoice_data in invoices_data]
 
-    # 调用AI解析发票信息
-    response = ask_deep_seek(content)
+    if any(invoice_info.warning for invoice_info in invoices):
+        print(f"识别结果有问题，不写入缓存，下次处理时重新识别: {file_name}")
+        return invoices
 
-    # 解析JSON响应
+    # 保存缓存
     try:
-        if response is None:
-            raise ValueError("AI响应为空")
-        invoice_data = json.loads(response)
-
-        # 创建InvoiceInfo对象
-        invoice_info = InvoiceInfo()
-
-        # 填充基本信息
-        invoice_info.invoice_number = invoice_data.get("invoice_number", "")
-        invoice_info.seller_tax_id = invoice_data.get("seller_tax_id", "")
-        invoice_info.seller_name = invoice_data.get("seller_name", "")
-        invoice_info.buyer_tax_id = invoice_data.get("buyer_tax_id", "")
-        invoice_info.buyer_name = invoice_data.get("buyer_name", "")
-        invoice_info.invoice_date = invoice_data.get("invoice_date", "")
-        invoice_info.tax_classification_code = invoice_data.get(
-            "tax_classification_code", ""
-        )
-        invoice_info.special_business_type = invoice_data.get(
-            "special_business_type", ""
+        invoice_cache.put(cache_key, invoices_to_record(invoices))
+        print(f"缓存已保存: {file_name}")
+    except Exception as e:
+        print(f"保存缓存失败 (文件: {file_name}): {e}")
+
+    _index_invoices([(cache_key, file_path, invoices)])
+    return invoices
+
+
+def _index_invoices(entries: List[Tuple[str, str, List[InvoiceInfo]]]):
+    """
+    将 [(内容哈希, PDF路径, 发票列表), ...] 写入查询索引，写入失败不影响识别结果
+
+    有发票带 warning 的文件不写入（与缓存相同），查重时不会复用有问题的结果
+    """
+    entries = [
+        (cache_key, file_path, invoices) for cache_key, file_path, invoices in entries
+        if not any(invoice_info.warning for invoice_info in invoices)
+    ]
+    if invoice_index is None or not entries:
+        return
+    try:
+        invoice_index.add_many(
+            (cache_key, os.path.abspath(file_path), [invoice_to_dict(invoice_info) for invoice_info in invoices])
+            for cache_key, file_path, invoices in entries
         )
-        invoice_info.invoice_source = invoice_data.get("invoice_source", "")
-        invoice_info.invoice_type = invoice_data.get("invoice_type", "")
-        invoice_info.invoice_status = invoice_data.get("invoice_status", "")
-        invoice_info.is_positive_invoice = invoice_data.get("is_positive_invoice", True)
-        invoice_info.invoice_risk_level = invoice_data.get("invoice_risk_level", "")
-        invoice_info.issuer = invoice_data.get("issuer", "")
-        invoice_info.remarks = invoice_data.get("remarks", "")
-
-        # 填充货物信息
-        items_data = invoice_data.get("items", [])
-        for item_data in items_data:
-            item = InvoiceItem(
-                name=item_data.get("name", ""),
-                specification=item_data.get("specification", ""),
-                unit=item_data.get("unit", ""),
-                quantity=item_data.get("quantity", 0),
-                unit_price=item_data.get("unit_price", 0.0),
-                amount=item_data.get("amount", 0.0),
-                tax_rate=item_data.get("tax_rate", ""),
-                tax_amount=item_data.get("tax_amount", 0.0),
-                total_with_tax=item_data.get("total_with_tax", 0.0),
-            )
-            # 确保items不为None（通过__post_init__已经初始化）
-            assert invoice_info.items is not None
-            invoice_info.items.append(item)
+    except Exception as e:
+        print(f"写入查询索引失败: {e}")
+
+
+_page_pool: Optional[ThreadPoolExecutor] = None
+_page_pool_lock = threading.Lock()
 
-        # 保存缓存文件
+# 正在调用AI识别的发票号码：{发票号码: 识别完成后设置结果的 Future}
+_inflight: Dict[str, Future] = {}
+_inflight_lock = threading.Lock()
+
+
+def _page_executor() -> ThreadPoolExecutor:
+    """多发票PDF中各张发票共用的识别线程池（首次使用时创建）"""
+    global _page_pool
+    with _page_pool_lock:
+        if _page_pool is None:
+            _page_pool = ThreadPoolExecutor(max_workers=PAGE_WORKERS, thread_name_prefix="invoice-page")
+        return _page_pool
+
+
+def _ask_segment(file_path: str, rs: list, content: str, route: Optional[Route] = None) -> dict:
+    """
+    调用AI识别PDF中的一张发票并校验结果，用量记到所属的文件（可在识别线程池中运行）
+
+    Args:
+        route: 路由选择的路径（content 已按该路径的提示词格式生成），
+            识别失败时按 model_router.escalate 升级；None 表示不使用路由
+    """
+    file_name = os.path.basename(file_path)
+
+    def on_field(key, value):
+        # 流式接收时在日志中提示进度：发票号码先于货物列表到达
+        if key == "invoice_number" and value:
+            print(f"已识别发票号码 {value}，继续接收货物明细 (文件: {file_name})")
+
+    with run_metrics.track(file_path):
+        if route is None:
+            return _checked_result(file_path, rs, _load_ai_json(ask_deep_seek(content, on_field=on_field)))
+
+        while True:
+            with run_metrics.route(route.name, route.price) as attempt:
+                try:
+                    response = ask_deep_seek(content, route.prompt_format, on_field, route.model)
+                    return _checked_result(file_path, rs, _load_ai_json(response), route.prompt_format)
+                except Exception as e:
+                    escalated = model_router.escalate(route) if model_router is not None else None
+                    if escalated is None:
+                        raise
+                    attempt["ok"] = False
+                    print(f"{route.name} 路径识别失败，改用 {escalated.name} 路径 (文件: {file_name}): {e}")
+            route = escalated
+            content = encode_prompt_content(rs, route.prompt_format)
+
+
+def _ask_segment_shared(file_path: str, rs: list, content: str, route: Optional[Route] = None) -> Tuple[dict, bool]:
+    """
+    _ask_segment 的查重版本：同一发票号码正在由其他文件调用AI识别时（同一批中的重复发票），
+    等待其结果而不再重复调用AI
+
+    只有正在调用AI的线程登记号码，等待的一方不会被别人等待，因此不会互相等待。
+    对方识别失败、结果带 warning 或销方识别号不在本票面上时照常调用AI。
+
+    Returns:
+        (识别结果, 是否使用了其他文件的结果)
+    """
+    number = page_invoice_number(rs) if REUSE_INDEXED_INVOICES else None
+    if number is None:
+        return _ask_segment(file_path, rs, content, route), False
+
+    with _inflight_lock:
+        owner = _inflight.get(number)
+        if owner is None:
+            _inflight[number] = future = Future()
+    if owner is not None:
+        invoice_data = owner.result()
+        if invoice_data is not None and _seller_on_page(invoice_data.get("seller_tax_id"), rs):
+            print(f"发票号码 {number} 正在由其他文件识别，使用其结果: {os.path.basename(file_path)}")
+            return copy.deepcopy(invoice_data), True
+        return _ask_segment(file_path, rs, content, route), False
+
+    invoice_data = None
+    try:
+        invoice_data = _ask_segment(file_path, rs, content, route)
+        return invoice_data, False
+    finally:
+        # 之后的文件通过 invoice_index 查到这张发票
+        with _inflight_lock:
+            del _inflight[number]
+        future.set_result(None if invoice_data is None or invoice_data.get("warning") else invoice_data)
+
+
+def _local_result(file_path: str, rs: list, decision: Optional[RouteDecision]) -> Optional[dict]:
+    """本地识别一张发票；使用路由时只识别路由到 local 路径的发票，并记入该路径的统计"""
+    if decision is None:
+        if not LOCAL_EXTRACTION:
+            return None
+        with run_metrics.stage("local_extract", [file_path]):
+            return extract_invoice_locally(rs)
+
+    if decision.route != LOCAL_ROUTE:
+        return None
+    with run_metrics.stage("local_extract", [file_path]), run_metrics.route(LOCAL_ROUTE) as attempt:
+        invoice_data = extract_invoice_locally(rs)
+        attempt["ok"] = invoice_data is not None
+    return invoice_data
+
+
+def _indexed_result(file_path: str, rs: list) -> Optional[dict]:
+    """票面上的发票号码已在查询索引中（且索引中的销方识别号出现在票面上）时返回索引中的结果"""
+    if invoice_index is None or not REUSE_INDEXED_INVOICES:
+        return None
+    number = page_invoice_number(rs)
+    if number is None:
+        return None
+    with run_metrics.stage("index_lookup", [file_path]):
         try:
-            cache_data = {
-                "invoice_number": invoice_info.invoice_number,
-                "seller_tax_id": invoice_info.seller_tax_id,
-                "seller_name": invoice_info.seller_name,
-                "buyer_tax_id": invoice_info.buyer_tax_id,
-                "buyer_name": invoice_info.buyer_name,
-                "invoice_date": invoice_info.invoice_date,
-                "tax_classification_code": invoice_info.tax_classification_code,
-                "special_business_type": invoice_info.special_business_type,
-                "invoice_source": invoice_info.invoice_source,
-                "invoice_type": invoice_info.invoice_type,
-                "invoice_status": invoice_info.invoice_status,
-                "is_positive_invoice": invoice_info.is_positive_invoice,
-                "invoice_risk_level": invoice_info.invoice_risk_level,
-                "issuer": invoice_info.issuer,
-                "remarks": invoice_info.remarks,
-                "items": [
-                    {
-                        "name": item.name,
-                        "specification": item.specification,
-                        "unit": item.unit,
-                        "quantity": item.quantity,
-                        "unit_price": item.unit_price,
-                        "amount": item.amount,
-                        "tax_rate": item.tax_rate,
-                        "tax_amount": item.tax_amount,
-                        "total_with_tax": item.total_with_tax,
-                    }
-                    for item in (invoice_info.items or [])
-                ]
-            }
-            
-            with open(cache_file, 'w', encoding='utf-8') as f:
-                json.dump(cache_data, f, ensure_ascii=False, indent=2)
-            print(f"缓存文件已保存: {cache_file}")
-            
+            matches = invoice_index.query(invoice_number=number)
         except Exception as e:
-            print(f"保存缓存文件失败 (文件: {os.path.basename(file_path)}): {e}")
+            print(f"查询索引失败: {e}")
+            return None
+    for match in matches:
+        if match.data.get("warning"):
+            continue
+        if _seller_on_page(match.seller_tax_id, rs):
+            print(
+                f"发票号码 {number} 已识别过（{os.path.basename(match.file_path)}），"
+                f"跳过AI调用: {os.path.basename(file_path)}"
+            )
+            return match.data
+    return None
+
+
+def _seller_on_page(seller_tax_id: Optional[str], rs: list) -> bool:
+    """销方识别号出现在票面文字中（没有识别号时不核对）"""
+    if not seller_tax_id:
+        return True
+    return seller_tax_id.upper() in "".join(box[4] for box in rs).replace(" ", "").upper()
+
+
+def _segment_contents(file_path: str, segments: List[list], batch: bool = False):
+    """
+    对PDF中的每张发票先查询索引中是否已识别过，再尝试本地识别
+
+    同时按结果记录文件的状态：需要AI识别时为 ai，全部来自索引时为 duplicate，否则为 local
+
+    Args:
+        batch: 为 True 时AI内容统一按 PROMPT_FORMAT 生成（批量识别共用一份提示词，不按路径区分）
+
+    Returns:
+        (results, contents, routes): results 为每张发票的识别结果（需要AI识别的为 None），
+        contents 为 {发票序号: 发送给AI的内容}，routes 为 {发票序号: 路由选择的AI路径}（未使用路由时为空）
+    """
+    file_name = os.path.basename(file_path)
+    results: List[Optional[dict]] = [None] * len(segments)
+    contents: Dict[int, str] = {}
+    routes: Dict[int, Route] = {}
+    reused = 0
+    for index, rs in enumerate(segments):
+        # 以不同文件名重复出现的发票直接使用已有的识别结果
+        invoice_data = _indexed_result(file_path, rs)
+        if invoice_data is not None:
+            results[index] = invoice_data
+            reused += 1
+            continue
+
+        # 标准版式的电子发票直接按坐标识别，无法确认结果时再调用AI
+        decision = model_router.decide(rs) if model_router is not None else None
+        invoice_data = _local_result(file_path, rs, decision)
+        if invoice_data is not None:
+            results[index] = invoice_data
+        elif decision is not None and not batch:
+            routes[index] = model_router.ai_route(decision.score)
+            contents[index] = encode_prompt_content(rs, routes[index].prompt_format)
+        else:
+            contents[index] = encode_prompt_content(rs)
+
+    if len(segments) > 1:
+        print(f"PDF包含 {len(segments)} 张发票: {file_name}")
+    if contents:
+        run_metrics.set_status("ai", [file_path])
+    elif reused == len(segments):
+        run_metrics.set_status("duplicate", [file_path])
+    else:
+        print(f"按标准版式本地识别成功，跳过AI调用: {file_name}")
+        run_metrics.set_status("local", [file_path])
+    return results, contents, routes
 
-        return invoice_info
+
+def _pdf_segments(file_path: str, pages: Optional[List[list]]) -> List[list]:
+    """读取PDF（已读取时直接使用 pages）并按发票拆分"""
+    if pages is None:
+        with run_metrics.stage("pdf_read", [file_path]):
+            pages = pdf_read_pages(file_path)
+    # 没有文字的PDF仍按一张空发票交给AI，与只读取第一页时的行为一致
+    return invoice_segments(pages) or [[]]
+
+
+def parse_invoices_from_pdf(
+        file_path: str,
+        cache_key: Optional[str] = None,
+        pages: Optional[List[list]] = None,
+) -> List[InvoiceInfo]:
+    """
+    从PDF文件解析全部发票，支持缓存机制
+
+    缓存以PDF文件内容的哈希为键，保存在 invoice_cache 指定的全局存储中，
+    因此重命名或复制的发票不会重复调用AI接口。
+
+    PDF的每一页都会读取：货物清单接续到后续页面时合并为同一张发票，
+    一页一张发票的合订PDF拆分为多张发票（见 invoice_pages.py），
+    多张发票的AI识别并行进行。
+
+    Args:
+        file_path: PDF文件路径
+        cache_key: 已计算好的文件内容哈希（批量处理时传入，避免重复计算）
+        pages: 已读取的各页文字坐标（在进程池中读取PDF时传入），None 表示在当前线程读取
+
+    Returns:
+        List[InvoiceInfo]: 按页面顺序排列的发票信息
+    """
+    file_name = os.path.basename(file_path)
+    if cache_key is None:
+        cache_key = file_digest(file_path)
+
+    with run_metrics.stage("cache_lookup", [file_path]):
+        invoices = _load_cached_invoices(file_path, cache_key)
+    if invoices is not None:
+        run_metrics.set_status("cached", [file_path])
+        return invoices
+
+    # 如果没有缓存或缓存读取失败，则解析PDF
+    print(f"开始解析PDF文件: {file_path}")
+
+    segments = _pdf_segments(file_path, pages)
+    results, contents, routes = _segment_contents(file_path, segments)
+
+    # 调用AI解析发票信息并校验结果；多张发票时在识别线程池中并行
+    try:
+        shared = 0
+        if len(contents) == 1:
+            for index, content in contents.items():
+                results[index], reused = _ask_segment_shared(file_path, segments[index], content, routes.get(index))
+                shared += reused
+        else:
+            futures = {
+                index: _page_executor().submit(
+                    _ask_segment_shared, file_path, segments[index], content, routes.get(index)
+                )
+                for index, content in contents.items()
+            }
+            for index, future in futures.items():
+                results[index], reused = future.result()
+                shared += reused
+        if contents and shared == len(contents) == len(segments):
+            run_metrics.set_status("duplicate", [file_path])
+
+        return _save_invoices(file_path, cache_key, results)
 
     except json.JSONDecodeError as e:
-        raise ValueError(f"解析AI响应失败 (文件: {os.path.basename(file_path)}): {e}")
+        raise ValueError(f"解析AI响应失败 (文件: {file_name}): {e}")
     except Exception as e:
-        raise Exception(f"处理发票信息时出错 (文件: {os.path.basename(file_path)}): {e}")
+        raise Exception(f"处理发票信息时出错 (文件: {file_name}): {e}")
 
 
-def pdf_read_text(path):
+def parse_invoice_from_pdf(
+        file_path: str,
+        cache_key: Optional[str] = None,
+        pages: Optional[List[list]] = None,
+) -> InvoiceInfo:
+    """
+    从PDF文件解析发票信息，支持缓存机制
+
+    PDF包含多张发票时只返回第一张，需要全部发票时使用 parse_invoices_from_pdf。
+
+    Returns:
+        InvoiceInfo: 解析后的发票信息对象
+    """
+    return parse_invoices_from_pdf(file_path, cache_key, pages)[0]
+
+
+def ask_deep_seek_batch(contents: Dict[str, str]) -> Dict[str, dict]:
+    """
+    在一次请求中识别多张发票，共用一份 SYSTEM_PROMPT
+
+    Args:
+        contents: {发票编号: 坐标文本}
+
+    Returns:
+        {发票编号: 识别结果字典}，只包含通过校验的发票；
+        整个响应无法解析时抛出 ValueError
+    """
+    parts = [f"发票 id={invoice_id}:\n{content}" for invoice_id, content in contents.items()]
+    messages = [
+        {"role": "system", "content": _system_prompt(batch=True)},
+        {"role": "user", "content": "\n\n".join(parts)},
+    ]
+    started = time.perf_counter()
+    with run_metrics.stage("ask_deep_seek"):
+        if STREAM_RESPONSES:
+            # 截止时间按发票张数放宽；超时抛出 DeadlineExceeded，由 _extract_batch 拆分重试
+            response = deep_seek_client.chat_stream(
+                DEEP_SEEK_KEY,
+                DEEP_SEEK_API_HOST,
+                messages,
+                deadline=_deadline(len(contents)),
+                model=DEEP_SEEK_MODEL,
+                response_format={"type": "json_object"},
+                max_tokens=BATCH_MAX_TOKENS,
+            )
+        else:
+            response = deep_seek_client.chat(
+                DEEP_SEEK_KEY,
+                DEEP_SEEK_API_HOST,
+                messages,
+                model=DEEP_SEEK_MODEL,
+                response_format={"type": "json_object"},
+                max_tokens=BATCH_MAX_TOKENS,
+            )
+    run_metrics.record_response(response, time.perf_counter() - started)
+    choice = response.choices[0]
+    if choice.finish_reason == "length":
+        raise ValueError("批量识别的响应被截断")
+    if not choice.message.content:
+        raise ValueError("AI响应为空")
+
+    payload = json.loads(choice.message.content)
+    invoices = payload.get("invoices") if isinstance(payload, dict) else None
+    if not isinstance(invoices, list):
+        raise ValueError("批量识别的响应缺少 invoices 数组")
+
+    results: Dict[str, dict] = {}
+    duplicated = set()
+    for invoice_data in invoices:
+        if not isinstance(invoice_data, dict):
+            continue
+        invoice_id = str(invoice_data.pop("id", ""))
+        if invoice_id not in contents or not isinstance(invoice_data.get("items", []), list):
+            continue
+        if invoice_id in results:
+            duplicated.add(invoice_id)
+        results[invoice_id] = invoice_data
+    # 同一编号出现多次时无法判断哪个结果正确，交给后续重试
+    for invoice_id in duplicated:
+        del results[invoice_id]
+    return results
+
+
+def _extract_batch(contents: Dict[str, str]) -> Dict[str, dict]:
+    """
+    批量识别多张发票，失败的部分拆分后重试
+
+    整批响应无法解析时对半拆分重试；响应中缺失或格式错误的发票单独重新分组；
+    拆到只剩一张时改用单张识别（ask_deep_seek）。
+
+    Returns:
+        {发票编号: 识别结果字典}，单张识别也失败的发票不包含在结果中
+    """
+    if len(contents) == 1:
+        invoice_id, content = next(iter(contents.items()))
+        try:
+            return {invoice_id: _load_ai_json(ask_deep_seek(content))}
+        except Exception as e:
+            print(f"单张识别失败 (编号: {invoice_id}): {e}")
+            return {}
+
+    try:
+        results = ask_deep_seek_batch(contents)
+    except Exception as e:
+        print(f"批量识别失败（{len(contents)} 张），拆分后重试: {e}")
+        results = {}
+
+    missing = {i: content for i, content in contents.items() if i not in results}
+    if not missing:
+        return results
+    if len(missing) < len(contents):
+        print(f"批量识别中有 {len(missing)} 张发票结果无效，重新识别")
+        results.update(_extract_batch(missing))
+    else:
+        ids = list(missing)
+        half = len(ids) // 2
+        for group in (ids[:half], ids[half:]):
+            results.update(_extract_batch({i: missing[i] for i in group}))
+    return results
+
+
+def parse_invoices_batched(
+        file_paths: List[str],
+        cache_keys: List[Optional[str]],
+        pages_list: Optional[List[Optional[List[list]]]] = None,
+):
+    """
+    批量解析多个PDF文件：缓存命中和本地识别成功的直接返回，
+    其余发票合并为一次AI请求（见 ask_deep_seek_batch）
+
+    包含多张发票的PDF中，每张发票在批量请求中各占一个编号。
+
+    Args:
+        file_paths: PDF文件路径列表
+        cache_keys: 对应的文件内容哈希列表（None 表示需要重新计算）
+        pages_list: 对应的已读取各页文字坐标列表（None 表示在当前线程读取）
+
+    Returns:
+        [(invoices, error), ...]，与 file_paths 一一对应
+    """
+    results: List[Tuple[Optional[List[InvoiceInfo]], Optional[Exception]]] = [(None, None)] * len(file_paths)
+    contents: Dict[str, str] = {}
+    keys: Dict[int, str] = {}
+    partial: Dict[int, List[Optional[dict]]] = {}
+    segments_of: Dict[int, List[list]] = {}
+
+    for index, file_path in enumerate(file_paths):
+        try:
+            cache_key = cache_keys[index] or file_digest(file_path)
+            with run_metrics.stage("cache_lookup", [file_path]):
+                invoices = _load_cached_invoices(file_path, cache_key)
+            if invoices is not None:
+                run_metrics.set_status("cached", [file_path])
+                results[index] = (invoices, None)
+                continue
+
+            print(f"开始解析PDF文件: {file_path}")
+            segments = _pdf_segments(file_path, pages_list[index] if pages_list else None)
+            invoices_data, segment_contents, _ = _segment_contents(file_path, segments, batch=True)
+            if not segment_contents:
+                results[index] = (_save_invoices(file_path, cache_key, invoices_data), None)
+                continue
+
+            for segment, content in segment_contents.items():
+                contents[f"{index}.{segment}"] = content
+            keys[index] = cache_key
+            partial[index] = invoices_data
+            segments_of[index] = segments
+        except Exception as e:
+            results[index] = (None, e)
+
+    if contents:
+        # 批量请求的等待时间和token用量归到同一批的所有文件
+        with run_metrics.track(*(file_paths[index] for index in partial)):
+            extracted = _extract_batch(contents)
+        for invoice_id, invoice_data in extracted.items():
+            index, segment = map(int, invoice_id.split("."))
+            with run_metrics.track(file_paths[index]):
+                partial[index][segment] = _checked_result(
+                    file_paths[index], segments_of[index][segment], invoice_data
+                )
+        for index, invoices_data in partial.items():
+            file_name = os.path.basename(file_paths[index])
+            if any(invoice_data is None for invoice_data in invoices_data):
+                results[index] = (None, ValueError(f"解析AI响应失败 (文件: {file_name})"))
+                continue
+            try:
+                invoices = _save_invoices(file_paths[index], keys[index], invoices_data)
+                results[index] = (invoices, None)
+            except Exception as e:
+                results[index] = (None, Exception(f"处理发票信息时出错 (文件: {file_name}): {e}"))
+
+    return results
+
+
+def _page_boxes(page) -> list:
+    """页面上各个词的文字坐标 [[left, top, right, bottom, text], ...]"""
     rs = []
+    for line in page.extract_words():
+        x0 = line.get("x0")
+        top = line.get("top")
+        x1 = line.get("x1")
+        bottom = line.get("bottom")
+        text = line.get("text")
+
+        # 检查所有必需的值是否存在
+        if x0 is not None and top is not None and x1 is not None and bottom is not None and text is not None:
+            item = [
+                int(x0),
+                int(top),
+                int(x1),
+                int(bottom),
+                text,
+            ]
+            rs.append(item)
+    return rs
+
+
+def pdf_read_pages(path) -> List[list]:
+    """
+    读取PDF每一页的文字坐标
+
+    Returns:
+        每页一个 [[left, top, right, bottom, text], ...]，坐标相对于所在页面
+    """
+    with pdfplumber.open(path) as pdf:
+        return [_page_boxes(page) for page in pdf.pages]
+
+
+def pdf_read_text(path):
+    """
+    读取PDF第一页的文字坐标（识别流程读取全部页面，见 pdf_read_pages）
+
+    Returns:
+        (rs, simple): rs 为 [[left, top, right, bottom, text], ...]；
+        simple 为去掉空格后的文本行列表
+    """
     with pdfplumber.open(path) as pdf:
         page = pdf.pages[0]
-        lines = page.extract_words()
+        rs = _page_boxes(page)
         simple = page.extract_text_simple()
         simple = simple.replace(" ", "")
         simple = simple.split("\n")
 
-        for line in lines:
-            x0 = line.get("x0")
-            top = line.get("top")
-            x1 = line.get("x1")
-            bottom = line.get("bottom")
-            text = line.get("text")
-            
-            # 检查所有必需的值是否存在
-            if x0 is not None and top is not None and x1 is not None and bottom is not None and text is not None:
-                item = [
-                    int(x0),
-                    int(top),
-                    int(x1),
-                    int(bottom),
-                    text,
-                ]
-                rs.append(item)
-
     return rs, simple
 
 
-def process_directory_to_xlsx(
-        directory_path: str, output_file: str = "invoice_data.xlsx"
+def _parse_invoice_safely(file_path: str, cache_key: Optional[str] = None, pages: Optional[List[list]] = None):
+    """在工作线程中解析单个PDF，异常作为返回值带回，避免中断整个批次"""
+    with run_metrics.track(file_path):
+        try:
+            return parse_invoices_from_pdf(file_path, cache_key, pages), None
+        except Exception as e:
+            run_metrics.set_status("error")
+            return None, e
+
+
+def _digest_safely(file_path: str) -> Optional[str]:
+    """计算文件哈希，文件无法读取时返回 None（由后续解析步骤报告错误）"""
+    try:
+        return file_digest(file_path)
+    except OSError:
+        return None
+
+
+def _chunked(iterable, size: int, first_size: Optional[int] = None):
+    """按 size 个一组产出；指定 first_size 时第一组只取 first_size 个，之后每组加倍直到 size"""
+    limit = min(first_size or size, size)
+    chunk = []
+    for value in iterable:
+        chunk.append(value)
+        if len(chunk) >= limit:
+            yield chunk
+            chunk = []
+            limit = min(limit * 2, size)
+    if chunk:
+        yield chunk
+
+
+def _cached_result(file_path: str, cached_data: dict) -> Future:
+    """将批量查询命中的缓存记录包装成已完成的Future"""
+    future = Future()
+    try:
+        print(f"发现缓存，直接读取: {os.path.basename(file_path)}")
+        future.set_result((invoices_from_record(cached_data), None))
+        run_metrics.set_status("cached", [file_path])
+    except Exception as e:
+        future.set_result((None, e))
+        run_metrics.set_status("error", [file_path])
+    return future
+
+
+def _parse_invoice_into(future: Future, file_path: str, cache_key: Optional[str], pages: Optional[List[list]]):
+    """在工作线程中解析单个PDF，并把结果交给对应的Future"""
+    future.set_result(_parse_invoice_safely(file_path, cache_key, pages))
+
+
+def _parse_invoice_batch_safely(batch, pages_list: Optional[List[Optional[List[list]]]] = None):
+    """在工作线程中批量解析，并把结果分发给每个文件对应的Future"""
+    try:
+        results = parse_invoices_batched(
+            [path for path, _, _ in batch], [key for _, key, _ in batch], pages_list
+        )
+    except Exception as e:
+        results = [(None, e)] * len(batch)
+    for (path, _, future), result in zip(batch, results):
+        if result[1] is not None:
+            run_metrics.set_status("error", [path])
+        future.set_result(result)
+
+
+def _read_pdf_timed(file_path: str):
+    """在子进程中读取PDF各页的文字坐标，同时返回耗时（子进程中的计时无法直接记入run_metrics）"""
+    started = time.perf_counter()
+    pages = pdf_read_pages(file_path)
+    return pages, time.perf_counter() - started
+
+
+def _read_pdfs_then(process_pool: ProcessPoolExecutor, file_paths: List[str], callback):
+    """
+    在进程池中并行读取多个PDF，全部完成后调用 callback(pages_list)
+
+    pages_list 与 file_paths 一一对应；读取失败的文件对应 None，
+    由解析线程重新读取并按原有方式报告错误。
+    """
+    pages_list: List[Optional[List[list]]] = [None] * len(file_paths)
+    remaining = [len(file_paths)]
+    lock = threading.Lock()
+
+    def on_done(index, future):
+        try:
+            pages, seconds = future.result()
+            pages_list[index] = pages
+            run_metrics.observe("pdf_read", seconds, [file_paths[index]])
+        except Exception:
+            pass
+        with lock:
+            remaining[0] -= 1
+            finished = remaining[0] == 0
+        if finished:
+            callback(pages_list)
+
+    for index, file_path in enumerate(file_paths):
+        future = process_pool.submit(_read_pdf_timed, file_path)
+        future.add_done_callback(lambda f, i=index: on_done(i, f))
+
+
+def iter_parse_invoices(
+        pdf_paths,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        parse_processes: int = DEFAULT_PARSE_PROCESSES,
+        digests: Optional[Dict[str, str]] = None,
 ):
     """
-    处理目录中所有PDF文件并生成XLSX表格
+    并发解析多个PDF文件，并按输入顺序逐个返回结果
+
+    同一时间最多有 max_workers 个文件在解析（PDF读取与AI调用重叠进行），
+    但结果始终按 pdf_paths 的顺序产出，保证写入表格的行顺序稳定。
+    文件按批计算内容哈希并批量查询缓存，命中的文件直接返回缓存结果，
+    不占用工作线程。
+
+    parse_processes 大于0时组成两级流水线：未命中缓存的PDF先在进程池中
+    并行读取文字坐标，读取完成后再交给解析线程识别和调用AI，
+    PDF读取随CPU核数扩展，不再排在网络等待之后。
 
     Args:
-        directory_path: PDF文件所在目录路径
-        output_file: 输出的XLSX文件名
+        pdf_paths: PDF文件路径的可迭代对象
+        max_workers: 并发解析的文件数量（批量模式下为并发的批次数），1 表示逐个处理
+        batch_size: 每次AI请求包含的发票数量，大于1时多张发票共用一份提示词
+        parse_processes: 读取PDF的进程数，0 表示在解析线程中读取
+        digests: 已计算好的文件内容哈希 {路径: 哈希}（如增量处理的清单检查时算出的），
+            其中的文件不再重新计算
+
+    Yields:
+        (pdf_path, invoices, error): invoices 为该文件中的发票列表（通常只有一张），
+        成功时 error 为 None，失败时 invoices 为 None
     """
-    # 定义表头（根据图片中的27个字段）
-    headers = [
-        "序号",
-        "发票代码",
-        "发票号码",
-        "数电发票号码",
-        "销方识别号",
-        "销方名称",
-        "购方识别号",
-        "购买方名称",
-        "开票日期",
-        "税收分类编码",
-        "特定业务类型",
-        "货物或应税劳务名称",
-        "规格型号",
-        "单位",
-        "数量",
-        "单价",
-        "金额",
-        "税率",
-        "税额",
-        "价税合计",
-        "发票来源",
-        "发票票种",
-        "发票状态",
-        "是否正数发票",
-        "发票风险等级",
-        "开票人",
-        "备注",
-    ]
+    max_workers = max(1, int(max_workers))
+    batch_size = max(1, int(batch_size))
+    parse_processes = max(0, int(parse_processes))
+    window = (max_workers * batch_size + parse_processes) * 2
+    process_pool = ProcessPoolExecutor(max_workers=parse_processes) if parse_processes else None
+    with process_pool or nullcontext(), ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        batch = []
 
-    # 创建工作簿和工作表
-    wb = Workbook()
-    ws = wb.active
-    if ws is None:
-        ws = wb.create_sheet("发票数据")
-    ws.title = "发票数据"
-
-    # 设置表头样式
-    header_font = Font(bold=True, color="FFFFFF")
-    header_fill = PatternFill(
-        start_color="808080", end_color="808080", fill_type="solid"
-    )
-    header_alignment = Alignment(horizontal="center", vertical="center")
+        def submit_one(pdf_path, key):
+            if process_pool is None:
+                return executor.submit(_parse_invoice_safely, pdf_path, key)
+            future = Future()
+            _read_pdfs_then(
+                process_pool,
+                [pdf_path],
+                lambda pages_list: executor.submit(_parse_invoice_into, future, pdf_path, key, pages_list[0]),
+            )
+            return future
 
-    # 写入表头
-    for col, header in enumerate(headers, 1):
-        cell = ws.cell(row=1, column=col, value=header)
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = header_alignment
+        def flush_batch():
+            if not batch:
+                return
+            jobs = list(batch)
+            batch.clear()
+            if process_pool is None:
+                executor.submit(_parse_invoice_batch_safely, jobs)
+            else:
+                _read_pdfs_then(
+                    process_pool,
+                    [path for path, _, _ in jobs],
+                    lambda pages_list: executor.submit(_parse_invoice_batch_safely, jobs, pages_list),
+                )
 
-    # 获取目录中所有PDF文件
-    pdf_files = [f for f in os.listdir(directory_path) if f.lower().endswith(".pdf")]
+        def digest(pdf_path):
+            return (digests or {}).get(pdf_path) or _digest_safely(pdf_path)
 
-    if not pdf_files:
-        print(f"在目录 {directory_path} 中未找到PDF文件")
-        return
+        for chunk in _chunked(pdf_paths, CACHE_LOOKUP_BATCH, CACHE_LOOKUP_FIRST_BATCH):
+            with run_metrics.stage("cache_lookup", chunk, split=True):
+                keys = list(executor.map(digest, chunk))
+                try:
+                    cached = invoice_cache.get_many(key for key in keys if key)
+                except Exception as e:
+                    print(f"批量查询缓存失败: {e}")
+                    cached = {}
 
-    print(f"找到 {len(pdf_files)} 个PDF文件，开始处理...")
+            # 命中缓存的文件在一个事务中写入查询索引
+            hits = {
+                position: _cached_result(chunk[position], cached[key])
+                for position, key in enumerate(keys) if key in cached
+            }
+            _index_invoices([
+                (keys[position], chunk[position], future.result()[0])
+                for position, future in hits.items() if future.result()[0] is not None
+            ])
 
-    row_num = 2  # 从第2行开始写入数据
-    serial_number = 1  # 序号计数器
+            for position, (pdf_path, key) in enumerate(zip(chunk, keys)):
+                if position in hits:
+                    future = hits[position]
+                elif batch_size > 1:
+                    future = Future()
+                    batch.append((pdf_path, key, future))
+                    if len(batch) >= batch_size:
+                        flush_batch()
+                else:
+                    future = submit_one(pdf_path, key)
+                pending.append((pdf_path, future))
+                # 限制提前提交的任务数量，避免一次性为超大目录创建全部任务
+                if len(pending) >= window:
+                    path, future = pending.popleft()
+                    if not future.done():
+                        # 等待的结果可能还在未提交的批次里，先提交
+                        flush_batch()
+                    yield (path, *future.result())
+        flush_batch()
+        while pending:
+            path, future = pending.popleft()
+            yield (path, *future.result())
 
-    for pdf_file in pdf_files:
-        pdf_path = os.path.join(directory_path, pdf_file)
-        print(f"正在处理: {pdf_file}")
 
-        try:
-            # 解析PDF文件
-            invoice_info = parse_invoice_from_pdf(pdf_path)
-
-            # 为每个货物项目创建一行数据
-            if invoice_info.items is not None:
-                for item in invoice_info.items:
-                    # 填充行数据
-                    row_data = [
-                        serial_number,  # 序号
-                        "",  # 发票代码（通常PDF中不包含）
-                        "",  # 发票号码（留空，因为数电发票号码列会填写）
-                        invoice_info.invoice_number,  # 数电发票号码
-                        invoice_info.seller_tax_id,  # 销方识别号
-                        invoice_info.seller_name,  # 销方名称
-                        invoice_info.buyer_tax_id,  # 购方识别号
-                        invoice_info.buyer_name,  # 购买方名称
-                        invoice_info.invoice_date,  # 开票日期
-                        invoice_info.tax_classification_code,  # 税收分类编码
-                        invoice_info.special_business_type,  # 特定业务类型
-                        item.name,  # 货物或应税劳务名称
-                        item.specification,  # 规格型号
-                        item.unit,  # 单位
-                        item.quantity,  # 数量
-                        item.unit_price,  # 单价
-                        item.amount,  # 金额
-                        item.tax_rate,  # 税率
-                        item.tax_amount,  # 税额
-                        item.total_with_tax,  # 价税合计
-                        invoice_info.invoice_source,  # 发票来源
-                        invoice_info.invoice_type,  # 发票票种
-                        invoice_info.invoice_status,  # 发票状态
-                        "是" if invoice_info.is_positive_invoice else "否",  # 是否正数发票
-                        invoice_info.invoice_risk_level,  # 发票风险等级
-                        invoice_info.issuer,  # 开票人
-                        invoice_info.remarks,  # 备注
-                    ]
-
-                    # 写入行数据
-                    for col, value in enumerate(row_data, 1):
-                        ws.cell(row=row_num, column=col, value=value)
-
-                    row_num += 1
-                    serial_number += 1
-            else:
-                # 如果没有货物信息，创建一行空数据
-                row_data = [
-                    serial_number,  # 序号
-                    "",  # 发票代码
-                    "",  # 发票号码
-                    invoice_info.invoice_number,  # 数电发票号码
-                    invoice_info.seller_tax_id,  # 销方识别号
-                    invoice_info.seller_name,  # 销方名称
-                    invoice_info.buyer_tax_id,  # 购方识别号
-                    invoice_info.buyer_name,  # 购买方名称
-                    invoice_info.invoice_date,  # 开票日期
-                    invoice_info.tax_classification_code,  # 税收分类编码
-                    invoice_info.special_business_type,  # 特定业务类型
-                    "",  # 货物或应税劳务名称
-                    "",  # 名称
-                    "",  # 规格型号
-                    "",  # 单位
-                    "",  # 数量
-                    "",  # 单价
-                    "",  # 金额
-                    "",  # 税率
-                    "",  # 税额
-                    "",  # 价税合计
-                    invoice_info.invoice_source,  # 发票来源
-                    invoice_info.invoice_type,  # 发票票种
-                    invoice_info.invoice_status,  # 发票状态
-                    "是" if invoice_info.is_positive_invoice else "否",  # 是否正数发票
-                    invoice_info.invoice_risk_level,  # 发票风险等级
-                    invoice_info.issuer,  # 开票人
-                    invoice_info.remarks,  # 备注
-                ]
-
-                # 写入行数据
-                for col, value in enumerate(row_data, 1):
-                    ws.cell(row=row_num, column=col, value=value)
-
-                row_num += 1
-                serial_number += 1
+def iter_parse_invoices_resumable(
+        pdf_paths,
+        journal: JobJournal,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        parse_processes: int = DEFAULT_PARSE_PROCESSES,
+        digests: Optional[Dict[str, str]] = None,
+):
+    """
+    带断点续传的 iter_parse_invoices
+
+    任务日志中已完成的文件直接返回记录的结果，其余文件并发解析，
+    解析成功后立即写入日志；结果仍按 pdf_paths 的顺序产出。
+    pdf_paths 可以是边扫描边产出的迭代器，不会被提前全部读入。
 
+    Yields:
+        (pdf_path, invoices, error)，与 iter_parse_invoices 相同
+    """
+    paths, lookahead = itertools.tee(pdf_paths)
+    # 已判断过的文件：{路径: 是否已记录在日志中}
+    # 解析线程的预读和按顺序产出结果的循环都会查询，谁先遇到谁判断
+    decisions: Dict[str, bool] = {}
+    restored = [0]
+
+    def read_journal(pdf_path: str) -> Optional[dict]:
+        try:
+            return journal.get(pdf_path)
         except Exception as e:
-            print(f"处理文件 {pdf_file} 时出错: {e}")
-            # 在Excel中添加错误信息行
-            error_message = f"解析失败 (文件: {pdf_file}): {str(e)}"
-            row_data = [
-                serial_number,  # 序号
-                "",  # 发票代码
-                "",  # 发票号码
-                "",  # 数电发票号码
-                "",  # 销方识别号
-                "",  # 销方名称
-                "",  # 购方识别号
-                "",  # 购买方名称
-                "",  # 开票日期
-                "",  # 税收分类编码
-                "",  # 特定业务类型
-                "",  # 货物或应税劳务名称
-                "",  # 名称
-                "",  # 规格型号
-                "",  # 单位
-                "",  # 数量
-                "",  # 单价
-                "",  # 金额
-                "",  # 税率
-                "",  # 税额
-                "",  # 价税合计
-                "",  # 发票来源
-                "",  # 发票票种
-                "",  # 发票状态
-                "",  # 是否正数发票
-                "",  # 发票风险等级
-                "",  # 开票人
-                error_message,  # 备注 - 显示错误信息
-            ]
+            print(f"读取任务日志失败 (文件: {os.path.basename(pdf_path)}): {e}")
+            return None
+
+    def is_journaled(pdf_path: str) -> bool:
+        if pdf_path not in decisions:
+            decisions[pdf_path] = read_journal(pdf_path) is not None
+            restored[0] += decisions[pdf_path]
+        return decisions[pdf_path]
 
-            # 写入错误信息行
-            for col, value in enumerate(row_data, 1):
-                cell = ws.cell(row=row_num, column=col, value=value)
-                # 为错误行设置红色背景
-                if col == len(row_data):  # 备注列
-                    cell.fill = PatternFill(start_color="FFCCCC", end_color="FFCCCC", fill_type="solid")
+    def remaining():
+        for pdf_path in lookahead:
+            if not is_journaled(pdf_path):
+                yield pdf_path
 
-            row_num += 1
-            serial_number += 1
-            # 即使出错也继续处理其他文件
+    results = iter_parse_invoices(remaining(), max_workers, batch_size, parse_processes, digests)
+    for pdf_path in paths:
+        if is_journaled(pdf_path):
+            try:
+                yield pdf_path, invoices_from_record(read_journal(pdf_path)), None
+            except Exception as e:
+                yield pdf_path, None, e
             continue
 
-    # 调整列宽
-    for col in range(1, len(headers) + 1):
-        ws.column_dimensions[
-            chr(64 + col) if col <= 26 else chr(64 + col // 26) + chr(64 + col % 26)
-        ].width = 15
+        path, invoices, error = next(results)
+        decisions.pop(path, None)
+        if error is None:
+            try:
+                journal.record(path, invoices_to_record(invoices))
+            except Exception as e:
+                print(f"写入任务日志失败 (文件: {os.path.basename(path)}): {e}")
+        yield path, invoices, error
 
-    # 保存文件
+    if restored[0]:
+        print(f"从任务日志恢复了 {restored[0]} 个已完成的文件")
+
+
+def process_directory_to_xlsx(
+        directory_path: str,
+        output_file: str = "invoice_data.xlsx",
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        streaming: bool = False,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        metrics_file: Optional[str] = None,
+        parse_processes: int = DEFAULT_PARSE_PROCESSES,
+        resume: bool = True,
+        recursive: bool = False,
+        include: Optional[List[str]] = None,
+        exclude: Optional[List[str]] = None,
+        modified_after=None,
+        modified_before=None,
+        export_formats: Optional[List[str]] = None,
+        export_layout: str = "items",
+        scan_workers: int = DEFAULT_SCAN_WORKERS,
+):
+    """
+    处理目录中所有PDF文件并生成XLSX表格
+
+    文件由 file_discovery.iter_pdf_files 边扫描边产出，
+    大型归档目录不必等扫描完成就开始处理。
+
+    处理进度记录在目录下的任务日志中（见 job_journal.py），
+    中途退出后再次处理同一目录时，已完成的文件不会重新处理。
+
+    Args:
+        directory_path: PDF文件所在目录路径
+        output_file: 输出的XLSX文件名
+        max_workers: 并发解析的文件数量，1 表示逐个处理
+        streaming: 使用openpyxl只写模式逐行写出，内存占用不随行数增长
+        batch_size: 每次AI请求包含的发票数量，大于1时多张发票共用一份提示词
+        metrics_file: 运行指标的导出路径，.prom 结尾时导出Prometheus文本格式，
+            否则导出JSON Lines（每个文件一行）；不导出时仍会打印运行汇总
+        parse_processes: 读取PDF的进程数（如 os.cpu_count()），0 表示在解析线程中读取
+        resume: 是否从上次中断的任务继续，False 时丢弃已有的任务日志
+        recursive: 是否处理子目录中的PDF
+        include / exclude: 包含/排除的通配符列表，匹配相对路径或文件名（如 "2024-*/*.pdf"、"*作废*"）
+        modified_after / modified_before: 按文件修改日期筛选，"YYYY-MM-DD" 或 date（含当天），
+            datetime 按确切时刻筛选（见 file_discovery.iter_pdf_files）
+        export_formats: 同时导出的带类型数据文件格式，如 ["csv", "jsonl", "parquet"]，
+            与汇总表同名、保存在同一目录（见 invoice_export.open_export）
+        export_layout: 数据文件的布局，"items" 每个货物一条记录，"nested" 每张发票一条记录
+        scan_workers: 递归查找时预先列出子目录的线程数
+    """
+
+    # 创建工作簿和工作表（含表头样式和列宽），按汇总表的列定义写入
+    wb, ws = create_summary_workbook(SUMMARY_HEADERS, streaming)
+    exporter = InvoiceExporter(XlsxSink(ws), duplicates=DUPLICATE_INVOICES)
+
+    # 供分析工具使用的数据文件与汇总表同时边处理边写出
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    output_file = f"发票数据汇总_{timestamp}.xlsx"
-    output_path = os.path.join(directory_path, output_file)
+    output_base = os.path.join(directory_path, f"发票数据汇总_{timestamp}")
+    data_exporters: List[InvoiceExporter] = []
+
+    # 边扫描目录边处理PDF文件
+    pdf_paths = iter_pdf_files(
+        directory_path,
+        recursive=recursive,
+        include=include,
+        exclude=exclude,
+        modified_after=modified_after,
+        modified_before=modified_before,
+        scan_workers=scan_workers,
+    )
+    print(f"开始处理目录 {directory_path}（并发数: {max_workers}）...")
+    run_metrics.reset()
+
+    file_count = 0
+
+    journal = JobJournal.for_directory(directory_path, resume)
+    # 处理中途出错或被中断时同样关闭数据文件（Parquet 在关闭时写出文件尾，否则文件无法读取）
+    try:
+        for export_format in export_formats or []:
+            data_exporters.append(open_export(f"{output_base}.{export_format}", export_layout, DUPLICATE_INVOICES))
+
+        for pdf_path, invoices, error in iter_parse_invoices_resumable(
+                pdf_paths, journal, max_workers, batch_size, parse_processes
+        ):
+            file_count += 1
+            pdf_file = os.path.basename(pdf_path)
+            print(f"正在写入: {pdf_file}")
+
+            if error is not None:
+                print(f"处理文件 {pdf_file} 时出错: {error}")
+
+            with run_metrics.stage("row_write", [pdf_path]):
+                exporter.write(pdf_path, invoices, error)
+                for data_exporter in data_exporters:
+                    data_exporter.write(pdf_path, invoices, error)
+    finally:
+        for data_exporter in data_exporters:
+            data_exporter.close()
+
+    if not file_count:
+        journal.finish()
+        for data_exporter in data_exporters:
+            os.remove(data_exporter.sink.path)
+        print(f"在目录 {directory_path} 中未找到PDF文件")
+        return
+
+    # 保存文件
+    output_path = f"{output_base}.xlsx"
     wb.save(output_path)
+    journal.finish()
     print(
-        f"\n处理完成！共处理了 {len(pdf_files)} 个PDF文件，生成了 {row_num - 2} 行数据"
+        f"\n处理完成！共处理了 {file_count} 个PDF文件，生成了 {exporter.rows_written} 行数据"
     )
+    if exporter.duplicate_count:
+        print(f"发现 {exporter.duplicate_count} 张重复的发票（发票号码与之前的文件相同）")
     print(f"Excel文件已保存到: {output_path}")
+    for data_exporter in data_exporters:
+        print(f"数据文件已保存到: {data_exporter.sink.path}（{data_exporter.rows_written} 条记录）")
+
+    run_metrics.finish()
+    print(run_metrics.format_summary())
+    if metrics_file:
+        try:
+            run_metrics.export(metrics_file)
+            print(f"运行指标已保存到: {metrics_file}")
+        except OSError as e:
+            print(f"保存运行指标失败: {e}")
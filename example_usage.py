@@ -9,11 +9,14 @@
 """
 
 from entry import process_directory_to_xlsx
+from file_discovery import iter_pdf_files
 import os
 
 def main():
     # 指定包含PDF文件的目录路径
     pdf_directory = "./pdf_files"  # 可以根据实际情况修改
+    recursive = False  # 是否同时处理子目录中的PDF文件
+    export_formats = []  # 同时导出的数据文件格式，如 ["csv", "jsonl", "parquet"]（Parquet需要安装pyarrow）
     
     # 检查目录是否存在
     if not os.path.exists(pdf_directory):
@@ -21,7 +24,7 @@ def main():
         return
     
     # 检查目录中是否有PDF文件
-    pdf_files = [f for f in os.listdir(pdf_directory) if f.lower().endswith('.pdf')]
+    pdf_files = [os.path.relpath(p, pdf_directory) for p in iter_pdf_files(pdf_directory, recursive=recursive)]
     if not pdf_files:
         print(f"在目录 {pdf_directory} 中未找到PDF文件")
         print("请将PDF文件放入该目录后重新运行")
@@ -36,7 +39,9 @@ def main():
     print(f"\n开始处理，输出文件: {output_filename}")
     
     try:
-        process_directory_to_xlsx(pdf_directory, output_filename)
+        process_directory_to_xlsx(
+            pdf_directory, output_filename, recursive=recursive, export_formats=export_formats
+        )
         print("\n✅ 处理完成！")
     except Exception as e:
         print(f"\n❌ 处理过程中出现错误: {e}")
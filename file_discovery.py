@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+PDF文件发现
+
+按月份、供应商分层存放的归档目录往往有上万个条目，os.listdir 只看一层，
+且必须等整个列表返回后才能开始处理。这里用 os.scandir 逐层扫描：
+- 可递归进入子目录
+- 支持包含/排除的通配符（匹配相对路径或文件名，如 "2024-*/*.pdf"、"*作废*"）
+- 支持按文件修改日期筛选
+- 逐个产出文件路径，处理流程不必等扫描结束就能开始
+- 可用多个线程预先扫描后续的子目录（网络共享盘上每次列目录都有明显延迟），
+  产出顺序仍与单线程扫描一致
+"""
+
+import fnmatch
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from typing import Iterable, Iterator, List, Optional, Tuple, Union
+
+DateLike = Union[str, date, datetime, None]
+
+
+def _to_timestamp(value: DateLike, end_of_day: bool = False) -> Optional[float]:
+    """
+    将 "YYYY-MM-DD"、date 或 datetime 转换为时间戳
+
+    字符串和 date 表示一整天，作为当天开始（end_of_day 时为当天结束）；
+    datetime 表示确切的时刻，按原样转换，不受 end_of_day 影响
+    """
+    if value is None or value == "":
+        return None
+    if isinstance(value, str):
+        value = datetime.strptime(value, "%Y-%m-%d").date()
+    if not isinstance(value, datetime):
+        value = datetime(value.year, value.month, value.day)
+        if end_of_day:
+            return value.timestamp() + 86400
+    return value.timestamp()
+
+
+def _matches(relative_path: str, patterns: Iterable[str]) -> bool:
+    name = relative_path.rsplit("/", 1)[-1]
+    return any(
+        fnmatch.fnmatch(relative_path, pattern) or fnmatch.fnmatch(name, pattern)
+        for pattern in patterns
+    )
+
+
+def _scan_directory(path: str) -> Tuple[List[os.DirEntry], List[str]]:
+    """列出一个目录，返回 (按名称排序的文件, 按名称排序的子目录)；无法读取时返回空"""
+    files, directories = [], []
+    try:
+        with os.scandir(path) as it:
+            for item in it:
+                try:
+                    if item.is_dir(follow_symlinks=False):
+                        directories.append(item.path)
+                    elif item.is_file():
+                        files.append(item)
+                except OSError:
+                    continue
+    except OSError as e:
+        print(f"无法读取目录 {path}: {e}")
+    files.sort(key=lambda item: item.name)
+    directories.sort()
+    return files, directories
+
+
+def iter_pdf_files(
+        directory_path: str,
+        recursive: bool = False,
+        include: Optional[Iterable[str]] = None,
+        exclude: Optional[Iterable[str]] = None,
+        modified_after: DateLike = None,
+        modified_before: DateLike = None,
+        scan_workers: int = 1,
+) -> Iterator[str]:
+    """
+    逐个产出目录中的PDF文件路径
+
+    每个目录内按文件名排序，先产出当前目录的文件，再依次进入子目录。
+
+    Args:
+        directory_path: 根目录
+        recursive: 是否进入子目录
+        include: 包含的通配符列表，默认 ["*.pdf"]（不区分大小写）
+        exclude: 排除的通配符列表，匹配的文件和子目录都会被跳过
+        modified_after: 只包含此日期（含）之后修改的文件，"YYYY-MM-DD"、date 或 datetime
+        modified_before: 只包含此日期（含）之前修改的文件；
+            datetime 按确切时刻筛选：modified_after 含该时刻，modified_before 不含该时刻
+        scan_workers: 扫描目录的线程数，大于1时预先扫描后续的子目录
+
+    Yields:
+        PDF文件的完整路径
+    """
+    include = [p.lower() for p in (include or ["*.pdf"])]
+    exclude = [p.lower() for p in (exclude or [])]
+    after = _to_timestamp(modified_after)
+    before = _to_timestamp(modified_before, end_of_day=True)
+    root = os.path.abspath(directory_path)
+
+    def relative(path: str) -> str:
+        return os.path.relpath(path, root).replace(os.sep, "/").lower()
+
+    executor = ThreadPoolExecutor(max_workers=scan_workers) if recursive and scan_workers > 1 else None
+    try:
+        def submit(path: str):
+            if executor is not None:
+                return executor.submit(_scan_directory, path)
+            return path
+
+        def result(job):
+            return job.result() if executor is not None else _scan_directory(job)
+
+        # 待处理的目录：深度优先，子目录按名称顺序处理
+        stack = deque([submit(directory_path)])
+        while stack:
+            files, directories = result(stack.pop())
+            for item in files:
+                rel = relative(item.path)
+                if not _matches(rel, include) or (exclude and _matches(rel, exclude)):
+                    continue
+                if after is not None or before is not None:
+                    try:
+                        mtime = item.stat().st_mtime
+                    except OSError:
+                        continue
+                    if (after is not None and mtime < after) or (before is not None and mtime >= before):
+                        continue
+                yield item.path
+
+            if recursive:
+                children = [path for path in directories if not (exclude and _matches(relative(path), exclude))]
+                # 按名称顺序提交（多线程时此刻已开始扫描），逆序入栈以便按名称顺序出栈
+                jobs = [submit(path) for path in children]
+                stack.extend(reversed(jobs))
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
@@ -8,20 +8,33 @@
 - 显示处理进度
 - 实时显示当前处理的文件
 - 显示使用说明
+
+后台线程不直接操作界面：日志、进度和其他界面操作先放入线程安全的队列，
+由Tk主循环每隔 UI_FLUSH_INTERVAL_MS 毫秒取出一次批量更新——日志一次插入，
+进度只显示最新的一条，日志框只保留最近 LOG_MAX_LINES 行，
+并发处理上千个文件时界面也不会卡顿。
 """
 
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, scrolledtext
+import queue
 import threading
 import os
 import sys
 from datetime import datetime
-from entry import process_directory_to_xlsx
+from entry import DEFAULT_SCAN_WORKERS, process_directory_to_xlsx
+from file_discovery import iter_pdf_files
 import json
 import base64
 import hashlib
 import hmac
 
+# 界面队列的刷新间隔（毫秒）
+UI_FLUSH_INTERVAL_MS = 100
+
+# 日志框保留的最大行数，超过时删除最早的行
+LOG_MAX_LINES = 2000
+
 
 class InvoiceRecognizerGUI:
     def __init__(self, root):
@@ -45,8 +58,12 @@ class InvoiceRecognizerGUI:
         self.processing_thread = None
         self.api_key = self.load_api_key()
 
+        # 后台线程发给界面的日志、进度和操作（见 flush_ui_queue）
+        self.ui_queue = queue.SimpleQueue()
+
         # 创建界面
         self.setup_ui()
+        self.root.after(UI_FLUSH_INTERVAL_MS, self.flush_ui_queue)
 
     def setup_ui(self):
         """设置用户界面"""
@@ -189,7 +206,7 @@ class InvoiceRecognizerGUI:
 
 ⚠️ 重要提醒：
 • 程序依赖DeepSeek的API接口，请先申请API KEY
-• 程序会在PDF文件目录下生成缓存文件（cache_res_*.json），请勿删除，否则会重复调用AI接口
+• 识别结果按文件内容缓存在用户目录（~/.invoice_recognizer/cache），重命名或复制的发票不会重复调用AI接口
 • AI识别结果可能不准确，建议人工复核重要数据
 • 如果某个文件解析失败，Excel的"备注"列会显示错误信息
 
@@ -490,6 +507,16 @@ class InvoiceRecognizerGUI:
         )
         self.clear_log_button.pack(side=tk.LEFT)
 
+        # 是否处理子目录（按月份、供应商分层存放的归档目录）
+        self.recursive_var = tk.BooleanVar(value=False)
+        self.recursive_check = ttk.Checkbutton(
+            button_frame,
+            text="包含子目录",
+            variable=self.recursive_var,
+            command=self.count_pdf_files
+        )
+        self.recursive_check.pack(side=tk.LEFT, padx=(10, 0))
+
         # 选中的目录标签
         self.selected_dir_label = ttk.Label(button_frame, text="未选择目录")
         self.selected_dir_label.pack(side=tk.RIGHT, padx=(10, 0))
@@ -544,11 +571,25 @@ class InvoiceRecognizerGUI:
             self.log_message(f"已选择目录: {directory}")
 
             # 检查目录中的PDF文件
-            pdf_files = [f for f in os.listdir(directory) if f.lower().endswith('.pdf')]
-            if pdf_files:
-                self.log_message(f"发现 {len(pdf_files)} 个PDF文件")
-            else:
-                self.log_message("警告: 选择的目录中没有找到PDF文件")
+            self.count_pdf_files()
+
+    def count_pdf_files(self):
+        """在后台线程中统计所选目录中的PDF文件数量（大型归档目录扫描较慢，不阻塞界面）"""
+        if not self.selected_directory:
+            return
+        threading.Thread(
+            target=self._count_pdf_files,
+            args=(self.selected_directory, self.recursive_var.get()),
+            daemon=True,
+        ).start()
+
+    def _count_pdf_files(self, directory, recursive):
+        count = sum(1 for _ in iter_pdf_files(directory, recursive=recursive, scan_workers=DEFAULT_SCAN_WORKERS))
+        if count:
+            scope = "（含子目录）" if recursive else ""
+            self.log_message(f"发现 {count} 个PDF文件{scope}")
+        else:
+            self.log_message("警告: 选择的目录中没有找到PDF文件")
 
     def start_processing(self):
         """开始处理文件"""
@@ -563,196 +604,186 @@ class InvoiceRecognizerGUI:
         # 禁用按钮
         self.select_dir_button.config(state=tk.DISABLED)
         self.process_button.config(state=tk.DISABLED)
+        self.recursive_check.config(state=tk.DISABLED)
 
         # 重置进度
         self.progress_var.set(0)
         self.current_file_label.config(text="正在启动...")
 
-        # 在新线程中处理
-        self.processing_thread = threading.Thread(target=self.process_files)
+        # 在新线程中处理（Tk变量只在主线程读取）
+        self.processing_thread = threading.Thread(
+            target=self.process_files, args=(self.selected_directory, self.recursive_var.get())
+        )
         self.processing_thread.daemon = True
         self.processing_thread.start()
 
-    def process_files(self):
+    def process_files(self, directory, recursive):
         """处理文件（在后台线程中运行）"""
         try:
             self.log_message("开始处理文件...")
 
-            # 获取PDF文件列表
-            pdf_files = [f for f in os.listdir(self.selected_directory) if f.lower().endswith('.pdf')]
-
-            if not pdf_files:
-                self.log_message("错误: 目录中没有找到PDF文件")
-                self.root.after(0, lambda: messagebox.showerror("错误", "目录中没有找到PDF文件"))
-                return
+            # 边扫描目录边处理，不必等整个目录扫描完成
+            pdf_files = iter_pdf_files(directory, recursive=recursive, scan_workers=DEFAULT_SCAN_WORKERS)
 
             # 重写process_directory_to_xlsx函数以支持进度回调
-            self.process_with_progress(pdf_files)
+            if not self.process_with_progress(directory, pdf_files):
+                self.log_message("错误: 目录中没有找到PDF文件")
+                self.run_on_ui(lambda: messagebox.showerror("错误", "目录中没有找到PDF文件"))
 
         except Exception as e:
             self.log_message(f"处理过程中出现错误: {e}")
-            self.root.after(0, lambda: messagebox.showerror("错误", f"处理过程中出现错误: {e}"))
+            message = f"处理过程中出现错误: {e}"
+            self.run_on_ui(lambda: messagebox.showerror("错误", message))
         finally:
             # 恢复按钮状态
-            self.root.after(0, self.enable_buttons)
-
-    def process_with_progress(self, pdf_files):
-        """带进度显示的文件处理"""
-        import json
-        from openpyxl import Workbook
-        from openpyxl.styles import Font, PatternFill, Alignment
-
-        # 定义表头
-        headers = [
-            "序号", "发票代码", "发票号码", "数电发票号码", "销方识别号", "销方名称",
-            "购方识别号", "购买方名称", "开票日期", "税收分类编码", "特定业务类型",
-            "货物或应税劳务名称", "规格型号", "单位", "数量", "单价", "金额",
-            "税率", "税额", "价税合计", "发票来源", "发票票种", "发票状态",
-            "是否正数发票", "发票风险等级", "开票人", "备注"
-        ]
-
-        # 创建工作簿
-        wb = Workbook()
-        ws = wb.active
-        if ws and hasattr(ws, 'title'):
-            ws.title = "发票数据"
-
-        # 设置表头样式
-        header_font = Font(bold=True, color="FFFFFF")
-        header_fill = PatternFill(start_color="808080", end_color="808080", fill_type="solid")
-        header_alignment = Alignment(horizontal="center", vertical="center")
-
-        # 写入表头
-        for col, header in enumerate(headers, 1):
-            cell = ws.cell(row=1, column=col, value=header)
-            if cell and hasattr(cell, 'font'):
-                cell.font = header_font
-                cell.fill = header_fill
-                cell.alignment = header_alignment
-
-        row_num = 2
-        serial_number = 1
-
-        # 处理每个文件
-        for i, pdf_file in enumerate(pdf_files):
-            # 更新进度
-            progress = (i / len(pdf_files)) * 100
-            self.root.after(0, lambda p=progress: self.progress_var.set(p))
-            self.root.after(0, lambda f=pdf_file: self.current_file_label.config(text=f"正在处理: {f}"))
-
-            if self.selected_directory:
-                pdf_path = os.path.join(self.selected_directory, pdf_file)
-            else:
-                pdf_path = pdf_file
-            self.log_message(f"处理文件 ({i + 1}/{len(pdf_files)}): {pdf_file}")
-
-            try:
-                # 导入解析函数
-                from entry import parse_invoice_from_pdf
-
-                # 临时设置API密钥
-                import entry
-                # original_key = entry.DEEP_SEEK_KEY
-                entry.DEEP_SEEK_KEY = self.api_key
-
-                # 解析PDF文件
-                invoice_info = parse_invoice_from_pdf(pdf_path)
-
-                # 为每个货物项目创建一行数据
-                if invoice_info.items is not None:
-                    for item in invoice_info.items:
-                        row_data = [
-                            serial_number, "", "", invoice_info.invoice_number,
-                            invoice_info.seller_tax_id, invoice_info.seller_name,
-                            invoice_info.buyer_tax_id, invoice_info.buyer_name,
-                            invoice_info.invoice_date, invoice_info.tax_classification_code,
-                            invoice_info.special_business_type, item.name, item.specification,
-                            item.unit, item.quantity, item.unit_price, item.amount,
-                            item.tax_rate, item.tax_amount, item.total_with_tax,
-                            invoice_info.invoice_source, invoice_info.invoice_type,
-                            invoice_info.invoice_status, "是" if invoice_info.is_positive_invoice else "否",
-                            invoice_info.invoice_risk_level, invoice_info.issuer, invoice_info.remarks
-                        ]
-
-                        for col, value in enumerate(row_data, 1):
-                            cell = ws.cell(row=row_num, column=col, value=value)
-
-                        row_num += 1
-                        serial_number += 1
-                else:
-                    # 如果没有货物信息，创建一行空数据
-                    row_data = [
-                        serial_number, "", "", invoice_info.invoice_number,
-                        invoice_info.seller_tax_id, invoice_info.seller_name,
-                        invoice_info.buyer_tax_id, invoice_info.buyer_name,
-                        invoice_info.invoice_date, invoice_info.tax_classification_code,
-                        invoice_info.special_business_type, "", "", "", "", "", "",
-                        "", "", "", invoice_info.invoice_source, invoice_info.invoice_type,
-                        invoice_info.invoice_status, "是" if invoice_info.is_positive_invoice else "否",
-                        invoice_info.invoice_risk_level, invoice_info.issuer, invoice_info.remarks
-                    ]
-
-                    for col, value in enumerate(row_data, 1):
-                        cell = ws.cell(row=row_num, column=col, value=value)
-
-                    row_num += 1
-                    serial_number += 1
+            self.run_on_ui(self.enable_buttons)
+
+    def process_with_progress(self, directory, pdf_files) -> int:
+        """
+        带进度显示的文件处理
+
+        Args:
+            directory: 处理的目录（任务日志和汇总表保存在这里）
+            pdf_files: PDF文件路径的可迭代对象（可以是仍在扫描中的生成器）
+
+        Returns:
+            处理的文件数，为 0 时不保存表格
+        """
+        from entry import DUPLICATE_INVOICES, SUMMARY_HEADERS, create_summary_workbook
+        from invoice_export import InvoiceExporter, XlsxSink
+
+        # 创建工作簿（只写模式逐行写出，大批量处理时内存占用保持平稳），
+        # 与命令行使用同一套列定义写入，重复的发票按 DUPLICATE_INVOICES 标记
+        wb, ws = create_summary_workbook(SUMMARY_HEADERS, streaming=True)
+        exporter = InvoiceExporter(XlsxSink(ws), duplicates=DUPLICATE_INVOICES)
+
+        # 导入并发解析函数
+        import entry
+        from entry import iter_parse_invoices_resumable
+        from job_journal import JobJournal
+
+        # 临时设置API密钥
+        entry.DEEP_SEEK_KEY = self.api_key
+        # 每次处理重新统计，多次处理时运行指标不会累积
+        entry.run_metrics.reset()
+
+        # 扫描结束前总数还在增加，进度按已发现的文件数计算
+        discovered = 0
+        scanning = True
+
+        def discover():
+            nonlocal discovered, scanning
+            for path in pdf_files:
+                discovered += 1
+                yield path
+            scanning = False
+
+        # 任务日志：已完成的文件随时记录，窗口被关闭后再次处理同一目录可从中断处继续
+        journal = JobJournal.for_directory(directory)
+        if len(journal):
+            self.log_message(f"发现未完成的任务，已完成的 {len(journal)} 个文件将直接使用上次的结果")
+
+        # 并发解析，按文件顺序写入结果
+        file_count = 0
+        results = iter_parse_invoices_resumable(discover(), journal)
+        for i, (pdf_path, invoices, error) in enumerate(results):
+            pdf_file = os.path.basename(pdf_path)
+            file_count = i + 1
 
+            # 更新进度
+            progress = (i / discovered) * 100
+            total = f"{discovered}+" if scanning else f"{discovered}"
+            self.set_progress(progress, f"已完成: {pdf_file}")
+            self.log_message(f"处理文件 ({file_count}/{total}): {pdf_file}")
+
+            # PDF中可能有多张发票（合订的扫描件），依次写入；识别失败时写入一行错误信息
+            exporter.write(pdf_path, invoices, error)
+            if error is None:
                 self.log_message(f"✅ 成功处理: {pdf_file}")
+            else:
+                self.log_message(f"❌ 解析失败 (文件: {pdf_file}): {error}")
 
-            except Exception as e:
-                error_message = f"解析失败 (文件: {pdf_file}): {str(e)}"
-                self.log_message(f"❌ {error_message}")
-
-                # 在Excel中添加错误信息行
-                row_data = [serial_number] + [""] * 26 + [error_message]
-
-                for col, value in enumerate(row_data, 1):
-                    cell = ws.cell(row=row_num, column=col, value=value)
-                    if cell and hasattr(cell, 'fill') and col == len(row_data):  # 备注列
-                        cell.fill = PatternFill(start_color="FFCCCC", end_color="FFCCCC", fill_type="solid")
-
-                row_num += 1
-                serial_number += 1
-
-        # 调整列宽
-        if ws and hasattr(ws, 'column_dimensions'):
-            for col in range(1, len(headers) + 1):
-                col_letter = chr(64 + col) if col <= 26 else chr(64 + col // 26) + chr(64 + col % 26)
-                ws.column_dimensions[col_letter].width = 15
+        if not file_count:
+            journal.finish()
+            return 0
 
         # 保存文件
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         output_file = f"发票数据汇总_{timestamp}.xlsx"
-        if self.selected_directory:
-            output_path = os.path.join(self.selected_directory, output_file)
-        else:
-            output_path = output_file
+        output_path = os.path.join(directory, output_file)
 
         wb.save(output_path)
+        journal.finish()
 
         # 完成处理
-        self.root.after(0, lambda: self.progress_var.set(100))
-        self.root.after(0, lambda: self.current_file_label.config(text="处理完成"))
-        self.log_message(f"🎉 处理完成！共处理了 {len(pdf_files)} 个PDF文件，生成了 {row_num - 2} 行数据")
+        self.set_progress(100, "处理完成")
+        self.log_message(f"🎉 处理完成！共处理了 {file_count} 个PDF文件，生成了 {exporter.rows_written} 行数据")
+        if exporter.duplicate_count:
+            self.log_message(f"⚠️ 发现 {exporter.duplicate_count} 张重复的发票（发票号码与之前的文件相同）")
         self.log_message(f"📁 Excel文件已保存到: {output_path}")
 
         # 显示完成消息
-        self.root.after(0, lambda: messagebox.showinfo("完成",
-                                                       f"处理完成！\n\n共处理了 {len(pdf_files)} 个PDF文件\n生成了 {row_num - 2} 行数据\n\nExcel文件已保存到:\n{output_path}"))
+        self.run_on_ui(lambda: messagebox.showinfo("完成",
+                                                       f"处理完成！\n\n共处理了 {file_count} 个PDF文件\n生成了 {exporter.rows_written} 行数据\n\nExcel文件已保存到:\n{output_path}"))
+        return file_count
 
     def enable_buttons(self):
         """恢复按钮状态"""
         self.select_dir_button.config(state=tk.NORMAL)
         self.process_button.config(state=tk.NORMAL)
+        self.recursive_check.config(state=tk.NORMAL)
 
     def log_message(self, message):
-        """添加日志消息"""
+        """添加日志消息（可在任意线程调用，下次刷新界面时显示）"""
         timestamp = datetime.now().strftime("%H:%M:%S")
-        log_entry = f"[{timestamp}] {message}\n"
-
-        self.root.after(0, lambda: self.log_text.insert(tk.END, log_entry))
-        self.root.after(0, lambda: self.log_text.see(tk.END))
+        self.ui_queue.put(("log", f"[{timestamp}] {message}\n"))
+
+    def set_progress(self, value, text=None):
+        """更新进度条和当前文件标签（可在任意线程调用，每次刷新只显示最新的进度）"""
+        self.ui_queue.put(("progress", (value, text)))
+
+    def run_on_ui(self, callback):
+        """在Tk主循环中执行界面操作，与之前的日志和进度按顺序生效"""
+        self.ui_queue.put(("call", callback))
+
+    def flush_ui_queue(self):
+        """取出队列中的全部消息批量更新界面，之后按固定间隔再次执行"""
+        lines = []
+        progress = None
+        callbacks = []
+        while True:
+            try:
+                kind, payload = self.ui_queue.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "log":
+                lines.append(payload)
+            elif kind == "progress":
+                progress = payload
+            else:
+                callbacks.append(payload)
+
+        if lines:
+            # 用户向上翻看日志时不自动滚动到底部
+            at_bottom = self.log_text.yview()[1] >= 0.999
+            # 超出上限的部分插入后也会被删除，直接只插入最后 LOG_MAX_LINES 行
+            self.log_text.insert(tk.END, "".join(lines[-LOG_MAX_LINES:]))
+            # 每条日志以换行结尾，最后一行为空行，不计入行数
+            line_count = int(self.log_text.index("end-1c").split(".")[0]) - 1
+            if line_count > LOG_MAX_LINES:
+                self.log_text.delete("1.0", f"{line_count - LOG_MAX_LINES + 1}.0")
+            if at_bottom:
+                self.log_text.see(tk.END)
+        if progress is not None:
+            value, text = progress
+            self.progress_var.set(value)
+            if text is not None:
+                self.current_file_label.config(text=text)
+        try:
+            for callback in callbacks:
+                callback()
+        finally:
+            self.root.after(UI_FLUSH_INTERVAL_MS, self.flush_ui_queue)
 
     def clear_log(self):
         """清空日志"""
@@ -772,7 +803,10 @@ def main():
             hasattr(app.processing_thread, 'is_alive') and
             app.processing_thread.is_alive()):
 
-            if messagebox.askokcancel("退出", "正在处理文件，确定要退出吗？"):
+            if messagebox.askokcancel(
+                "退出",
+                "正在处理文件，确定要退出吗？\n\n已完成的文件已记录，下次处理同一目录时将从中断处继续。",
+            ):
                 root.destroy()
         else:
             root.destroy()
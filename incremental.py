@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+增量处理：只识别目录中新增或修改过的PDF
+
+在处理目录下保存清单 .invoice_manifest.json，记录已导出文件的
+相对路径、大小、修改时间、内容哈希以及在汇总表中的序号范围。每次运行：
+- 大小和修改时间都未变化的文件直接跳过（不读取文件内容）
+- 大小或修改时间变化但内容哈希相同的文件（如被复制或touch过）只更新清单
+- 其余新增或修改过的文件照常识别（检查清单时算出的哈希直接用于查询缓存），结果写入输出表格
+
+输出方式：
+- master：追加到目录下固定的汇总表（默认 发票数据汇总.xlsx），序号接着已有的行继续；
+  修改过的文件先删除汇总表中该文件原来的行，再追加新的识别结果。
+  每次运行都要读取并重新保存整个汇总表，耗时随汇总表的行数增长
+- delta：只包含本次新增发票的增量表 发票数据增量_{时间}.xlsx，
+  写出耗时只与新增文件数量有关；修改过的文件同样写入增量表，汇总表中旧的行不会删除，
+  适合发票很多、汇总表很大的目录
+
+使用方法：
+python incremental.py ./pdf_files                 # 追加到 ./pdf_files/发票数据汇总.xlsx
+python incremental.py ./pdf_files --mode delta    # 生成增量表
+"""
+
+import argparse
+import json
+import os
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from openpyxl import load_workbook
+
+import entry
+from invoice_export import InvoiceExporter, XlsxSink, summary_invoice_numbers
+from file_discovery import iter_pdf_files
+from invoice_cache import file_digest
+from job_journal import JOB_INCREMENTAL, JobJournal
+
+# 清单文件名（位于处理目录下）
+MANIFEST_NAME = ".invoice_manifest.json"
+MANIFEST_VERSION = 1
+
+# master 模式的汇总表文件名
+MASTER_FILE = "发票数据汇总.xlsx"
+
+MODES = ("master", "delta")
+
+
+class Manifest:
+    """
+    已导出文件的清单：{相对路径: {"size", "mtime_ns", "sha256", "rows"}}
+
+    rows 为 master 模式下该文件在汇总表中的 [第一行的序号, 行数]，文件被修改后据此删除旧的行
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.files: Dict[str, dict] = {}
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == MANIFEST_VERSION:
+                self.files = data.get("files", {})
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            print(f"读取清单失败 ({path}): {e}，将重新处理全部文件")
+
+    @classmethod
+    def for_directory(cls, directory_path: str) -> "Manifest":
+        return cls(os.path.join(directory_path, MANIFEST_NAME))
+
+    def check(self, name: str, file_path: str) -> Optional[Tuple[str, Tuple[int, int]]]:
+        """
+        判断文件是否需要处理
+
+        Returns:
+            需要处理时返回 (文件内容哈希, 计算哈希前的 (大小, 修改时间))；
+            已导出且内容未变化时返回 None
+        """
+        stat = os.stat(file_path)
+        signature = (stat.st_size, stat.st_mtime_ns)
+        entry_data = self.files.get(name)
+        if entry_data and (entry_data.get("size"), entry_data.get("mtime_ns")) == signature:
+            return None
+        digest = file_digest(file_path)
+        if entry_data and entry_data.get("sha256") == digest:
+            # 内容未变，只是文件被复制或touch过
+            self.update(name, digest, signature)
+            return None
+        return digest, signature
+
+    def update(self, name: str, digest: str, signature: Tuple[int, int], rows: Optional[Tuple[int, int]] = None):
+        """
+        记录文件已导出
+
+        Args:
+            signature: 计算哈希前文件的 (大小, 修改时间)；处理期间文件又被修改时与当前状态不同，
+                下次运行会重新处理（不能在处理完成后重新读取）
+            rows: 写入汇总表的 (第一行的序号, 行数)；None 时保留清单中原有的记录
+                （内容未变或写入增量表时，汇总表中的行没有变化）
+        """
+        file_data = {"size": signature[0], "mtime_ns": signature[1], "sha256": digest}
+        if rows is None:
+            rows = self.files.get(name, {}).get("rows")
+        if rows is not None:
+            file_data["rows"] = list(rows)
+        self.files[name] = file_data
+
+    def master_rows(self, name: str) -> Optional[Tuple[int, int]]:
+        """文件在汇总表中的 (第一行的序号, 行数)；没有记录时返回 None"""
+        rows = self.files.get(name, {}).get("rows")
+        return tuple(rows) if rows else None
+
+    def save(self):
+        """先写临时文件再替换，避免中途退出时留下损坏的清单"""
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": MANIFEST_VERSION, "files": self.files}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+
+def open_master_workbook(master_path: str):
+    """
+    打开已有的汇总表，返回 (wb, ws, 下一个序号)；不存在时新建
+
+    openpyxl 不支持只追加写入：整个汇总表会读入内存，写入后也要整个重新保存，
+    每次运行的耗时和内存都随汇总表的行数增长（汇总表很大时可改用 delta 模式）
+    """
+    if not os.path.exists(master_path):
+        wb, ws = entry.create_summary_workbook(entry.SUMMARY_HEADERS)
+        return wb, ws, 1
+
+    wb = load_workbook(master_path)
+    ws = wb["发票数据"] if "发票数据" in wb.sheetnames else wb.active
+    last_serial = ws.cell(row=ws.max_row, column=1).value if ws.max_row > 1 else 0
+    next_serial = last_serial + 1 if isinstance(last_serial, int) else ws.max_row
+    return wb, ws, next_serial
+
+
+def delete_master_rows(ws, rows: Optional[Tuple[int, int]]) -> int:
+    """
+    删除汇总表中序号在 rows = (第一行的序号, 行数) 范围内的行（文件被修改后的旧结果）
+
+    Returns:
+        删除的行数
+    """
+    if not rows:
+        return 0
+    first, count = rows
+    stale = [
+        index for index, (serial,) in enumerate(ws.iter_rows(min_row=2, max_col=1, values_only=True), start=2)
+        if isinstance(serial, int) and first <= serial < first + count
+    ]
+    # 从下往上按连续的区间删除，前面的行号不受影响
+    end = len(stale)
+    while end:
+        start = end - 1
+        while start and stale[start - 1] == stale[start] - 1:
+            start -= 1
+        ws.delete_rows(stale[start], end - start)
+        end = start
+    return len(stale)
+
+
+def replace_master_rows(ws, exporter: InvoiceExporter, rows: Optional[Tuple[int, int]]):
+    """
+    写入修改过的文件前删除它在汇总表中原来的行
+
+    删除后重新读取已有的发票号码，新的结果不会因为与自己原来的行相同而被当作重复
+    """
+    if delete_master_rows(ws, rows):
+        exporter.seen_numbers = summary_invoice_numbers(ws)
+
+
+def process_directory_incremental(
+        directory_path: str,
+        mode: str = "master",
+        master_file: str = MASTER_FILE,
+        max_workers: int = entry.DEFAULT_MAX_WORKERS,
+        batch_size: int = entry.DEFAULT_BATCH_SIZE,
+        parse_processes: int = entry.DEFAULT_PARSE_PROCESSES,
+        recursive: bool = False,
+        include: Optional[List[str]] = None,
+        exclude: Optional[List[str]] = None,
+        scan_workers: int = entry.DEFAULT_SCAN_WORKERS,
+) -> Optional[str]:
+    """
+    增量处理目录：只识别新增或修改过的PDF
+
+    Args:
+        directory_path: PDF文件所在目录路径
+        mode: "master" 追加到汇总表，"delta" 生成只含新增发票的增量表
+        master_file: master 模式的汇总表文件名（位于处理目录下）
+        max_workers / batch_size / parse_processes: 同 process_directory_to_xlsx
+        recursive / include / exclude / scan_workers: 同 process_directory_to_xlsx，
+            清单中以相对处理目录的路径记录子目录中的文件
+
+    Returns:
+        写入的表格路径；没有新文件时返回 None
+    """
+    if mode not in MODES:
+        raise ValueError(f"未知的增量输出方式: {mode}")
+
+    manifest = Manifest.for_directory(directory_path)
+    # 清单中的文件名：相对处理目录的路径，统一使用 "/" 分隔
+    pdf_files: Dict[str, str] = {}
+    for pdf_path in iter_pdf_files(
+            directory_path, recursive=recursive, include=include, exclude=exclude, scan_workers=scan_workers
+    ):
+        pdf_files[pdf_path] = os.path.relpath(pdf_path, directory_path).replace(os.sep, "/")
+
+    new_files: Dict[str, Tuple[str, Tuple[int, int]]] = {}
+    for pdf_path, name in pdf_files.items():
+        try:
+            checked = manifest.check(name, pdf_path)
+        except OSError as e:
+            print(f"读取文件失败 ({name}): {e}")
+            continue
+        if checked is not None:
+            new_files[pdf_path] = checked
+
+    skipped = len(pdf_files) - len(new_files)
+    print(f"共 {len(pdf_files)} 个PDF文件，{skipped} 个已导出，{len(new_files)} 个需要处理")
+    if not new_files:
+        manifest.save()
+        return None
+
+    if mode == "master":
+        output_path = os.path.join(directory_path, master_file)
+        wb, ws, serial_number = open_master_workbook(output_path)
+        # 汇总表中已有的发票再次以新文件出现时同样算作重复
+        seen_numbers = summary_invoice_numbers(ws)
+    else:
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        output_path = os.path.join(directory_path, f"发票数据增量_{timestamp}.xlsx")
+        wb, ws = entry.create_summary_workbook(entry.SUMMARY_HEADERS, streaming=True)
+        serial_number = 1
+        seen_numbers = set()
+
+    entry.run_metrics.reset()
+    pdf_paths = list(new_files)
+    journal = JobJournal.for_directory(directory_path, kind=JOB_INCREMENTAL)
+    exporter = InvoiceExporter(
+        XlsxSink(ws), serial_number=serial_number, duplicates=entry.DUPLICATE_INVOICES, seen_numbers=seen_numbers
+    )
+    # 检查清单时已经计算过内容哈希，查询缓存时不再重新读取文件
+    digests = {pdf_path: digest for pdf_path, (digest, _) in new_files.items()}
+    exported: Dict[str, Optional[Tuple[int, int]]] = {}
+    failed, replaced = [], 0
+    for pdf_path, invoices, error in entry.iter_parse_invoices_resumable(
+            pdf_paths, journal, max_workers, batch_size, parse_processes, digests
+    ):
+        pdf_file = pdf_files[pdf_path]
+        if error is not None:
+            failed.append(pdf_file)
+            print(f"处理文件 {pdf_file} 时出错: {error}")
+            # 汇总表中不保留错误行（也保留文件原来的行），失败的文件下次运行时重试
+            if mode == "master":
+                continue
+        with entry.run_metrics.stage("row_write", [pdf_path]):
+            if mode == "master":
+                old_rows = manifest.master_rows(pdf_file)
+                replace_master_rows(ws, exporter, old_rows)
+                replaced += old_rows is not None
+            first_serial = exporter.serial_number
+            count = exporter.write(pdf_path, invoices, error)
+        if error is None:
+            exported[pdf_path] = (first_serial, count) if mode == "master" else None
+
+    wb.save(output_path)
+    for pdf_path, rows in exported.items():
+        manifest.update(pdf_files[pdf_path], *new_files[pdf_path], rows=rows)
+    manifest.save()
+    journal.finish()
+
+    print(f"\n处理完成！新增 {len(exported)} 个文件，写入 {exporter.rows_written} 行数据")
+    if replaced:
+        print(f"其中 {replaced} 个文件修改过，已替换汇总表中原来的行")
+    if exporter.duplicate_count:
+        print(f"发现 {exporter.duplicate_count} 张重复的发票（发票号码与之前的文件相同）")
+    if failed:
+        print(f"{len(failed)} 个文件识别失败，下次运行时将重试: {', '.join(failed)}")
+    print(f"Excel文件已保存到: {output_path}")
+    entry.run_metrics.finish()
+    print(entry.run_metrics.format_summary())
+    return output_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="增量处理：只识别目录中新增或修改过的PDF")
+    parser.add_argument("directory", help="PDF文件所在目录")
+    parser.add_argument("--mode", choices=MODES, default="master",
+                        help="master：追加到汇总表；delta：生成只含新增发票的增量表")
+    parser.add_argument("--master-file", default=MASTER_FILE, help="master 模式的汇总表文件名")
+    parser.add_argument("--workers", type=int, default=entry.DEFAULT_MAX_WORKERS, help="并发数")
+    parser.add_argument("--batch-size", type=int, default=entry.DEFAULT_BATCH_SIZE,
+                        help="每次AI请求包含的发票数量")
+    parser.add_argument("--recursive", action="store_true", help="同时处理子目录中的PDF")
+    parser.add_argument("--include", action="append", help="只处理匹配的文件（通配符，可重复指定）")
+    parser.add_argument("--exclude", action="append", help="跳过匹配的文件（通配符，可重复指定）")
+    args = parser.parse_args()
+
+    process_directory_incremental(
+        args.directory,
+        mode=args.mode,
+        master_file=args.master_file,
+        max_workers=args.workers,
+        batch_size=args.batch_size,
+        recursive=args.recursive,
+        include=args.include,
+        exclude=args.exclude,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+发票识别结果缓存
+
+按PDF文件内容的SHA-256哈希保存识别结果，与文件名和所在目录无关：
+同一张发票无论被重命名、复制到其他目录，还是从邮件、共享盘、GUI
+分别导入，都只需调用一次AI接口；文件内容被修改后哈希随之变化，
+不会读到过期的结果。
+
+缓存统一存放在 ~/.invoice_recognizer/ 下，并按总大小和存放时间淘汰。
+提供两种存储后端：
+- json：每条记录一个JSON文件（cache/ 目录），便于人工查看
+- sqlite：单个SQLite数据库文件（cache.db，WAL模式），支持批量查询，
+  适合上万张发票的大型归档
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, Optional
+
+# 默认缓存目录（与API密钥配置位于同一目录下）
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".invoice_recognizer", "cache")
+DEFAULT_CACHE_DB = os.path.join(os.path.expanduser("~"), ".invoice_recognizer", "cache.db")
+
+# 默认淘汰策略：总大小上限与最长保留天数
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+DEFAULT_MAX_AGE_DAYS = 365
+
+# 每写入多少条记录执行一次淘汰检查
+EVICT_EVERY_PUTS = 200
+
+
+def file_digest(file_path: str) -> str:
+    """计算文件内容的SHA-256哈希，作为缓存键"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class JsonFileCache:
+    """
+    以JSON文件保存的内容寻址缓存
+
+    每条记录保存为 <cache_dir>/<键前2位>/<键>.json，命中时刷新文件修改时间，
+    淘汰时优先删除超过保留期限的记录，再按最久未使用的顺序删除直至低于大小上限。
+    """
+
+    def __init__(
+        self,
+        cache_dir: str = DEFAULT_CACHE_DIR,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        max_age_days: float = DEFAULT_MAX_AGE_DAYS,
+    ):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self._lock = threading.Lock()
+        self._puts = 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, key: str) -> Optional[dict]:
+        """读取缓存记录，不存在或已损坏时返回 None"""
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            print(f"读取缓存失败 ({path}): {e}")
+            return None
+
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, dict]:
+        """批量读取缓存记录，返回 {键: 记录}，只包含命中的键"""
+        result = {}
+        for key in keys:
+            data = self.get(key)
+            if data is not None:
+                result[key] = data
+        return result
+
+    def put(self, key: str, data: dict):
+        """写入缓存记录（先写临时文件再替换，避免并发写入产生半个文件）"""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._puts += 1
+            should_evict = self._puts % EVICT_EVERY_PUTS == 0
+        if should_evict:
+            self.evict()
+
+    def evict(self) -> int:
+        """按保留期限和大小上限淘汰缓存记录，返回删除的记录数"""
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        removed = 0
+        expire_before = time.time() - self.max_age_days * 86400
+        total = sum(size for _, size, _ in entries)
+        for mtime, size, path in sorted(entries):
+            if mtime >= expire_before and total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        return removed
+
+
+class SqliteCache:
+    """
+    以单个SQLite数据库保存的内容寻址缓存
+
+    使用WAL模式，读写互不阻塞；每个线程使用独立连接。
+    get_many 用一条 IN 查询判断一批键是否已缓存，
+    避免大批量重跑时逐个文件打开、解析JSON。
+    """
+
+    # 单条SQL中 IN 列表的最大参数个数（SQLite默认上限为999）
+    BATCH_SIZE = 900
+
+    def __init__(
+        self,
+        db_path: str = DEFAULT_CACHE_DB,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        max_age_days: float = DEFAULT_MAX_AGE_DAYS,
+    ):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._puts = 0
+
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS cache (
+                key TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_accessed ON cache (accessed_at)")
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[dict]:
+        """读取缓存记录，不存在或已损坏时返回 None"""
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, dict]:
+        """批量读取缓存记录，返回 {键: 记录}，只包含命中的键"""
+        keys = list(dict.fromkeys(keys))
+        result = {}
+        conn = self._conn()
+        now = time.time()
+        for start in range(0, len(keys), self.BATCH_SIZE):
+            batch = keys[start:start + self.BATCH_SIZE]
+            placeholders = ",".join("?" * len(batch))
+            rows = conn.execute(
+                f"SELECT key, data FROM cache WHERE key IN ({placeholders})", batch
+            ).fetchall()
+            for key, data in rows:
+                try:
+                    result[key] = json.loads(data)
+                except ValueError as e:
+                    print(f"读取缓存失败 (键: {key}): {e}")
+            if rows:
+                conn.execute(
+                    f"UPDATE cache SET accessed_at = ? WHERE key IN ({placeholders})",
+                    [now, *batch],
+                )
+        conn.commit()
+        return result
+
+    def put(self, key: str, data: dict):
+        """写入缓存记录"""
+        payload = json.dumps(data, ensure_ascii=False)
+        now = time.time()
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache (key, data, size, created_at, accessed_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (key, payload, len(payload.encode("utf-8")), now, now),
+        )
+        conn.commit()
+
+        with self._lock:
+            self._puts += 1
+            should_evict = self._puts % EVICT_EVERY_PUTS == 0
+        if should_evict:
+            self.evict()
+
+    def evict(self) -> int:
+        """按保留期限和大小上限淘汰缓存记录，返回删除的记录数"""
+        conn = self._conn()
+        expire_before = time.time() - self.max_age_days * 86400
+        removed = conn.execute(
+            "DELETE FROM cache WHERE accessed_at < ?", (expire_before,)
+        ).rowcount
+
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+        if total > self.max_bytes:
+            doomed = []
+            for key, size in conn.execute(
+                "SELECT key, size FROM cache ORDER BY accessed_at"
+            ):
+                if total <= self.max_bytes:
+                    break
+                doomed.append((key,))
+                total -= size
+            conn.executemany("DELETE FROM cache WHERE key = ?", doomed)
+            removed += len(doomed)
+        conn.commit()
+        return removed
+
+
+def create_cache(backend: str = "json", **kwargs):
+    """
+    按名称创建缓存后端
+
+    Args:
+        backend: "json"（每条记录一个文件）或 "sqlite"（单个数据库文件）
+        **kwargs: 传给对应后端构造函数的参数
+
+    Returns:
+        JsonFileCache 或 SqliteCache 实例
+    """
+    if backend == "json":
+        return JsonFileCache(**kwargs)
+    if backend == "sqlite":
+        return SqliteCache(**kwargs)
+    raise ValueError(f"未知的缓存后端: {backend}")
@@ -0,0 +1,654 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+识别结果的导出引擎
+
+汇总表的27列只在 SUMMARY_COLUMNS 中定义一次（表头、取自发票还是货物的哪个字段），
+命令行、GUI、增量处理和监视文件夹都通过这里生成和写出数据行：
+- ColumnSpec 在创建时把列定义预编译为两个取值函数（发票字段、货物字段各一个 attrgetter）
+  和一份拼接布局，一个文件的全部行一次生成为元组，不再逐个单元格取值
+- 每个货物一行；没有货物的发票写一行发票信息；识别失败的文件写一行错误信息（备注列）；
+  识别结果有问题（InvoiceInfo.warning，如校验未通过）的发票照常写入，汇总表中备注列写明问题
+- 生成的行交给 sink 写出：XlsxSink 写入 openpyxl 工作表（错误行的备注列为红色背景），
+  其他输出格式只需实现 write_rows 和 write_error_row（不写错误行的设置 writes_errors = False）
+- 同一发票号码的发票以不同文件名多次出现时，可以照常写入、在汇总表中整行标为黄色，
+  或者不写入（见 DUPLICATE_POLICIES）
+
+供数据仓库等分析工具使用时，可以同时导出带类型的 CSV、JSON Lines 和 Parquet
+（见 open_export）：列名为英文字段名，金额、单价等保持数值类型和完整精度，
+可以每个货物一条记录（items），也可以每张发票一条记录、货物作为嵌套列表（nested）。
+Parquet 需要安装 pyarrow。
+"""
+
+import csv
+import json
+import os
+from dataclasses import dataclass
+from operator import attrgetter
+from typing import Callable, Iterable, List, Optional, Sequence, Tuple
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Font, PatternFill
+from openpyxl.utils import get_column_letter
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+HEADER_FONT = Font(bold=True, color="FFFFFF")
+HEADER_FILL = PatternFill(start_color="808080", end_color="808080", fill_type="solid")
+HEADER_ALIGNMENT = Alignment(horizontal="center", vertical="center")
+ERROR_FILL = PatternFill(start_color="FFCCCC", end_color="FFCCCC", fill_type="solid")
+DUPLICATE_FILL = PatternFill(start_color="FFF2CC", end_color="FFF2CC", fill_type="solid")
+COLUMN_WIDTH = 15
+
+# 同一发票号码再次出现时的处理方式（见 InvoiceExporter）
+DUPLICATE_KEEP = "keep"  # 照常写入
+DUPLICATE_FLAG = "flag"  # 汇总表中照常写入并整行标为黄色，数据文件中不写入
+DUPLICATE_SKIP = "skip"  # 不写入
+DUPLICATE_POLICIES = (DUPLICATE_KEEP, DUPLICATE_FLAG, DUPLICATE_SKIP)
+
+# Parquet 每个行组包含的行数（行组越大压缩越好，写出时占用的内存越多）
+PARQUET_ROW_GROUP = 100_000
+
+# 列的取值来源
+SERIAL = "serial"  # 序号
+BLANK = "blank"  # 留空（PDF中没有的信息）
+INVOICE = "invoice"  # InvoiceInfo 的字段
+ITEM = "item"  # InvoiceItem 的字段（没有货物时留空）
+FILE = "file"  # 发票所在的PDF文件名
+
+
+@dataclass(frozen=True)
+class Column:
+    """汇总表的一列"""
+
+    header: str
+    source: str  # SERIAL / BLANK / INVOICE / ITEM / FILE
+    field: str = ""  # source 为 INVOICE / ITEM 时的字段名
+    convert: Optional[Callable] = None  # 写出前的转换（如布尔值转为"是/否"）
+    kind: Optional[str] = None  # 带类型输出时的类型："str" / "float" / "bool"，同时决定默认的转换
+
+
+def _yes_no(value) -> str:
+    return "是" if value else "否"
+
+
+def _to_str(value) -> str:
+    return "" if value is None else str(value)
+
+
+def _to_float(value) -> Optional[float]:
+    """AI返回的数字可能是字符串（含 ¥ 和千分位），无法识别时为空值"""
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(str(value).replace("¥", "").replace("￥", "").replace(",", "").strip())
+    except ValueError:
+        return None
+
+
+KIND_CONVERTERS = {"str": _to_str, "float": _to_float, "bool": bool}
+
+
+# 汇总表的27列
+SUMMARY_COLUMNS = [
+    Column("序号", SERIAL),
+    Column("发票代码", BLANK),  # 通常PDF中不包含
+    Column("发票号码", BLANK),  # 留空，数电发票号码列会填写
+    Column("数电发票号码", INVOICE, "invoice_number"),
+    Column("销方识别号", INVOICE, "seller_tax_id"),
+    Column("销方名称", INVOICE, "seller_name"),
+    Column("购方识别号", INVOICE, "buyer_tax_id"),
+    Column("购买方名称", INVOICE, "buyer_name"),
+    Column("开票日期", INVOICE, "invoice_date"),
+    Column("税收分类编码", INVOICE, "tax_classification_code"),
+    Column("特定业务类型", INVOICE, "special_business_type"),
+    Column("货物或应税劳务名称", ITEM, "name"),
+    Column("规格型号", ITEM, "specification"),
+    Column("单位", ITEM, "unit"),
+    Column("数量", ITEM, "quantity"),
+    Column("单价", ITEM, "unit_price"),
+    Column("金额", ITEM, "amount"),
+    Column("税率", ITEM, "tax_rate"),
+    Column("税额", ITEM, "tax_amount"),
+    Column("价税合计", ITEM, "total_with_tax"),
+    Column("发票来源", INVOICE, "invoice_source"),
+    Column("发票票种", INVOICE, "invoice_type"),
+    Column("发票状态", INVOICE, "invoice_status"),
+    Column("是否正数发票", INVOICE, "is_positive_invoice", _yes_no),
+    Column("发票风险等级", INVOICE, "invoice_risk_level"),
+    Column("开票人", INVOICE, "issuer"),
+    Column("备注", INVOICE, "remarks"),
+]
+
+
+def _getter(fields: List[str]) -> Callable[[object], tuple]:
+    """返回一次取出多个字段、总是返回元组的函数"""
+    if not fields:
+        return lambda obj: ()
+    if len(fields) == 1:
+        getter = attrgetter(fields[0])
+        return lambda obj: (getter(obj),)
+    return attrgetter(*fields)
+
+
+class ColumnSpec:
+    """
+    预编译的列定义
+
+    同一来源的相邻列合并为一段，生成一行时只需按段拼接发票字段元组和货物字段元组。
+    错误信息写在最后一列（备注）。
+    """
+
+    def __init__(self, columns: Sequence[Column]):
+        self.columns = tuple(columns)
+        self.headers = [column.header for column in self.columns]
+        self.error_column = len(self.columns) - 1
+
+        invoice_fields, item_fields = [], []
+        self._invoice_converters: List[Tuple[int, Callable]] = []
+        self._item_converters: List[Tuple[int, Callable]] = []
+        self._segments: List[Tuple[str, int, int]] = []
+        for column in self.columns:
+            if column.source == INVOICE:
+                fields, converters = invoice_fields, self._invoice_converters
+            elif column.source == ITEM:
+                fields, converters = item_fields, self._item_converters
+            elif column.source in (SERIAL, BLANK, FILE):
+                fields, converters = None, None
+            else:
+                raise ValueError(f"未知的列来源: {column.source}")
+
+            position = len(fields) if fields is not None else 0
+            if fields is not None:
+                convert = column.convert or KIND_CONVERTERS.get(column.kind)
+                if convert is not None:
+                    converters.append((position, convert))
+                fields.append(column.field)
+            if self._segments and self._segments[-1][0] == column.source and column.source not in (SERIAL, FILE):
+                source, start, stop = self._segments[-1]
+                self._segments[-1] = (source, start, stop + 1)
+            else:
+                self._segments.append((column.source, position, position + 1))
+
+        self._invoice_values = _getter(invoice_fields)
+        self._item_values = _getter(item_fields)
+        self._empty_item = (None if self.typed else "",) * len(item_fields)
+        self._blanks = ("",) * len(self.columns)
+        self._serial_columns = [i for i, column in enumerate(self.columns) if column.source == SERIAL]
+        # 没有货物列时每张发票只生成一行
+        self.has_items = bool(item_fields)
+
+    @property
+    def typed(self) -> bool:
+        """是否为带类型输出的列定义（各列都指定了 kind）"""
+        return all(column.kind or column.source == SERIAL for column in self.columns)
+
+    @property
+    def kinds(self) -> List[str]:
+        """各列的类型（序号为 int，留空列为 str）"""
+        return [
+            "int" if column.source == SERIAL else column.kind or "str"
+            for column in self.columns
+        ]
+
+    def item_values(self, item) -> tuple:
+        """一个货物各列的值（已转换）"""
+        return self._converted(self._item_values(item), self._item_converters)
+
+    def _converted(self, values: tuple, converters) -> tuple:
+        if not converters:
+            return values
+        values = list(values)
+        for position, convert in converters:
+            values[position] = convert(values[position])
+        return tuple(values)
+
+    def _assemble(self, serial_number: int, file_name: str, invoice_values: tuple, item_values: tuple) -> tuple:
+        row: list = []
+        for source, start, stop in self._segments:
+            if source == INVOICE:
+                row.extend(invoice_values[start:stop])
+            elif source == ITEM:
+                row.extend(item_values[start:stop])
+            elif source == SERIAL:
+                row.append(serial_number)
+            elif source == FILE:
+                row.append(file_name)
+            else:
+                row.extend(self._blanks[start:stop])
+        return tuple(row)
+
+    def invoice_rows(self, invoices, serial_number: int, file_name: str = "") -> List[tuple]:
+        """
+        将发票列表展开为数据行：每个货物一行，没有货物的发票一行
+
+        Args:
+            invoices: InvoiceInfo 列表（同一文件中的发票按顺序排列）
+            serial_number: 第一行的序号
+            file_name: 发票所在的PDF文件名（FILE 列）
+        """
+        rows: List[tuple] = []
+        for invoice_info in invoices:
+            invoice_values = self._converted(self._invoice_values(invoice_info), self._invoice_converters)
+            items = (invoice_info.items or [None]) if self.has_items else [None]
+            for item in items:
+                item_values = self._empty_item if item is None else self.item_values(item)
+                rows.append(self._assemble(serial_number + len(rows), file_name, invoice_values, item_values))
+        return rows
+
+    def error_row(self, serial_number: int, message: str) -> tuple:
+        """识别失败的文件：只有序号和最后一列中的错误信息"""
+        row = list(self._blanks)
+        for index in self._serial_columns:
+            row[index] = serial_number
+        row[self.error_column] = message
+        return tuple(row)
+
+
+class NestedColumnSpec:
+    """
+    每张发票一条记录的列定义：发票各列之后是 items 列，
+    其中每个货物为一个 {列名: 值} 字典
+
+    与 ColumnSpec 的接口相同，可以直接交给 InvoiceExporter。
+    """
+
+    def __init__(self, invoice_columns: Sequence[Column], item_columns: Sequence[Column]):
+        self._invoice_spec = ColumnSpec(invoice_columns)
+        self._item_spec = ColumnSpec(item_columns)
+        if self._invoice_spec.has_items:
+            raise ValueError("发票列中不能包含货物字段")
+        self.item_headers = self._item_spec.headers
+        self.item_kinds = self._item_spec.kinds
+        self.headers = self._invoice_spec.headers + ["items"]
+        self.kinds = self._invoice_spec.kinds + ["items"]
+
+    def invoice_rows(self, invoices, serial_number: int, file_name: str = "") -> List[tuple]:
+        rows: List[tuple] = []
+        headers = self.item_headers
+        for invoice_info in invoices:
+            row = self._invoice_spec.invoice_rows([invoice_info], serial_number + len(rows), file_name)[0]
+            items = [dict(zip(headers, self._item_spec.item_values(item))) for item in invoice_info.items or []]
+            rows.append(row + (items,))
+        return rows
+
+    def error_row(self, serial_number: int, message: str) -> tuple:
+        return self._invoice_spec.error_row(serial_number, message) + ([],)
+
+
+
+SUMMARY_SPEC = ColumnSpec(SUMMARY_COLUMNS)
+SUMMARY_HEADERS = SUMMARY_SPEC.headers
+
+# 带类型输出的列：发票字段和货物字段（货物名称列名为 item_name，避免与其他名称混淆）
+RECORD_INVOICE_COLUMNS = [
+    Column(field, INVOICE, field, kind=kind)
+    for field, kind in (
+        ("invoice_number", "str"), ("seller_tax_id", "str"), ("seller_name", "str"),
+        ("buyer_tax_id", "str"), ("buyer_name", "str"), ("invoice_date", "str"),
+        ("tax_classification_code", "str"), ("special_business_type", "str"),
+        ("invoice_source", "str"), ("invoice_type", "str"), ("invoice_status", "str"),
+        ("is_positive_invoice", "bool"), ("invoice_risk_level", "str"),
+        ("issuer", "str"), ("remarks", "str"), ("warning", "str"),
+    )
+]
+RECORD_ITEM_COLUMNS = [
+    Column("item_name" if field == "name" else field, ITEM, field, kind=kind)
+    for field, kind in (
+        ("name", "str"), ("specification", "str"), ("unit", "str"), ("quantity", "float"),
+        ("unit_price", "float"), ("amount", "float"), ("tax_rate", "str"),
+        ("tax_amount", "float"), ("total_with_tax", "float"),
+    )
+]
+RECORD_PREFIX_COLUMNS = [Column("file", FILE, kind="str"), Column("serial", SERIAL)]
+
+
+# 带类型输出的两种布局：每个货物一条记录 / 每张发票一条记录（货物嵌套）
+EXPORT_LAYOUTS = {
+    "items": ColumnSpec(RECORD_PREFIX_COLUMNS + RECORD_INVOICE_COLUMNS + RECORD_ITEM_COLUMNS),
+    "nested": NestedColumnSpec(RECORD_PREFIX_COLUMNS + RECORD_INVOICE_COLUMNS, RECORD_ITEM_COLUMNS),
+}
+
+
+def create_summary_workbook(headers, streaming: bool = False):
+    """
+    创建汇总工作簿，写入带样式的表头并设置列宽
+
+    Args:
+        headers: 表头列表
+        streaming: 为 True 时使用openpyxl只写模式（write_only），
+            行写出后即序列化到临时文件，适合几十万行的超大批次
+
+    Returns:
+        (wb, ws): 工作簿和"发票数据"工作表，之后用 XlsxSink 或 append_summary_row 写入
+    """
+    if streaming:
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet("发票数据")
+    else:
+        wb = Workbook()
+        ws = wb.active
+        if ws is None:
+            ws = wb.create_sheet("发票数据")
+        ws.title = "发票数据"
+
+    # 调整列宽（只写模式下必须在写入数据之前设置）
+    for col in range(1, len(headers) + 1):
+        ws.column_dimensions[get_column_letter(col)].width = COLUMN_WIDTH
+
+    # 写入表头
+    header_cells = []
+    for header in headers:
+        cell = WriteOnlyCell(ws, value=header)
+        cell.font = HEADER_FONT
+        cell.fill = HEADER_FILL
+        cell.alignment = HEADER_ALIGNMENT
+        header_cells.append(cell)
+    ws.append(header_cells)
+
+    return wb, ws
+
+
+def summary_invoice_numbers(ws) -> set:
+    """已有汇总表中的发票号码（追加写入时作为 InvoiceExporter 的 seen_numbers）"""
+    headers = [cell.value for cell in next(ws.iter_rows(min_row=1, max_row=1))]
+    if "数电发票号码" not in headers:
+        return set()
+    column = headers.index("数电发票号码") + 1
+    return {
+        str(value) for (value,) in ws.iter_rows(min_row=2, min_col=column, max_col=column, values_only=True)
+        if value
+    }
+
+
+def append_summary_row(ws, row_data, error: bool = False, duplicate: bool = False):
+    """
+    在汇总表末尾追加一整行
+
+    Args:
+        ws: create_summary_workbook 返回的工作表
+        row_data: 行数据
+        error: 是否为错误行（最后一列设置红色背景）
+        duplicate: 是否为重复发票的行（整行设置黄色背景）
+    """
+    if error:
+        row_data = list(row_data)
+        cell = WriteOnlyCell(ws, value=row_data[-1])
+        cell.fill = ERROR_FILL
+        row_data[-1] = cell
+    elif duplicate:
+        cells = []
+        for value in row_data:
+            cell = WriteOnlyCell(ws, value=value)
+            cell.fill = DUPLICATE_FILL
+            cells.append(cell)
+        row_data = cells
+    ws.append(row_data)
+
+
+class XlsxSink:
+    """写入 openpyxl 工作表（只写模式或普通模式均可）"""
+
+    writes_errors = True
+
+    def __init__(self, ws):
+        self.ws = ws
+
+    def write_rows(self, rows: List[tuple]):
+        append = self.ws.append
+        for row in rows:
+            append(row)
+
+    def write_error_row(self, row: tuple):
+        append_summary_row(self.ws, row, error=True)
+
+    def write_duplicate_rows(self, rows: List[tuple]):
+        for row in rows:
+            append_summary_row(self.ws, row, duplicate=True)
+
+    def write_warning_rows(self, rows: List[tuple], warning: str):
+        """识别结果有问题的发票：问题写在备注列之前，备注列设置红色背景"""
+        for row in rows:
+            remarks = row[-1]
+            append_summary_row(self.ws, row[:-1] + (f"{warning}；{remarks}" if remarks else warning,), error=True)
+
+
+def _csv_value(value):
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, list):
+        return json.dumps(value, ensure_ascii=False)
+    return "" if value is None else value
+
+
+class CsvSink:
+    """
+    带表头的UTF-8 CSV
+
+    数字按完整精度写出，布尔值写为 true/false，空值为空字符串，
+    嵌套布局的货物列表写为JSON。识别失败的文件不写入（错误信息见汇总表和日志）。
+    """
+
+    writes_errors = False
+
+    def __init__(self, path: str, spec):
+        self.path = path
+        self._file = open(path, "w", encoding="utf-8", newline="")
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(spec.headers)
+
+    def write_rows(self, rows: List[tuple]):
+        self._writer.writerows([_csv_value(value) for value in row] for row in rows)
+
+    def close(self):
+        self._file.close()
+
+
+class JsonlSink:
+    """每行一个JSON对象（列名为键），识别失败的文件不写入"""
+
+    writes_errors = False
+
+    def __init__(self, path: str, spec):
+        self.path = path
+        self.headers = list(spec.headers)
+        self._file = open(path, "w", encoding="utf-8")
+
+    def write_rows(self, rows: List[tuple]):
+        headers = self.headers
+        self._file.write("".join(
+            json.dumps(dict(zip(headers, row)), ensure_ascii=False) + "\n" for row in rows
+        ))
+
+    def close(self):
+        self._file.close()
+
+
+def _arrow_type(kind: str):
+    return {"str": pa.string(), "float": pa.float64(), "int": pa.int64(), "bool": pa.bool_()}[kind]
+
+
+class ParquetSink:
+    """
+    Parquet 文件（需要安装 pyarrow）
+
+    按列定义的类型建立schema，每累积 row_group_size 行写出一个行组，
+    内存占用与总行数无关。嵌套布局的货物列为 list<struct>。
+    识别失败的文件不写入。
+    """
+
+    writes_errors = False
+
+    def __init__(self, path: str, spec, row_group_size: int = PARQUET_ROW_GROUP):
+        if pa is None:
+            raise ImportError("导出Parquet需要安装 pyarrow: pip install pyarrow")
+        fields = []
+        for header, kind in zip(spec.headers, spec.kinds):
+            if kind == "items":
+                item_type = pa.struct([
+                    pa.field(name, _arrow_type(item_kind))
+                    for name, item_kind in zip(spec.item_headers, spec.item_kinds)
+                ])
+                fields.append(pa.field(header, pa.list_(item_type)))
+            else:
+                fields.append(pa.field(header, _arrow_type(kind)))
+        self.path = path
+        self.schema = pa.schema(fields)
+        self.row_group_size = row_group_size
+        self._rows: List[tuple] = []
+        self._writer = pq.ParquetWriter(path, self.schema)
+
+    def write_rows(self, rows: List[tuple]):
+        self._rows.extend(rows)
+        if len(self._rows) >= self.row_group_size:
+            self._flush()
+
+    def _flush(self):
+        if not self._rows:
+            return
+        columns = list(zip(*self._rows))
+        self._rows = []
+        arrays = [pa.array(column, type=field.type) for column, field in zip(columns, self.schema)]
+        self._writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        self._flush()
+        self._writer.close()
+
+
+# 带类型输出的格式（按文件扩展名选择）
+EXPORT_FORMATS = {"csv": CsvSink, "jsonl": JsonlSink, "parquet": ParquetSink}
+
+
+class InvoiceExporter:
+    """
+    按列定义把识别结果写入 sink，并负责序号
+
+    Args:
+        sink: 实现 write_rows(rows) 和 write_error_row(row) 的对象；
+            writes_errors 为 False 的 sink 不写识别失败的文件；
+            实现了 write_warning_rows(rows, warning) 的 sink（汇总表）单独写出带 warning 的发票
+        spec: 列定义，默认为汇总表的27列
+        serial_number: 第一行的序号（追加到已有表格时接着已有的序号）
+        duplicates: 发票号码已写入过的发票的处理方式（见 DUPLICATE_POLICIES）；
+            DUPLICATE_FLAG 时实现了 write_duplicate_rows 的 sink（汇总表）标记后写入，其他 sink 不写入
+        seen_numbers: 已写入过的发票号码（追加到已有表格时传入表格中已有的号码）
+    """
+
+    def __init__(
+            self,
+            sink,
+            spec=SUMMARY_SPEC,
+            serial_number: int = 1,
+            duplicates: str = DUPLICATE_KEEP,
+            seen_numbers: Optional[Iterable[str]] = None,
+    ):
+        if duplicates not in DUPLICATE_POLICIES:
+            raise ValueError(f"未知的重复发票处理方式: {duplicates}（可选 {', '.join(DUPLICATE_POLICIES)}）")
+        self.sink = sink
+        self.spec = spec
+        self.serial_number = serial_number
+        self.duplicates = duplicates
+        self.seen_numbers = set(seen_numbers or ())
+        self.rows_written = 0
+        self.duplicate_count = 0  # 发现的重复发票数
+
+    def write(self, file_path: str, invoices, error: Optional[BaseException]) -> int:
+        """
+        写入一个文件的识别结果
+
+        Args:
+            file_path: PDF文件路径（错误信息中显示文件名）
+            invoices: 文件中的发票列表，失败时为 None
+            error: 识别失败的异常，成功时为 None
+
+        Returns:
+            写入的行数
+        """
+        if error is None:
+            file_name = os.path.basename(file_path)
+            invoices, duplicates = self._split_duplicates(invoices)
+            count = self._write_invoices(invoices, file_name)
+            write_duplicate_rows = getattr(self.sink, "write_duplicate_rows", None)
+            if duplicates and self.duplicates == DUPLICATE_FLAG and write_duplicate_rows is not None:
+                rows = self.spec.invoice_rows(duplicates, self.serial_number + count, file_name)
+                write_duplicate_rows(rows)
+                count += len(rows)
+        elif not getattr(self.sink, "writes_errors", True):
+            return 0
+        else:
+            message = f"解析失败 (文件: {os.path.basename(file_path)}): {error}"
+            self.sink.write_error_row(self.spec.error_row(self.serial_number, message))
+            count = 1
+        self.serial_number += count
+        self.rows_written += count
+        return count
+
+    def _write_invoices(self, invoices, file_name: str) -> int:
+        """写出首次出现的发票，返回行数；带 warning 的发票交给 sink 的 write_warning_rows"""
+        write_warning_rows = getattr(self.sink, "write_warning_rows", None)
+        if write_warning_rows is None or not any(invoice_info.warning for invoice_info in invoices):
+            rows = self.spec.invoice_rows(invoices, self.serial_number, file_name)
+            self.sink.write_rows(rows)
+            return len(rows)
+
+        count = 0
+        for invoice_info in invoices:
+            rows = self.spec.invoice_rows([invoice_info], self.serial_number + count, file_name)
+            if invoice_info.warning:
+                write_warning_rows(rows, invoice_info.warning)
+            else:
+                self.sink.write_rows(rows)
+            count += len(rows)
+        return count
+
+    def _split_duplicates(self, invoices):
+        """把发票分为 (首次出现的, 发票号码已写入过的)，没有号码的发票不算重复"""
+        if self.duplicates == DUPLICATE_KEEP:
+            return invoices, []
+        fresh, duplicates = [], []
+        for invoice_info in invoices:
+            number = invoice_info.invoice_number
+            if number and number in self.seen_numbers:
+                duplicates.append(invoice_info)
+            else:
+                if number:
+                    self.seen_numbers.add(number)
+                fresh.append(invoice_info)
+        self.duplicate_count += len(duplicates)
+        return fresh, duplicates
+
+    def close(self):
+        """关闭 sink（写出缓存的行组、关闭文件）；XlsxSink 由调用方保存工作簿"""
+        close = getattr(self.sink, "close", None)
+        if close is not None:
+            close()
+
+
+def open_export(path: str, layout: str = "items", duplicates: str = DUPLICATE_KEEP) -> InvoiceExporter:
+    """
+    打开一个带类型的导出文件，格式按扩展名选择（.csv / .jsonl / .parquet）
+
+    Args:
+        path: 输出文件路径
+        layout: "items" 每个货物一条记录；"nested" 每张发票一条记录，货物在 items 列中
+        duplicates: 重复发票的处理方式（见 InvoiceExporter），数据文件中 flag 与 skip 相同
+
+    Returns:
+        写入该文件的 InvoiceExporter，全部写完后调用 close()
+    """
+    extension = os.path.splitext(path)[1].lower().lstrip(".")
+    if extension not in EXPORT_FORMATS:
+        raise ValueError(f"不支持的导出格式: {extension}（可选 {', '.join(EXPORT_FORMATS)}）")
+    if layout not in EXPORT_LAYOUTS:
+        raise ValueError(f"未知的导出布局: {layout}（可选 {', '.join(EXPORT_LAYOUTS)}）")
+    spec = EXPORT_LAYOUTS[layout]
+    return InvoiceExporter(EXPORT_FORMATS[extension](path, spec), spec, duplicates=duplicates)
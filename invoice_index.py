@@ -0,0 +1,398 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+已识别发票的本地查询索引
+
+识别结果原本只保存在缓存和各次导出的表格中，按销方、购方、日期或金额查找发票
+需要逐个打开文件。InvoiceIndex 把每张发票的关键字段写入一个SQLite数据库
+（默认 ~/.invoice_recognizer/index.db），并在销方识别号、购方识别号、
+开票日期（统一为 YYYY-MM-DD）和价税合计上建立索引，
+十万张发票规模的归档中按条件查询只需几毫秒。
+
+entry.py 在识别完成或命中缓存时自动写入索引（见 entry.invoice_index），
+因此对已有的归档重新运行一次（全部命中缓存，不调用AI）即可建立索引，
+也可以用 --add 只把目录中已缓存的发票加入索引。
+
+使用方法：
+python invoice_index.py --seller 91320506MA1MMRPX1T --quarter 2024Q3 --min-total 10000
+python invoice_index.py --buyer 91340700MA8P9Y7Y9D --from 2024-07-01 --to 2024-09-30
+python invoice_index.py --number 24322000000479248343
+python invoice_index.py --add ./pdf_files --recursive
+"""
+
+import argparse
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from datetime import date
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+# 默认索引数据库（与缓存位于同一目录下）
+DEFAULT_INDEX_DB = os.path.join(os.path.expanduser("~"), ".invoice_recognizer", "index.db")
+
+# 开票日期的常见写法：2024年11月29日、2024-11-29、2024/11/29、2024.11.29、20241129
+DATE_RE = re.compile(r"(\d{4})\s*[年\-/.]\s*(\d{1,2})\s*[月\-/.]\s*(\d{1,2})")
+COMPACT_DATE_RE = re.compile(r"(?<!\d)(\d{4})(\d{2})(\d{2})(?!\d)")
+
+# 季度写法：2024Q3、2024-Q3、2024q3
+QUARTER_RE = re.compile(r"^(\d{4})-?[Qq]([1-4])$")
+
+# 查询结果的字段（与数据表的列一致，data 为完整的发票字典）
+RESULT_COLUMNS = (
+    "file_path", "invoice_number", "seller_tax_id", "seller_name", "buyer_tax_id", "buyer_name",
+    "invoice_date", "amount", "tax_amount", "total_with_tax", "data",
+)
+
+
+def normalize_date(text) -> Optional[str]:
+    """把开票日期统一为 YYYY-MM-DD，无法识别时返回 None"""
+    if not isinstance(text, str):
+        return None
+    match = DATE_RE.search(text) or COMPACT_DATE_RE.search(text)
+    if not match:
+        return None
+    try:
+        return date(int(match.group(1)), int(match.group(2)), int(match.group(3))).isoformat()
+    except ValueError:
+        return None
+
+
+def quarter_range(quarter: str) -> Tuple[str, str]:
+    """季度对应的起止日期（含），如 "2024Q3" -> ("2024-07-01", "2024-09-30")"""
+    match = QUARTER_RE.match(quarter.strip())
+    if not match:
+        raise ValueError(f"无法识别的季度: {quarter}（应为 2024Q3 的形式）")
+    year, index = int(match.group(1)), int(match.group(2))
+    last_days = {1: 31, 2: 30, 3: 30, 4: 31}
+    start = date(year, index * 3 - 2, 1)
+    end = date(year, index * 3, last_days[index])
+    return start.isoformat(), end.isoformat()
+
+
+def _number(value) -> Optional[float]:
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(str(value).replace("¥", "").replace("￥", "").replace(",", "").strip())
+    except ValueError:
+        return None
+
+
+def _item_sum(items, field: str) -> Optional[float]:
+    """货物某一金额字段之和，没有货物或含有无法识别的数字时为 None"""
+    if not isinstance(items, list) or not items:
+        return None
+    values = [_number(item.get(field)) if isinstance(item, dict) else None for item in items]
+    if None in values:
+        return None
+    return round(sum(values), 2)
+
+
+def _text(value) -> str:
+    return value.strip() if isinstance(value, str) else ""
+
+
+@dataclass
+class IndexedInvoice:
+    """查询结果中的一张发票"""
+
+    file_path: str  # 最近一次识别或读取缓存时的PDF路径
+    invoice_number: str
+    seller_tax_id: str
+    seller_name: str
+    buyer_tax_id: str
+    buyer_name: str
+    invoice_date: Optional[str]  # YYYY-MM-DD，无法识别时为 None
+    amount: Optional[float]  # 货物金额之和
+    tax_amount: Optional[float]  # 货物税额之和
+    total_with_tax: Optional[float]  # 价税合计
+    data: dict  # 完整的发票字典（字段与AI返回的JSON一致）
+
+
+class InvoiceIndex:
+    """
+    以SQLite保存的发票查询索引
+
+    每张发票一行，以 (PDF内容哈希, 在PDF中的顺序) 为主键：同一PDF重新写入时
+    先删除旧的行，重命名或移动过的PDF只更新路径。
+    与 invoice_cache.SqliteCache 相同，使用WAL模式，每个线程使用独立连接。
+    数据库文件在第一次读写时才创建，只创建对象（如导入 entry 时）不会在磁盘上留下文件。
+    """
+
+    def __init__(self, db_path: str = DEFAULT_INDEX_DB):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._init_lock = threading.Lock()
+        self._initialized = False
+
+    def _initialize(self):
+        """创建数据库目录、表和索引（每个对象只执行一次）"""
+        with self._init_lock:
+            if self._initialized:
+                return
+            db_dir = os.path.dirname(self.db_path)
+            if db_dir:
+                os.makedirs(db_dir, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            try:
+                self._create_schema(conn)
+            finally:
+                conn.close()
+            self._initialized = True
+
+    @staticmethod
+    def _create_schema(conn: sqlite3.Connection):
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS invoices (
+                cache_key TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                file_path TEXT NOT NULL,
+                invoice_number TEXT NOT NULL,
+                seller_tax_id TEXT NOT NULL,
+                seller_name TEXT NOT NULL,
+                buyer_tax_id TEXT NOT NULL,
+                buyer_name TEXT NOT NULL,
+                invoice_date TEXT,
+                amount REAL,
+                tax_amount REAL,
+                total_with_tax REAL,
+                data TEXT NOT NULL,
+                indexed_at REAL NOT NULL,
+                PRIMARY KEY (cache_key, seq)
+            )
+            """
+        )
+        # 按识别号查询时通常同时限定日期，因此与开票日期组成联合索引
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_invoices_seller ON invoices (seller_tax_id, invoice_date)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_invoices_buyer ON invoices (buyer_tax_id, invoice_date)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_invoices_date ON invoices (invoice_date)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_invoices_total ON invoices (total_with_tax)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_invoices_number ON invoices (invoice_number)")
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            if not self._initialized:
+                self._initialize()
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def add(self, cache_key: str, file_path: str, invoices: Sequence[dict]):
+        """写入一个PDF文件的全部发票（发票字典与缓存中的字段一致）"""
+        self.add_many([(cache_key, file_path, invoices)])
+
+    def add_many(self, entries: Iterable[Tuple[str, str, Sequence[dict]]]):
+        """在一个事务中写入多个PDF文件：[(内容哈希, PDF路径, [发票字典, ...]), ...]"""
+        now = time.time()
+        keys = []
+        rows = []
+        for cache_key, file_path, invoices in entries:
+            keys.append((cache_key,))
+            for seq, invoice in enumerate(invoices):
+                items = invoice.get("items")
+                rows.append((
+                    cache_key,
+                    seq,
+                    file_path,
+                    _text(invoice.get("invoice_number")),
+                    _text(invoice.get("seller_tax_id")).upper(),
+                    _text(invoice.get("seller_name")),
+                    _text(invoice.get("buyer_tax_id")).upper(),
+                    _text(invoice.get("buyer_name")),
+                    normalize_date(invoice.get("invoice_date")),
+                    _item_sum(items, "amount"),
+                    _item_sum(items, "tax_amount"),
+                    _item_sum(items, "total_with_tax"),
+                    json.dumps(invoice, ensure_ascii=False),
+                    now,
+                ))
+        if not keys:
+            return
+        conn = self._conn()
+        with conn:
+            conn.executemany("DELETE FROM invoices WHERE cache_key = ?", keys)
+            conn.executemany(
+                "INSERT INTO invoices (cache_key, seq, file_path, invoice_number, seller_tax_id, seller_name, "
+                "buyer_tax_id, buyer_name, invoice_date, amount, tax_amount, total_with_tax, data, indexed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+
+    def query(
+            self,
+            seller_tax_id: Optional[str] = None,
+            buyer_tax_id: Optional[str] = None,
+            date_from: Optional[str] = None,
+            date_to: Optional[str] = None,
+            min_total: Optional[float] = None,
+            max_total: Optional[float] = None,
+            invoice_number: Optional[str] = None,
+            limit: int = 0,
+    ) -> List[IndexedInvoice]:
+        """
+        按条件查询发票，条件之间为"并且"关系，结果按开票日期排序
+
+        Args:
+            seller_tax_id / buyer_tax_id: 销方/购方识别号（不区分大小写）
+            date_from / date_to: 开票日期范围（含），可使用 normalize_date 支持的任意写法
+            min_total / max_total: 价税合计范围（含）
+            invoice_number: 发票号码
+            limit: 最多返回的发票数，0 表示不限制
+        """
+        conditions = []
+        params: list = []
+        if seller_tax_id:
+            conditions.append("seller_tax_id = ?")
+            params.append(seller_tax_id.strip().upper())
+        if buyer_tax_id:
+            conditions.append("buyer_tax_id = ?")
+            params.append(buyer_tax_id.strip().upper())
+        for value, operator in ((date_from, ">="), (date_to, "<=")):
+            if value:
+                normalized = normalize_date(value)
+                if normalized is None:
+                    raise ValueError(f"无法识别的日期: {value}")
+                conditions.append(f"invoice_date {operator} ?")
+                params.append(normalized)
+        if min_total is not None:
+            conditions.append("total_with_tax >= ?")
+            params.append(min_total)
+        if max_total is not None:
+            conditions.append("total_with_tax <= ?")
+            params.append(max_total)
+        if invoice_number:
+            conditions.append("invoice_number = ?")
+            params.append(invoice_number.strip())
+
+        sql = f"SELECT {', '.join(RESULT_COLUMNS)} FROM invoices"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        # "+" 使排序不能借用开票日期索引：只按金额等条件查询时仍使用对应的索引，
+        # 而不是为了省去排序按日期顺序扫描全表
+        sql += " ORDER BY +invoice_date, invoice_number"
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+
+        results = []
+        for row in self._conn().execute(sql, params):
+            values = dict(zip(RESULT_COLUMNS, row))
+            values["data"] = json.loads(values["data"])
+            results.append(IndexedInvoice(**values))
+        return results
+
+    def count(self) -> int:
+        """索引中的发票数"""
+        return self._conn().execute("SELECT COUNT(*) FROM invoices").fetchone()[0]
+
+    def close(self):
+        """关闭当前线程的连接"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def add_cached_directory(index: InvoiceIndex, directory: str, recursive: bool = False) -> Tuple[int, int]:
+    """
+    把目录中已有识别缓存的PDF加入索引（不调用AI）
+
+    Returns:
+        (加入索引的PDF数, 没有缓存而跳过的PDF数)
+    """
+    import entry
+
+    added = skipped = 0
+    paths = list(entry.iter_pdf_files(directory, recursive=recursive))
+    for start in range(0, len(paths), entry.CACHE_LOOKUP_BATCH):
+        chunk = paths[start:start + entry.CACHE_LOOKUP_BATCH]
+        keys = [entry.file_digest(path) for path in chunk]
+        cached = entry.invoice_cache.get_many(keys)
+        entries = []
+        for path, key in zip(chunk, keys):
+            if key not in cached:
+                skipped += 1
+                continue
+            try:
+                invoices = entry.invoices_from_record(cached[key])
+            except Exception as e:
+                print(f"读取缓存失败 (文件: {os.path.basename(path)}): {e}")
+                skipped += 1
+                continue
+            entries.append((key, os.path.abspath(path), [entry.invoice_to_dict(invoice) for invoice in invoices]))
+        index.add_many(entries)
+        added += len(entries)
+    return added, skipped
+
+
+def _format_amount(value: Optional[float]) -> str:
+    return "" if value is None else f"{value:,.2f}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="查询已识别发票的本地索引")
+    parser.add_argument("--db", default=DEFAULT_INDEX_DB, help="索引数据库文件")
+    parser.add_argument("--seller", help="销方识别号")
+    parser.add_argument("--buyer", help="购方识别号")
+    parser.add_argument("--number", help="发票号码")
+    parser.add_argument("--quarter", help="开票季度，如 2024Q3（不能与 --from/--to 同时使用）")
+    parser.add_argument("--from", dest="date_from", help="开票日期起（含），如 2024-07-01")
+    parser.add_argument("--to", dest="date_to", help="开票日期止（含），如 2024-09-30")
+    parser.add_argument("--min-total", type=float, help="价税合计下限（含）")
+    parser.add_argument("--max-total", type=float, help="价税合计上限（含）")
+    parser.add_argument("--limit", type=int, default=0, help="最多列出的发票数（0 表示全部）")
+    parser.add_argument("--add", metavar="DIRECTORY", help="把目录中已缓存的发票加入索引后退出")
+    parser.add_argument("--recursive", action="store_true", help="--add 时包含子目录")
+    args = parser.parse_args()
+    # argparse 的互斥组只能互斥单个参数，--quarter 要与 --from、--to 两个参数互斥
+    if args.quarter and (args.date_from or args.date_to):
+        parser.error("--quarter 不能与 --from/--to 同时使用")
+
+    index = InvoiceIndex(args.db)
+    if args.add:
+        added, skipped = add_cached_directory(index, args.add, recursive=args.recursive)
+        print(f"已加入索引: {added} 个文件，没有缓存而跳过: {skipped} 个文件（索引共 {index.count()} 张发票）")
+        return
+
+    date_from, date_to = args.date_from, args.date_to
+    start = time.perf_counter()
+    try:
+        if args.quarter:
+            date_from, date_to = quarter_range(args.quarter)
+        results = index.query(
+            seller_tax_id=args.seller,
+            buyer_tax_id=args.buyer,
+            date_from=date_from,
+            date_to=date_to,
+            min_total=args.min_total,
+            max_total=args.max_total,
+            invoice_number=args.number,
+            limit=args.limit,
+        )
+    except ValueError as e:
+        parser.error(str(e))
+    elapsed = time.perf_counter() - start
+
+    for invoice in results:
+        print(
+            f"{invoice.invoice_date or '':<12}{invoice.invoice_number:<22}"
+            f"{_format_amount(invoice.total_with_tax):>14}  {invoice.seller_name} -> {invoice.buyer_name}"
+            f"  {invoice.file_path}"
+        )
+    total = sum(invoice.total_with_tax or 0.0 for invoice in results)
+    print(f"共 {len(results)} 张发票，价税合计 {total:,.2f}，查询耗时 {elapsed * 1000:.1f} 毫秒")
+
+
+if __name__ == "__main__":
+    main()
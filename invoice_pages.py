@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+多页PDF的分页识别
+
+pdf_read_pages 按页返回文字坐标 [left, top, right, bottom, text]，
+这里判断每一页是新发票的首页还是上一张发票的续页：
+- 页面上有"第1页"之类的页码标记时以页码为准（第1页为新发票，其余为续页）
+- 页面上的发票号码与当前发票不同时为新发票（一页一张发票的合订PDF）
+- 没有发票号码、但有"开票日期"的页面视为号码无法读取的新发票
+- 其余页面（货物清单接续页、号码相同的重复表头页）为续页
+- 没有任何文字的页面（纯图片扫描页）跳过
+
+同一张发票的各页按顺序向下拼接成一份坐标列表，货物表格因此连成一张，
+续页开头重复的发票表头（标题、号码、购销方信息、列标题）会被去掉。
+"""
+
+import re
+from typing import List, Optional
+
+from local_extractor import HEADER_FIELDS, INVOICE_NUMBER_RE, group_rows, merge_labels
+
+# 页码标记："第2页/共3页"、"共3页 第2页"
+PAGE_MARK_RE = re.compile(r"第\s*(\d+)\s*页")
+
+# 新发票首页的标签（发票号码无法读取时使用）
+INVOICE_DATE_LABEL = "开票日期"
+
+# 拼接时相邻两页之间的间距
+PAGE_GAP = 20
+
+
+def _row_texts(rows) -> List[str]:
+    return [" ".join(box[4] for box in row) for row in rows]
+
+
+def page_invoice_number(boxes) -> Optional[str]:
+    """页面上的发票号码，没有时返回 None"""
+    for text in _row_texts(group_rows(boxes)):
+        match = INVOICE_NUMBER_RE.search(text)
+        if match:
+            return match.group(1)
+    return None
+
+
+def _page_mark(texts: List[str]) -> Optional[int]:
+    for text in texts:
+        match = PAGE_MARK_RE.search(text)
+        if match:
+            return int(match.group(1))
+    return None
+
+
+def _header_rows(rows) -> set:
+    """首页中货物表头（含表头行）以上各行的文字，用于识别续页重复的表头"""
+    texts = _row_texts(rows)
+    for index, row in enumerate(rows):
+        if any(HEADER_FIELDS.get(label) == "amount" for _, _, label in merge_labels(row)):
+            return set(texts[:index + 1])
+    return set(texts)
+
+
+def _strip_repeated_header(rows, header: set):
+    """去掉续页开头与首页表头相同的行（以及页码行），遇到第一行新内容后停止"""
+    for index, text in enumerate(_row_texts(rows)):
+        if text not in header and not PAGE_MARK_RE.search(text):
+            return rows[index:]
+    return []
+
+
+def split_invoice_pages(pages: List[list]) -> List[List[int]]:
+    """
+    将各页分组为发票
+
+    Args:
+        pages: 每页的文字坐标列表
+
+    Returns:
+        每张发票包含的页码（从0开始）列表，如 [[0, 1], [2], [3]]
+    """
+    groups: List[List[int]] = []
+    current_number = None
+    for page_index, boxes in enumerate(pages):
+        if not boxes:
+            continue
+        texts = _row_texts(group_rows(boxes))
+        number = page_invoice_number(boxes)
+        mark = _page_mark(texts)
+
+        if not groups:
+            new_invoice = True
+        elif mark is not None:
+            new_invoice = mark == 1
+        elif number is not None:
+            new_invoice = number != current_number
+        else:
+            new_invoice = any(INVOICE_DATE_LABEL in text for text in texts)
+
+        if new_invoice:
+            groups.append([page_index])
+            current_number = number
+        else:
+            groups[-1].append(page_index)
+            if current_number is None:
+                current_number = number
+    return groups
+
+
+def merge_pages(pages: List[list]) -> list:
+    """
+    将同一张发票的各页拼接为一份坐标列表
+
+    后一页整体下移到前一页最低的文字之下，续页开头重复的表头行被去掉。
+    只有一页时原样返回。
+    """
+    if len(pages) == 1:
+        return list(pages[0])
+    merged: list = []
+    header: set = set()
+    for page_number, boxes in enumerate(pages):
+        rows = group_rows(boxes)
+        if page_number == 0:
+            header = _header_rows(rows)
+        else:
+            rows = _strip_repeated_header(rows, header)
+        if not rows:
+            continue
+        shift = 0
+        if merged:
+            top = min(box[1] for row in rows for box in row)
+            shift = max(box[3] for box in merged) + PAGE_GAP - top
+        for row in rows:
+            for left, box_top, right, bottom, text in row:
+                merged.append([left, box_top + shift, right, bottom + shift, text])
+    return merged
+
+
+def invoice_segments(pages: List[list]) -> List[list]:
+    """
+    按发票拆分并拼接PDF的各页
+
+    Returns:
+        每张发票一份坐标列表；单页PDF返回只有一个元素的列表，没有文字时返回空列表
+    """
+    return [merge_pages([pages[i] for i in group]) for group in split_invoice_pages(pages)]
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+AI识别结果的校验与纠错请求
+
+AI返回的发票字典在写入缓存前按以下规则校验：
+- 每个货物的 金额 + 税额 = 价税合计（提示词要求价税合计由两者相加得到，
+  不一致时直接在本地改正，不需要再次调用AI）
+- 货物金额之和、税额之和与票面"合计"行一致，两者相加与"（小写）"价税合计一致
+- 销方/购方识别号符合统一社会信用代码（18位，含校验位）或旧版15/17/20位识别号的格式，
+  并且确实出现在票面文字中
+
+无法在本地改正的问题由 build_correction 生成一个简短的纠错请求：
+只包含出错的字段、发现的问题和票面上相关的几行文字，
+不再重新发送整张发票和完整的提示词。
+"""
+
+import json
+import re
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+from local_extractor import AMOUNT_TOLERANCE, HEADER_FIELDS, TOTAL_WITH_TAX_RE, group_rows, merge_labels
+
+# 统一社会信用代码（GB 32100-2015）使用的字符和各位的权重
+CREDIT_CODE_CHARS = "0123456789ABCDEFGHJKLMNPQRTUWXY"
+CREDIT_CODE_WEIGHTS = [1, 3, 9, 27, 19, 26, 16, 17, 20, 29, 25, 13, 8, 24, 10, 30, 28]
+
+# 居民身份证号码（个人作为购买方时使用）各位的权重和校验码
+ID_CARD_WEIGHTS = [7, 9, 10, 5, 8, 4, 2, 1, 6, 3, 7, 9, 10, 5, 8, 4, 2]
+ID_CARD_CHECKS = "10X98765432"
+
+# 旧版纳税人识别号：15、17或20位
+LEGACY_TAX_ID_RE = re.compile(r"^(?:[0-9A-Z]{15}|[0-9A-Z]{17}|[0-9A-Z]{20})$")
+
+# 票面上疑似识别号的文字（识别号与标签被拆成两个文字框时使用）
+TAX_ID_TEXT_RE = re.compile(r"[0-9A-Z]{15,20}")
+
+# 纠错请求可以改正的字段
+CORRECTABLE_FIELDS = ("items", "seller_tax_id", "buyer_tax_id")
+
+CORRECTION_PROMPT = """你是一个发票识别助手。之前从一张发票中识别出的部分字段未通过校验。
+下面给出这些字段当前的识别结果、发现的问题，以及票面上相关的文字。
+请对照票面文字重新识别这些字段，返回一个JSON对象，只包含需要改正的字段：
+- items：完整的货物列表，每个货物包含 name, specification, unit, quantity, unit_price, amount,
+  tax_rate, tax_amount, total_with_tax，价税合计使用金额和税额相加得到
+- seller_tax_id / buyer_tax_id：销方/购方的统一社会信用代码/纳税人识别号
+  （左栏为购买方，右栏为销售方），票面上没有时填空
+"""
+
+JSON_REPAIR_PROMPT = """下面是一段格式有误的JSON。请只修正格式错误（引号、逗号、括号等），
+不要增加、删除或改动其中的内容，返回修正后的JSON对象。
+"""
+
+
+@dataclass
+class ValidationProblem:
+    """一项未通过的校验"""
+
+    field: str  # 出错的字段（见 CORRECTABLE_FIELDS）
+    message: str  # 问题描述
+
+
+def _number(value) -> Optional[float]:
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            return float(value.replace("¥", "").replace("￥", "").replace(",", "").strip())
+        except ValueError:
+            return None
+    return None
+
+
+def is_valid_tax_id(tax_id: str) -> bool:
+    """识别号格式是否正确：统一社会信用代码和身份证号码检查校验位，旧版识别号只检查长度和字符"""
+    tax_id = tax_id.strip().upper()
+    if len(tax_id) == 18:
+        if all(c in CREDIT_CODE_CHARS for c in tax_id):
+            total = sum(CREDIT_CODE_CHARS.index(c) * w for c, w in zip(tax_id, CREDIT_CODE_WEIGHTS))
+            if CREDIT_CODE_CHARS[(31 - total % 31) % 31] == tax_id[17]:
+                return True
+        if tax_id[:17].isdigit():
+            total = sum(int(c) * w for c, w in zip(tax_id, ID_CARD_WEIGHTS))
+            return ID_CARD_CHECKS[total % 11] == tax_id[17]
+        return False
+    return bool(LEGACY_TAX_ID_RE.match(tax_id))
+
+
+def document_totals(boxes) -> Tuple[Optional[float], Optional[float], Optional[float]]:
+    """
+    票面上的合计金额
+
+    Returns:
+        (金额合计, 税额合计, 价税合计)，票面上找不到的为 None
+    """
+    amount_total = tax_total = total_with_tax = None
+    for row in group_rows(boxes):
+        if amount_total is None and "".join(box[4] for box in row[:2]).startswith("合计"):
+            totals = [_number(box[4]) for box in row]
+            totals = [value for value in totals if value is not None]
+            if totals:
+                amount_total = totals[0]
+            if len(totals) >= 2:
+                tax_total = totals[1]
+        for box in row:
+            match = TOTAL_WITH_TAX_RE.search(box[4])
+            if match:
+                total_with_tax = _number(match.group(1))
+    return amount_total, tax_total, total_with_tax
+
+
+def _fix_item_totals(items: List[dict]):
+    """按 金额 + 税额 改正每个货物的价税合计"""
+    for item in items:
+        amount, tax_amount = _number(item.get("amount")), _number(item.get("tax_amount"))
+        if amount is None or tax_amount is None:
+            continue
+        total = _number(item.get("total_with_tax"))
+        if total is None or abs(total - (amount + tax_amount)) > AMOUNT_TOLERANCE:
+            item["total_with_tax"] = round(amount + tax_amount, 2)
+
+
+def validate_invoice(invoice_data: dict, boxes) -> List[ValidationProblem]:
+    """
+    校验AI返回的发票字典
+
+    货物的价税合计与金额、税额不一致时直接在 invoice_data 中改正，不算作问题。
+
+    Args:
+        invoice_data: 与 SYSTEM_PROMPT 中字段一致的字典
+        boxes: 识别时使用的文字坐标，用于读取票面合计和核对识别号
+
+    Returns:
+        未通过的校验项，为空表示结果可信
+    """
+    problems: List[ValidationProblem] = []
+    items = invoice_data.get("items")
+    if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+        problems.append(ValidationProblem("items", "货物列表格式错误"))
+        items = []
+    _fix_item_totals(items)
+
+    amounts = [_number(item.get("amount")) for item in items]
+    taxes = [_number(item.get("tax_amount")) for item in items]
+    amount_total, tax_total, total_with_tax = document_totals(boxes)
+    if None in amounts or None in taxes:
+        problems.append(ValidationProblem("items", "部分货物的金额或税额不是数字"))
+    elif amount_total or total_with_tax:
+        amount_sum, tax_sum = sum(amounts), sum(taxes)
+        if not items:
+            problems.append(ValidationProblem("items", "票面有合计金额，但未识别到货物"))
+        elif amount_total is not None and abs(amount_sum - amount_total) > AMOUNT_TOLERANCE:
+            problems.append(ValidationProblem(
+                "items", f"货物金额之和 {amount_sum:.2f} 与票面合计 {amount_total:.2f} 不一致"))
+        elif tax_total is not None and abs(tax_sum - tax_total) > AMOUNT_TOLERANCE:
+            problems.append(ValidationProblem(
+                "items", f"货物税额之和 {tax_sum:.2f} 与票面合计 {tax_total:.2f} 不一致"))
+        elif total_with_tax is not None and abs(amount_sum + tax_sum - total_with_tax) > AMOUNT_TOLERANCE:
+            problems.append(ValidationProblem(
+                "items", f"货物价税合计 {amount_sum + tax_sum:.2f} 与票面（小写）{total_with_tax:.2f} 不一致"))
+
+    page_text = "".join(box[4] for box in boxes).replace(" ", "")
+    for field, label in (("seller_tax_id", "销方识别号"), ("buyer_tax_id", "购方识别号")):
+        tax_id = invoice_data.get(field) or ""
+        if not isinstance(tax_id, str):
+            problems.append(ValidationProblem(field, f"{label}格式错误"))
+        elif not tax_id:
+            if field == "seller_tax_id" and "识别号" in page_text:
+                problems.append(ValidationProblem(field, f"票面有识别号，但未识别到{label}"))
+        elif not is_valid_tax_id(tax_id):
+            problems.append(ValidationProblem(field, f"{label} {tax_id} 格式或校验位错误"))
+        elif page_text and tax_id.upper() not in page_text.upper():
+            problems.append(ValidationProblem(field, f"{label} {tax_id} 不在票面文字中"))
+    return problems
+
+
+def correction_excerpt(boxes, fields) -> list:
+    """票面上与出错字段相关的文字：货物表格到价税合计之间的各行，或购销方名称和识别号所在的行"""
+    rows = group_rows(boxes)
+    selected = set()
+    if "items" in fields:
+        start = next(
+            (i for i, row in enumerate(rows)
+             if any(HEADER_FIELDS.get(label) == "name" for _, _, label in merge_labels(row))),
+            0,
+        )
+        end = next(
+            (i for i, row in enumerate(rows) if i >= start and any(TOTAL_WITH_TAX_RE.search(b[4]) for b in row)),
+            len(rows) - 1,
+        )
+        selected.update(range(start, end + 1))
+    if "seller_tax_id" in fields or "buyer_tax_id" in fields:
+        for i, row in enumerate(rows):
+            text = "".join(box[4] for box in row)
+            if "名称" in text or "识别号" in text or TAX_ID_TEXT_RE.search(text):
+                selected.add(i)
+    return [box for i in sorted(selected) for box in rows[i]]
+
+
+def build_correction(
+        invoice_data: dict,
+        boxes,
+        problems: List[ValidationProblem],
+        encode: Callable[[list], str],
+) -> Tuple[List[str], str]:
+    """
+    生成纠错请求的内容
+
+    Args:
+        invoice_data: 未通过校验的识别结果
+        boxes: 识别时使用的文字坐标
+        problems: validate_invoice 返回的问题
+        encode: 将文字坐标转换为提示词文本的函数（与识别时使用相同的格式）
+
+    Returns:
+        (fields, content): 需要改正的字段，以及与 CORRECTION_PROMPT 一起发送的内容
+    """
+    fields = [field for field in CORRECTABLE_FIELDS if any(p.field == field for p in problems)]
+    current: Dict[str, object] = {field: invoice_data.get(field) for field in fields}
+    content = (
+        f"需要改正的字段: {', '.join(fields)}\n"
+        f"当前结果: {json.dumps(current, ensure_ascii=False)}\n"
+        f"问题:\n" + "\n".join(f"- {p.message}" for p in problems) + "\n"
+        f"票面相关文字:\n{encode(correction_excerpt(boxes, fields))}"
+    )
+    return fields, content
+
+
+def apply_correction(invoice_data: dict, corrected: dict, fields: List[str]) -> dict:
+    """返回用纠错结果替换出错字段后的新字典（只接受 fields 中的字段）"""
+    merged = dict(invoice_data)
+    for field in fields:
+        if field in corrected:
+            merged[field] = corrected[field]
+    return merged
+
+
+def repair_json(text: str) -> Optional[dict]:
+    """在本地修复常见的格式问题（代码块标记、JSON前后的说明文字），失败时返回 None"""
+    start, end = text.find("{"), text.rfind("}")
+    if start < 0 or end <= start:
+        return None
+    try:
+        data = json.loads(text[start:end + 1])
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+批量任务的断点续传日志
+
+批量处理时每识别完一个文件，就把识别结果追加到处理目录下的
+.invoice_job.jsonl 中（每行一条记录，写入后立即刷新到磁盘）。
+程序被关闭或中途崩溃后，再次处理同一目录时：
+- 日志中已完成的文件直接使用记录的结果，不再读取PDF、查询缓存或调用AI
+- 只处理剩余的文件，最终的Excel表格按原顺序包含全部文件
+整个任务完成并保存表格后删除日志。
+
+记录按文件相对于处理目录的路径、大小和修改时间匹配，文件被替换或修改后会重新识别；
+识别失败的文件不写入日志，续传时会重试。
+
+完整导出（命令行和GUI）与增量处理各用一个日志文件，第一行记录任务类型：
+中断的完整导出之后在同一目录运行增量处理，不会用到或删除完整导出的日志，反之亦然。
+"""
+
+import json
+import os
+from typing import Dict, Optional, Tuple
+
+# 任务类型：完整导出（process_directory_to_xlsx 和 GUI）/ 增量处理（incremental.py）
+JOB_EXPORT = "export"
+JOB_INCREMENTAL = "incremental"
+
+# 各类任务的日志文件名（位于处理目录下）
+JOURNAL_NAMES = {
+    JOB_EXPORT: ".invoice_job.jsonl",
+    JOB_INCREMENTAL: ".invoice_job_incremental.jsonl",
+}
+
+# 日志格式版本，不一致时丢弃旧日志
+JOURNAL_VERSION = 2
+
+# 每写入多少条记录执行一次 fsync（每条记录都会 flush，进程被结束时不会丢失）
+FSYNC_EVERY = 20
+
+
+def _signature(file_path: str) -> Tuple[int, int]:
+    stat = os.stat(file_path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+class JobJournal:
+    """
+    追加写入的任务日志
+
+    第一行为任务信息 {"job": 格式版本, "kind": 任务类型}，之后每行一条记录：
+        {"file": 相对路径, "size": 字节数, "mtime_ns": 修改时间, "invoice": 识别结果}
+    打开时只建立 {相对路径: 行偏移} 索引，需要时再读取对应行，
+    续传上万个文件的任务时不会把全部结果读入内存。
+    格式版本或任务类型与 kind 不一致的日志被丢弃。
+    """
+
+    def __init__(self, path: str, kind: str = JOB_EXPORT):
+        self.path = path
+        self.kind = kind
+        self._index: Dict[str, Tuple[int, int, int]] = {}
+        self._writes = 0
+        self._load()
+        self._file = open(path, "ab")
+        if self._file.tell() == 0:
+            self._write({"job": JOURNAL_VERSION, "kind": kind})
+
+    @classmethod
+    def for_directory(cls, directory_path: str, resume: bool = True, kind: str = JOB_EXPORT) -> "JobJournal":
+        """
+        打开目录对应的任务日志
+
+        Args:
+            directory_path: 处理的PDF目录
+            resume: 为 False 时丢弃已有日志，重新开始
+            kind: 任务类型（JOB_EXPORT / JOB_INCREMENTAL），每类任务使用自己的日志文件
+        """
+        if kind not in JOURNAL_NAMES:
+            raise ValueError(f"未知的任务类型: {kind}")
+        path = os.path.join(directory_path, JOURNAL_NAMES[kind])
+        if not resume and os.path.exists(path):
+            os.remove(path)
+        return cls(path, kind)
+
+    def _load(self):
+        """读取已有日志，建立索引；截掉崩溃时写了一半的最后一行"""
+        if not os.path.exists(self.path):
+            return
+        valid_end = 0
+        with open(self.path, "rb") as f:
+            offset = 0
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                if offset == 0 and (record.get("job") != JOURNAL_VERSION or record.get("kind") != self.kind):
+                    break
+                if "file" in record:
+                    self._index[record["file"]] = (offset, record.get("size"), record.get("mtime_ns"))
+                offset += len(line)
+                valid_end = offset
+
+        if valid_end == 0:
+            self._index.clear()
+        if valid_end != os.path.getsize(self.path):
+            with open(self.path, "r+b") as f:
+                f.truncate(valid_end)
+
+    def _key(self, file_path: str) -> str:
+        """文件相对于日志所在目录的路径（统一使用 / 分隔），递归处理时不同子目录的同名文件互不影响"""
+        return os.path.relpath(file_path, os.path.dirname(os.path.abspath(self.path))).replace(os.sep, "/")
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def get(self, file_path: str) -> Optional[dict]:
+        """返回文件已记录的识别结果；未记录或文件已被修改时返回 None"""
+        entry = self._index.get(self._key(file_path))
+        if entry is None:
+            return None
+        offset, size, mtime_ns = entry
+        try:
+            if _signature(file_path) != (size, mtime_ns):
+                return None
+        except OSError:
+            return None
+
+        self._file.flush()
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            return json.loads(f.readline()).get("invoice")
+
+    def record(self, file_path: str, invoice_data: dict):
+        """记录一个识别完成的文件"""
+        size, mtime_ns = _signature(file_path)
+        key = self._key(file_path)
+        offset = self._file.tell()
+        self._write({"file": key, "size": size, "mtime_ns": mtime_ns, "invoice": invoice_data})
+        self._index[key] = (offset, size, mtime_ns)
+
+    def _write(self, record: dict):
+        self._file.write(json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n")
+        self._file.flush()
+        self._writes += 1
+        if self._writes % FSYNC_EVERY == 0:
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        if not self._file.closed:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+
+    def finish(self):
+        """任务完成：关闭并删除日志"""
+        self.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
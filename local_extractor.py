@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+标准电子发票版式的本地字段提取
+
+根据 pdf_read_text 返回的文字坐标 [left, top, right, bottom, text]，
+按标准电子发票（增值税专用发票/普通发票）的版式直接识别各项字段，
+返回与AI接口相同结构的字典。
+
+只有在所有校验都通过时才返回结果（发票号码、日期、销方信息齐全，
+货物金额/税额之和与"合计"栏一致，价税合计与"（小写）"金额一致），
+否则返回 None，由调用方改用AI识别。
+"""
+
+import re
+from typing import Dict, List, Optional, Tuple
+
+# 同一行文字的top坐标最大偏差
+ROW_TOLERANCE = 3
+
+# 表头中被拆成单字的标签，相邻两字的最大间距
+HEADER_MERGE_GAP = 14
+
+# 金额比对允许的误差（元）
+AMOUNT_TOLERANCE = 0.011
+
+INVOICE_NUMBER_RE = re.compile(r"发票号码[:：]\s*(\d{8,20})")
+INVOICE_DATE_RE = re.compile(r"开票日期[:：]\s*(\d{4}年\d{1,2}月\d{1,2}日)")
+NAME_RE = re.compile(r"^名\s*称[:：]\s*(.*)$")
+TAX_ID_RE = re.compile(r"纳税人识别号[:：]\s*([0-9A-Z]{15,20})?")
+ISSUER_RE = re.compile(r"^开票人[:：]\s*(.+)$")
+TOTAL_WITH_TAX_RE = re.compile(r"（小写）\s*[¥￥]?\s*(-?[\d,]+\.?\d*)")
+INVOICE_TYPE_RE = re.compile(r"^电子发票（.+）$")
+
+# 表头标签与货物字段的对应关系
+HEADER_FIELDS = {
+    "项目名称": "name",
+    "货物或应税劳务、服务名称": "name",
+    "规格型号": "specification",
+    "单位": "unit",
+    "数量": "quantity",
+    "单价": "unit_price",
+    "金额": "amount",
+    "税率/征收率": "tax_rate",
+    "税率": "tax_rate",
+    "税额": "tax_amount",
+}
+
+# 不属于备注内容的装饰性单字标签
+DECORATIVE_LABELS = {"购", "买", "销", "售", "方", "信", "息", "备", "注", "合", "计"}
+
+
+def _parse_number(text: str) -> Optional[float]:
+    cleaned = text.replace("¥", "").replace("￥", "").replace(",", "").strip()
+    try:
+        return float(cleaned)
+    except ValueError:
+        return None
+
+
+def _as_quantity(value: float):
+    return int(value) if value == int(value) else value
+
+
+def group_rows(boxes) -> List[List[list]]:
+    """按top坐标将文字框分组为行，行内按left排序"""
+    rows: List[List[list]] = []
+    for box in sorted(boxes, key=lambda b: (b[1], b[0])):
+        if rows and abs(box[1] - rows[-1][0][1]) <= ROW_TOLERANCE:
+            rows[-1].append(box)
+        else:
+            rows.append([box])
+    return [sorted(row, key=lambda b: b[0]) for row in rows]
+
+
+def merge_labels(row) -> List[Tuple[int, int, str]]:
+    """将表头中被拆开的单字合并成完整标签，返回 [(left, right, 标签)]"""
+    labels: List[list] = []
+    for left, _, right, _, text in row:
+        if labels and left - labels[-1][1] <= HEADER_MERGE_GAP and len(labels[-1][2]) == 1 and len(text) == 1:
+            labels[-1][1] = right
+            labels[-1][2] += text
+        else:
+            labels.append([left, right, text])
+    return [(left, right, text) for left, right, text in labels]
+
+
+def _column_for(box, columns) -> Optional[str]:
+    """按横向重叠程度（无重叠时按中心距离）确定文字框所在列"""
+    left, right = box[0], box[2]
+    best, best_score = None, None
+    for col_left, col_right, field in columns:
+        overlap = min(right, col_right) - max(left, col_left)
+        distance = abs((left + right) / 2 - (col_left + col_right) / 2)
+        score = (overlap, -distance) if overlap > 0 else (0, -distance)
+        if best_score is None or score > best_score:
+            best, best_score = field, score
+    return best
+
+
+def _extract_items(rows, header_index: int, total_index: int, problems: List[str]):
+    columns = []
+    for left, right, label in merge_labels(rows[header_index]):
+        field = HEADER_FIELDS.get(label)
+        if field:
+            columns.append((left, right, field))
+    if not any(field == "amount" for _, _, field in columns):
+        problems.append("货物表头缺少金额列")
+        return []
+
+    items: List[Dict] = []
+    for row in rows[header_index + 1:total_index]:
+        values: Dict[str, str] = {}
+        for box in row:
+            field = _column_for(box, columns)
+            if field:
+                values[field] = (values.get(field, "") + box[4]).strip()
+
+        amount = _parse_number(values.get("amount", ""))
+        if amount is None:
+            # 没有金额的行是上一行名称或规格型号的换行部分
+            if items and values:
+                for field in ("name", "specification"):
+                    if values.get(field):
+                        items[-1][field] += values[field]
+            elif values:
+                problems.append(f"无法识别的货物行: {values}")
+            continue
+
+        tax_amount = _parse_number(values.get("tax_amount", "")) or 0.0
+        quantity = _parse_number(values.get("quantity", ""))
+        unit_price = _parse_number(values.get("unit_price", ""))
+        items.append(
+            {
+                "name": values.get("name", ""),
+                "specification": values.get("specification", ""),
+                "unit": values.get("unit", ""),
+                "quantity": _as_quantity(quantity) if quantity is not None else "",
+                "unit_price": unit_price if unit_price is not None else "",
+                "amount": amount,
+                "tax_rate": values.get("tax_rate", ""),
+                "tax_amount": tax_amount,
+                "total_with_tax": round(amount + tax_amount, 2),
+            }
+        )
+    return items
+
+
+def extract_invoice_fields(boxes) -> Tuple[dict, List[str]]:
+    """
+    按标准电子发票版式提取字段
+
+    Args:
+        boxes: pdf_read_text 返回的 [[left, top, right, bottom, text], ...]
+
+    Returns:
+        (invoice_data, problems): 与AI返回结构一致的字典，以及未通过的校验项；
+        problems 为空表示结果可信
+    """
+    problems: List[str] = []
+    data = {
+        "invoice_number": "",
+        "seller_tax_id": "",
+        "seller_name": "",
+        "buyer_tax_id": "",
+        "buyer_name": "",
+        "invoice_date": "",
+        "tax_classification_code": "",
+        "special_business_type": "",
+        "items": [],
+        "invoice_source": "",
+        "invoice_type": "",
+        "invoice_status": "",
+        "is_positive_invoice": True,
+        "invoice_risk_level": "",
+        "issuer": "",
+        "remarks": "",
+    }
+
+    names, tax_ids = [], []
+    total_with_tax, total_bottom = None, None
+    for left, top, right, bottom, text in boxes:
+        if not data["invoice_type"] and INVOICE_TYPE_RE.match(text):
+            data["invoice_type"] = text
+        match = INVOICE_NUMBER_RE.search(text)
+        if match:
+            data["invoice_number"] = match.group(1)
+        match = INVOICE_DATE_RE.search(text)
+        if match:
+            data["invoice_date"] = match.group(1)
+        match = NAME_RE.match(text)
+        if match:
+            names.append((left, match.group(1).strip()))
+        match = TAX_ID_RE.search(text)
+        if match:
+            tax_ids.append((left, match.group(1) or ""))
+        match = ISSUER_RE.match(text)
+        if match:
+            data["issuer"] = match.group(1).strip()
+        match = TOTAL_WITH_TAX_RE.search(text)
+        if match:
+            total_with_tax = _parse_number(match.group(1))
+            total_bottom = bottom
+
+    # 购买方信息在左栏，销售方信息在右栏
+    names.sort()
+    tax_ids.sort()
+    if len(names) == 2:
+        data["buyer_name"], data["seller_name"] = names[0][1], names[1][1]
+    else:
+        problems.append(f"识别到 {len(names)} 个名称栏，应为2个")
+    if len(tax_ids) == 2:
+        data["buyer_tax_id"], data["seller_tax_id"] = tax_ids[0][1], tax_ids[1][1]
+    else:
+        problems.append(f"识别到 {len(tax_ids)} 个纳税人识别号栏，应为2个")
+
+    for field in ("invoice_number", "invoice_date", "seller_name", "seller_tax_id", "buyer_name"):
+        if not data[field]:
+            problems.append(f"缺少字段: {field}")
+
+    rows = group_rows(boxes)
+    header_index = next(
+        (i for i, row in enumerate(rows)
+         if any(HEADER_FIELDS.get(label) == "name" for _, _, label in merge_labels(row))),
+        None,
+    )
+    total_index = next(
+        (i for i, row in enumerate(rows)
+         if "".join(box[4] for box in row[:2]).startswith("合计")),
+        None,
+    )
+    if header_index is None or total_index is None or total_index <= header_index:
+        problems.append("未找到货物表头或合计行")
+        return data, problems
+
+    data["items"] = _extract_items(rows, header_index, total_index, problems)
+    if not data["items"]:
+        problems.append("未识别到货物")
+
+    # 合计行：金额合计与税额合计
+    totals = [_parse_number(box[4]) for box in rows[total_index]]
+    totals = [value for value in totals if value is not None]
+    amount_sum = sum(item["amount"] for item in data["items"])
+    tax_sum = sum(item["tax_amount"] for item in data["items"])
+    if len(totals) >= 1 and abs(totals[0] - amount_sum) > AMOUNT_TOLERANCE:
+        problems.append(f"金额合计不一致: 货物合计 {amount_sum:.2f}，票面 {totals[0]:.2f}")
+    if len(totals) >= 2 and abs(totals[1] - tax_sum) > AMOUNT_TOLERANCE:
+        problems.append(f"税额合计不一致: 货物合计 {tax_sum:.2f}，票面 {totals[1]:.2f}")
+    if total_with_tax is None:
+        problems.append("未找到价税合计（小写）")
+    elif abs(total_with_tax - (amount_sum + tax_sum)) > AMOUNT_TOLERANCE:
+        problems.append(f"价税合计不一致: 货物合计 {amount_sum + tax_sum:.2f}，票面 {total_with_tax:.2f}")
+    else:
+        data["is_positive_invoice"] = total_with_tax >= 0
+
+    # 备注：价税合计栏下方到开票人之间的内容（同一行相邻的文字框合并）
+    remarks = []
+    for row in rows[total_index + 1:]:
+        if total_bottom is None or row[0][1] < total_bottom:
+            continue
+        if any(ISSUER_RE.match(box[4]) for box in row):
+            break
+        merged: List[list] = []
+        for box in row:
+            if box[4] in DECORATIVE_LABELS:
+                continue
+            if merged and box[4].startswith(("：", ":")):
+                merged[-1][1] += box[4]
+            else:
+                merged.append([box[0], box[4]])
+        remarks.extend(text for _, text in merged)
+    data["remarks"] = ", ".join(remarks)
+
+    return data, problems
+
+
+def extract_invoice_locally(boxes) -> Optional[dict]:
+    """
+    尝试在本地识别标准版式的电子发票
+
+    Returns:
+        全部校验通过时返回与AI接口结构一致的字典，否则返回 None
+    """
+    data, problems = extract_invoice_fields(boxes)
+    if problems:
+        return None
+    return data
@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+处理过程的分阶段计时与运行指标
+
+记录每个文件在各阶段花费的时间，以及AI接口返回的token用量：
+- cache_lookup：查询识别结果缓存
+- pdf_read：读取PDF文字坐标（pdf_read_text）
+- local_extract：本地版式识别
+- ask_deep_seek：等待AI接口响应（批量识别时同一批的文件各计整次等待时间）
+- first_field：流式接收时从发出请求到第一个完整字段到达的时间（包含在 ask_deep_seek 中）
+- row_write：写入汇总表格
+
+运行结束后可打印 p50/p95 汇总，或导出为 JSON Lines（每个文件一行）
+或 Prometheus 文本格式。
+
+工作线程通过 track() 声明当前处理的文件，之后在同一线程中记录的
+阶段耗时和token用量都会归到这些文件名下。
+
+启用按复杂度路由（见 model_router.py）时，每次按某条路径识别发票都通过 route() 记录：
+各路径的发票数、失败数、耗时分位数、token用量和估算费用，用于调整路由阈值。
+"""
+
+import contextvars
+import json
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# 阶段名称与汇总显示的中文名
+STAGES = {
+    "cache_lookup": "查询缓存",
+    "pdf_read": "PDF解析",
+    "index_lookup": "查询索引",
+    "local_extract": "本地识别",
+    "ask_deep_seek": "等待AI",
+    "first_field": "首个字段",
+    "row_write": "写入表格",
+}
+
+# 当前线程（或协程）正在处理的文件
+_current_files: contextvars.ContextVar = contextvars.ContextVar("metrics_files", default=())
+
+# 当前线程正在进行的路径识别（route() 中），AI请求的token用量同时记到这里
+_current_route: contextvars.ContextVar = contextvars.ContextVar("metrics_route", default=None)
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """
+    最近秩法计算分位数（第 ceil(fraction * n) 小的值），values 为空时返回 0
+
+    >>> percentile([1, 2, 3, 4, 5, 6], 0.5)
+    3
+    >>> percentile(list(range(1, 21)), 0.95)
+    19
+    >>> percentile(list(range(1, 61)), 0.95)
+    57
+    >>> percentile([5], 0.95), percentile([], 0.5)
+    (5, 0.0)
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    # 先舍入到9位小数，避免 0.95 * 60 之类的浮点误差把秩向上多进一位
+    index = max(0, min(len(ordered) - 1, math.ceil(round(fraction * len(ordered), 9)) - 1))
+    return ordered[index]
+
+
+class RunMetrics:
+    """
+    一次批量处理的运行指标（线程安全）
+
+    每个文件对应一条记录：
+        {"file": 路径, "status": "cached"/"duplicate"/"local"/"ai"/"error",
+         "stages": {阶段: 秒}, "prompt_tokens": n, "completion_tokens": n}
+    每次AI请求另记一条：{"seconds": 秒, "invoices": 张数, "prompt_tokens": n, "completion_tokens": n}
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """清空已记录的数据，开始新的一次运行"""
+        with self._lock:
+            self._clear()
+
+    def _clear(self):
+        self.records: Dict[str, dict] = {}
+        self.requests: List[dict] = []
+        self.routes: Dict[str, dict] = {}
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+        self.elapsed: Optional[float] = None
+
+    def rotate(self) -> "RunMetrics":
+        """
+        结束当前一段统计并清空，返回包含这段数据的 RunMetrics
+
+        供长时间运行的程序（如监视文件夹）定期输出汇总，记录不会无限增长；
+        取出数据和清空在同一次加锁内完成，其间记录的数据不会丢失。
+        """
+        snapshot = RunMetrics()
+        with self._lock:
+            snapshot.records, snapshot.requests, snapshot.routes = self.records, self.requests, self.routes
+            snapshot.started_at, snapshot._started = self.started_at, self._started
+            snapshot.elapsed = time.perf_counter() - self._started
+            self._clear()
+        return snapshot
+
+    def finish(self):
+        """标记运行结束，固定总耗时"""
+        self.elapsed = time.perf_counter() - self._started
+
+    def _record(self, file_path: str) -> dict:
+        record = self.records.get(file_path)
+        if record is None:
+            record = {
+                "file": file_path,
+                "status": "",
+                "stages": {},
+                "prompt_tokens": 0,
+                "completion_tokens": 0,
+            }
+            self.records[file_path] = record
+        return record
+
+    @contextmanager
+    def track(self, *file_paths: str):
+        """声明当前线程正在处理的文件，期间记录的数据归到这些文件"""
+        token = _current_files.set(file_paths)
+        try:
+            yield
+        finally:
+            _current_files.reset(token)
+
+    @contextmanager
+    def stage(self, name: str, file_paths: Optional[Iterable[str]] = None, split: bool = False):
+        """
+        计时一个处理阶段
+
+        Args:
+            name: 阶段名称（见 STAGES）
+            file_paths: 归属的文件，默认使用 track() 声明的文件
+            split: 为 True 时耗时由这些文件平均分摊（如批量查询缓存），
+                否则每个文件各计整段耗时（如批量识别中的等待）
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, file_paths, split)
+
+    def observe(self, name: str, seconds: float, file_paths: Optional[Iterable[str]] = None, split: bool = False):
+        """直接记录一段耗时"""
+        files = tuple(file_paths) if file_paths is not None else _current_files.get()
+        if not files:
+            return
+        share = seconds / len(files) if split else seconds
+        with self._lock:
+            for file_path in files:
+                stages = self._record(file_path)["stages"]
+                stages[name] = stages.get(name, 0.0) + share
+
+    def set_status(self, status: str, file_paths: Optional[Iterable[str]] = None):
+        """记录文件的处理结果：cached / local / ai / error"""
+        files = tuple(file_paths) if file_paths is not None else _current_files.get()
+        with self._lock:
+            for file_path in files:
+                self._record(file_path)["status"] = status
+
+    @contextmanager
+    def route(self, name: str, price: Tuple[float, float] = (0.0, 0.0)):
+        """
+        记录一次按路径进行的识别
+
+        耗时和期间AI请求的token用量记到路径 name 下；抛出异常，
+        或在 yield 的字典中设置 attempt["ok"] = False（如本地识别未通过校验）时记为失败。
+
+        Args:
+            price: 每百万 输入/输出 token 的价格，用于估算费用
+        """
+        attempt = {"ok": True, "prompt_tokens": 0, "completion_tokens": 0}
+        token = _current_route.set(attempt)
+        started = time.perf_counter()
+        try:
+            yield attempt
+        except BaseException:
+            attempt["ok"] = False
+            raise
+        finally:
+            _current_route.reset(token)
+            seconds = time.perf_counter() - started
+            cost = (attempt["prompt_tokens"] * price[0] + attempt["completion_tokens"] * price[1]) / 1_000_000
+            with self._lock:
+                stats = self.routes.setdefault(name, {
+                    "invoices": 0, "failures": 0, "seconds": [],
+                    "prompt_tokens": 0, "completion_tokens": 0, "cost": 0.0,
+                })
+                stats["invoices"] += 1
+                stats["failures"] += not attempt["ok"]
+                stats["seconds"].append(seconds)
+                stats["prompt_tokens"] += attempt["prompt_tokens"]
+                stats["completion_tokens"] += attempt["completion_tokens"]
+                stats["cost"] += cost
+
+    def record_response(self, response, seconds: float):
+        """记录一次AI请求的耗时和token用量（用量由当前文件平均分摊）"""
+        usage = getattr(response, "usage", None)
+        prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+        files = _current_files.get()
+        attempt = _current_route.get()
+        if attempt is not None:
+            attempt["prompt_tokens"] += prompt_tokens
+            attempt["completion_tokens"] += completion_tokens
+        with self._lock:
+            self.requests.append(
+                {
+                    "seconds": seconds,
+                    "invoices": len(files),
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                }
+            )
+            for file_path in files:
+                record = self._record(file_path)
+                record["prompt_tokens"] += prompt_tokens / len(files)
+                record["completion_tokens"] += completion_tokens / len(files)
+
+    def summary(self) -> dict:
+        """汇总：各阶段 p50/p95/合计耗时、各状态文件数、AI请求数与token总数"""
+        with self._lock:
+            records = list(self.records.values())
+            requests = list(self.requests)
+            routes = {name: dict(stats, seconds=list(stats["seconds"])) for name, stats in self.routes.items()}
+        stages = {}
+        for name in STAGES:
+            values = [r["stages"][name] for r in records if name in r["stages"]]
+            if values:
+                stages[name] = {
+                    "count": len(values),
+                    "sum": sum(values),
+                    "p50": percentile(values, 0.5),
+                    "p95": percentile(values, 0.95),
+                }
+        statuses: Dict[str, int] = {}
+        for record in records:
+            status = record["status"] or "unknown"
+            statuses[status] = statuses.get(status, 0) + 1
+        request_seconds = [r["seconds"] for r in requests]
+        elapsed = self.elapsed if self.elapsed is not None else time.perf_counter() - self._started
+        return {
+            "files": len(records),
+            "elapsed": elapsed,
+            "statuses": statuses,
+            "stages": stages,
+            "requests": len(requests),
+            "request_p50": percentile(request_seconds, 0.5),
+            "request_p95": percentile(request_seconds, 0.95),
+            "prompt_tokens": sum(r["prompt_tokens"] for r in requests),
+            "completion_tokens": sum(r["completion_tokens"] for r in requests),
+            "routes": {
+                name: {
+                    "invoices": stats["invoices"],
+                    "failures": stats["failures"],
+                    "p50": percentile(stats["seconds"], 0.5),
+                    "p95": percentile(stats["seconds"], 0.95),
+                    "prompt_tokens": stats["prompt_tokens"],
+                    "completion_tokens": stats["completion_tokens"],
+                    "cost": stats["cost"],
+                }
+                for name, stats in routes.items()
+            },
+        }
+
+    def format_summary(self) -> str:
+        """生成运行汇总文本"""
+        summary = self.summary()
+        statuses = "，".join(f"{status} {count}" for status, count in sorted(summary["statuses"].items()))
+        lines = [
+            f"运行汇总：{summary['files']} 个文件，耗时 {summary['elapsed']:.2f} 秒（{statuses or '无'}）",
+            f"{'阶段':<10}{'文件数':>8}{'p50(ms)':>10}{'p95(ms)':>10}{'合计(s)':>10}",
+        ]
+        for name, stats in summary["stages"].items():
+            lines.append(
+                f"{STAGES[name]:<10}{stats['count']:>8}{stats['p50'] * 1000:>10.1f}"
+                f"{stats['p95'] * 1000:>10.1f}{stats['sum']:>10.2f}"
+            )
+        lines.append(
+            f"AI请求 {summary['requests']} 次（p50 {summary['request_p50'] * 1000:.0f} ms，"
+            f"p95 {summary['request_p95'] * 1000:.0f} ms），"
+            f"输入token {summary['prompt_tokens']}，输出token {summary['completion_tokens']}"
+        )
+        if summary["routes"]:
+            lines.append(
+                f"{'路径':<10}{'发票数':>8}{'失败':>6}{'p50(ms)':>10}{'p95(ms)':>10}"
+                f"{'输入token':>12}{'输出token':>12}{'费用(元)':>10}"
+            )
+            for name, stats in summary["routes"].items():
+                lines.append(
+                    f"{name:<10}{stats['invoices']:>8}{stats['failures']:>6}{stats['p50'] * 1000:>10.1f}"
+                    f"{stats['p95'] * 1000:>10.1f}{stats['prompt_tokens']:>12}{stats['completion_tokens']:>12}"
+                    f"{stats['cost']:>10.4f}"
+                )
+        return "\n".join(lines)
+
+    def write_jsonl(self, path: str):
+        """每个文件一行JSON：状态、各阶段耗时（秒）和分摊的token数"""
+        with self._lock:
+            records = [dict(r, stages=dict(r["stages"])) for r in self.records.values()]
+        with open(path, "w", encoding="utf-8") as f:
+            for record in records:
+                record["prompt_tokens"] = round(record["prompt_tokens"], 1)
+                record["completion_tokens"] = round(record["completion_tokens"], 1)
+                record["stages"] = {name: round(value, 6) for name, value in record["stages"].items()}
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def prometheus_text(self) -> str:
+        """Prometheus 文本格式（可配合 node_exporter 的 textfile collector 使用）"""
+        summary = self.summary()
+        lines = [
+            "# HELP invoice_stage_seconds Per-file time spent in each processing stage.",
+            "# TYPE invoice_stage_seconds summary",
+        ]
+        for name, stats in summary["stages"].items():
+            lines.append(f'invoice_stage_seconds{{stage="{name}",quantile="0.5"}} {stats["p50"]:.6f}')
+            lines.append(f'invoice_stage_seconds{{stage="{name}",quantile="0.95"}} {stats["p95"]:.6f}')
+            lines.append(f'invoice_stage_seconds_sum{{stage="{name}"}} {stats["sum"]:.6f}')
+            lines.append(f'invoice_stage_seconds_count{{stage="{name}"}} {stats["count"]}')
+        lines += [
+            "# HELP invoice_files_total Processed files by result.",
+            "# TYPE invoice_files_total counter",
+        ]
+        for status, count in sorted(summary["statuses"].items()):
+            lines.append(f'invoice_files_total{{status="{status}"}} {count}')
+        lines += [
+            "# HELP invoice_llm_requests_total Chat completion requests sent.",
+            "# TYPE invoice_llm_requests_total counter",
+            f"invoice_llm_requests_total {summary['requests']}",
+            "# HELP invoice_llm_tokens_total Tokens reported by the API.",
+            "# TYPE invoice_llm_tokens_total counter",
+            f'invoice_llm_tokens_total{{type="prompt"}} {summary["prompt_tokens"]}',
+            f'invoice_llm_tokens_total{{type="completion"}} {summary["completion_tokens"]}',
+        ]
+        if summary["routes"]:
+            lines += [
+                "# HELP invoice_route_invoices_total Invoices attempted per route, by result.",
+                "# TYPE invoice_route_invoices_total counter",
+            ]
+            for name, stats in summary["routes"].items():
+                lines.append(
+                    f'invoice_route_invoices_total{{route="{name}",result="ok"}} '
+                    f'{stats["invoices"] - stats["failures"]}'
+                )
+                lines.append(f'invoice_route_invoices_total{{route="{name}",result="failed"}} {stats["failures"]}')
+            lines += [
+                "# HELP invoice_route_seconds Time per invoice attempt on each route.",
+                "# TYPE invoice_route_seconds summary",
+            ]
+            for name, stats in summary["routes"].items():
+                lines.append(f'invoice_route_seconds{{route="{name}",quantile="0.5"}} {stats["p50"]:.6f}')
+                lines.append(f'invoice_route_seconds{{route="{name}",quantile="0.95"}} {stats["p95"]:.6f}')
+                lines.append(f'invoice_route_seconds_count{{route="{name}"}} {stats["invoices"]}')
+            lines += [
+                "# HELP invoice_route_cost_total Estimated API cost per route.",
+                "# TYPE invoice_route_cost_total counter",
+            ]
+            for name, stats in summary["routes"].items():
+                lines.append(f'invoice_route_cost_total{{route="{name}"}} {stats["cost"]:.6f}')
+        lines += [
+            "# HELP invoice_run_seconds Wall-clock duration of the run.",
+            "# TYPE invoice_run_seconds gauge",
+            f"invoice_run_seconds {summary['elapsed']:.6f}",
+        ]
+        return "\n".join(lines) + "\n"
+
+    def export(self, path: str):
+        """按扩展名导出：.prom 为 Prometheus 文本格式，其他为 JSON Lines"""
+        if path.lower().endswith(".prom"):
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(self.prometheus_text())
+        else:
+            self.write_jsonl(path)
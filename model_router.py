@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+按发票的复杂度选择识别路径
+
+调用AI之前先根据 pdf_read_text 的文字坐标给每张发票打分：
+- 文字框数量（版面越复杂越多）
+- 货物行数（货物表头与"合计"行之间的行数）
+- 是否符合标准电子发票版式（能找到发票号码、货物表头和"（小写）"价税合计）
+
+按分数选择最便宜的可行路径：
+- local：标准版式，在本地按坐标识别（不调用AI），未通过校验时按分数改走 compact 或 full
+- compact：简单发票，使用紧凑提示词（输入token约少一半）和 compact_model
+- full：复杂发票或非标准版式，使用完整坐标提示词和 full_model
+compact 路径识别失败（请求出错、响应无法解析）时升级到 full 路径重试。
+
+各路径的发票数、失败数、耗时、token用量和费用记入运行指标（见 metrics.py 的 route），
+可据此调整 compact_threshold 等阈值。
+"""
+
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+from local_extractor import HEADER_FIELDS, INVOICE_NUMBER_RE, TOTAL_WITH_TAX_RE, group_rows, merge_labels
+
+LOCAL_ROUTE = "local"
+COMPACT_ROUTE = "compact"
+FULL_ROUTE = "full"
+
+# 各模型每百万 输入/输出 token 的价格（元），用于估算各路径的费用，以官网价格为准
+MODEL_PRICES: Dict[str, Tuple[float, float]] = {
+    "deepseek-chat": (2.0, 3.0),
+    "deepseek-reasoner": (2.0, 3.0),
+}
+
+# 打分权重：每100个文字框、每4行货物各计1分，非标准版式加1分
+BOXES_PER_POINT = 100
+ITEM_ROWS_PER_POINT = 4
+NON_TEMPLATE_PENALTY = 1.0
+
+
+@dataclass
+class Route:
+    """一条AI识别路径"""
+
+    name: str
+    model: str
+    prompt_format: str  # "list" 或 "compact"（见 entry.encode_prompt_content）
+
+    @property
+    def price(self) -> Tuple[float, float]:
+        return MODEL_PRICES.get(self.model, (0.0, 0.0))
+
+
+@dataclass
+class InvoiceFeatures:
+    """用于打分的发票特征"""
+
+    box_count: int  # 文字框数量
+    item_rows: int  # 货物行数（找不到货物表头时为 0）
+    template: bool  # 是否符合标准电子发票版式
+
+
+@dataclass
+class RouteDecision:
+    """路由结果"""
+
+    route: str  # LOCAL_ROUTE / COMPACT_ROUTE / FULL_ROUTE
+    score: float
+    features: InvoiceFeatures
+
+
+def invoice_features(boxes) -> InvoiceFeatures:
+    """从文字坐标中提取打分用的特征"""
+    rows = group_rows(boxes)
+    header_index = None
+    total_index = None
+    has_number = False
+    for index, row in enumerate(rows):
+        text = " ".join(box[4] for box in row)
+        if INVOICE_NUMBER_RE.search(text):
+            has_number = True
+        if header_index is None:
+            fields = {HEADER_FIELDS.get(label) for _, _, label in merge_labels(row)}
+            if "name" in fields and "amount" in fields:
+                header_index = index
+        elif total_index is None and "".join(box[4] for box in row[:2]).startswith("合计"):
+            total_index = index
+    has_total = any(TOTAL_WITH_TAX_RE.search(box[4]) for box in boxes)
+
+    item_rows = 0
+    if header_index is not None:
+        item_rows = (total_index if total_index is not None else len(rows)) - header_index - 1
+    return InvoiceFeatures(
+        box_count=len(boxes),
+        item_rows=max(0, item_rows),
+        template=has_number and header_index is not None and has_total,
+    )
+
+
+def complexity_score(features: InvoiceFeatures) -> float:
+    """复杂度分数，越高越需要完整的提示词"""
+    score = features.box_count / BOXES_PER_POINT + features.item_rows / ITEM_ROWS_PER_POINT
+    if not features.template:
+        score += NON_TEMPLATE_PENALTY
+    return score
+
+
+class ModelRouter:
+    """
+    为每张发票选择识别路径
+
+    Args:
+        compact_threshold: 分数不超过该值的发票走 compact 路径，否则走 full 路径
+        local: 标准版式的发票是否先在本地识别
+        compact_model / full_model: 两条AI路径使用的模型
+    """
+
+    def __init__(
+            self,
+            compact_threshold: float = 1.5,
+            local: bool = True,
+            compact_model: str = "deepseek-chat",
+            full_model: str = "deepseek-chat",
+    ):
+        self.compact_threshold = compact_threshold
+        self.local = local
+        self.routes = {
+            COMPACT_ROUTE: Route(COMPACT_ROUTE, compact_model, "compact"),
+            FULL_ROUTE: Route(FULL_ROUTE, full_model, "list"),
+        }
+
+    def decide(self, boxes) -> RouteDecision:
+        """根据文字坐标选择路径"""
+        features = invoice_features(boxes)
+        score = complexity_score(features)
+        if self.local and features.template:
+            route = LOCAL_ROUTE
+        else:
+            route = self.ai_route(score).name
+        return RouteDecision(route, score, features)
+
+    def ai_route(self, score: float) -> Route:
+        """按分数选择AI路径（本地识别失败后同样使用）"""
+        return self.routes[COMPACT_ROUTE if score <= self.compact_threshold else FULL_ROUTE]
+
+    def escalate(self, route: Route) -> Optional[Route]:
+        """识别失败时升级到的路径，已是最高一级时返回 None"""
+        if route.name == COMPACT_ROUTE:
+            return self.routes[FULL_ROUTE]
+        return None
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+提示词格式对比工具
+
+比较两种发票内容格式（"list" 原始坐标列表 / "compact" 紧凑按行文本）
+的提示词token数和识别准确率。
+
+使用方法：
+python prompt_compare.py ./pdf_files              # 只统计token数（本地估算，不调用AI）
+python prompt_compare.py ./pdf_files --api        # 分别调用AI，统计实际token数并比较识别结果
+python prompt_compare.py ./pdf_files --api --limit 20
+
+调用AI时以本地版式识别通过校验的结果作为标准答案，
+本地无法识别的发票以原始格式的识别结果作为标准答案。
+"""
+
+import argparse
+import json
+import os
+import re
+
+import entry
+from local_extractor import extract_invoice_locally
+
+FORMATS = ("list", "compact")
+
+# 参与准确率比较的表头字段与货物字段
+HEADER_FIELDS = (
+    "invoice_number", "seller_tax_id", "seller_name", "buyer_tax_id",
+    "buyer_name", "invoice_date", "invoice_type", "issuer",
+)
+ITEM_FIELDS = (
+    "name", "specification", "unit", "quantity", "unit_price",
+    "amount", "tax_rate", "tax_amount", "total_with_tax",
+)
+
+CJK_RE = re.compile(r"[\u3000-\u9fff\uff00-\uffef]")
+
+
+def estimate_tokens(text: str) -> float:
+    """按DeepSeek的经验比例估算token数：中文字符约0.6，其他字符约0.3"""
+    cjk = len(CJK_RE.findall(text))
+    return cjk * 0.6 + (len(text) - cjk) * 0.3
+
+
+def _normalize(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return round(float(value), 6)
+    if isinstance(value, str):
+        try:
+            return round(float(value.replace("¥", "").replace(",", "")), 6)
+        except ValueError:
+            return value.strip()
+    return value
+
+
+def compare_fields(expected: dict, actual: dict):
+    """返回 (一致的字段数, 比较的字段数)"""
+    matched = total = 0
+    for field in HEADER_FIELDS:
+        total += 1
+        matched += _normalize(expected.get(field, "")) == _normalize(actual.get(field, ""))
+    expected_items = expected.get("items") or []
+    actual_items = actual.get("items") or []
+    for index, expected_item in enumerate(expected_items):
+        actual_item = actual_items[index] if index < len(actual_items) else {}
+        for field in ITEM_FIELDS:
+            total += 1
+            matched += _normalize(expected_item.get(field, "")) == _normalize(actual_item.get(field, ""))
+    # 多识别出的货物行按字段全部错误计
+    total += max(0, len(actual_items) - len(expected_items)) * len(ITEM_FIELDS)
+    return matched, total
+
+
+def ask(content: str, prompt_format: str):
+    """调用AI识别，返回 (识别结果, 实际提示词token数)"""
+    system_prompt = entry.COMPACT_SYSTEM_PROMPT if prompt_format == "compact" else entry.SYSTEM_PROMPT
+    response = entry.deep_seek_client.chat(
+        entry.DEEP_SEEK_KEY,
+        entry.DEEP_SEEK_API_HOST,
+        [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": content},
+        ],
+        model=entry.DEEP_SEEK_MODEL,
+        response_format={"type": "json_object"},
+    )
+    usage = getattr(response, "usage", None)
+    return json.loads(response.choices[0].message.content), getattr(usage, "prompt_tokens", 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="比较发票内容格式的提示词token数和识别准确率")
+    parser.add_argument("directory", help="样本PDF所在目录")
+    parser.add_argument("--api", action="store_true", help="调用AI统计实际token数和识别准确率")
+    parser.add_argument("--limit", type=int, default=0, help="最多处理的文件数（0 表示全部）")
+    args = parser.parse_args()
+
+    pdf_files = sorted(f for f in os.listdir(args.directory) if f.lower().endswith(".pdf"))
+    if args.limit:
+        pdf_files = pdf_files[:args.limit]
+    if not pdf_files:
+        print(f"在目录 {args.directory} 中未找到PDF文件")
+        return
+
+    system_tokens = {
+        "list": estimate_tokens(entry.SYSTEM_PROMPT),
+        "compact": estimate_tokens(entry.COMPACT_SYSTEM_PROMPT),
+    }
+    estimated = {fmt: 0.0 for fmt in FORMATS}
+    actual = {fmt: 0 for fmt in FORMATS}
+    accuracy = {fmt: [0, 0] for fmt in FORMATS}
+
+    print(f"{'文件':<40}{'list(估算)':>12}{'compact(估算)':>15}")
+    for pdf_file in pdf_files:
+        rs, _ = entry.pdf_read_text(os.path.join(args.directory, pdf_file))
+        contents = {fmt: entry.encode_prompt_content(rs, fmt) for fmt in FORMATS}
+        tokens = {fmt: estimate_tokens(contents[fmt]) for fmt in FORMATS}
+        for fmt in FORMATS:
+            estimated[fmt] += tokens[fmt]
+        print(f"{pdf_file:<40}{tokens['list']:>12.0f}{tokens['compact']:>15.0f}")
+
+        if not args.api:
+            continue
+        results = {}
+        for fmt in FORMATS:
+            try:
+                results[fmt], prompt_tokens = ask(contents[fmt], fmt)
+                actual[fmt] += prompt_tokens
+            except Exception as e:
+                print(f"  {fmt} 格式识别失败: {e}")
+                results[fmt] = {}
+        expected = extract_invoice_locally(rs) or results["list"]
+        for fmt in FORMATS:
+            matched, total = compare_fields(expected, results[fmt])
+            accuracy[fmt][0] += matched
+            accuracy[fmt][1] += total
+            print(f"  {fmt}: 字段一致 {matched}/{total}")
+
+    count = len(pdf_files)
+    print(f"\n共 {count} 个文件")
+    for fmt in FORMATS:
+        per_invoice = system_tokens[fmt] + estimated[fmt] / count
+        print(
+            f"{fmt:<8} 提示词(系统) ≈ {system_tokens[fmt]:.0f} token，"
+            f"发票内容平均 ≈ {estimated[fmt] / count:.0f} token，"
+            f"每张合计 ≈ {per_invoice:.0f} token"
+        )
+    saving = 1 - (system_tokens["compact"] + estimated["compact"] / count) / (
+        system_tokens["list"] + estimated["list"] / count
+    )
+    print(f"紧凑格式每张发票约节省 {saving:.0%} 的输入token（估算）")
+
+    if args.api:
+        for fmt in FORMATS:
+            matched, total = accuracy[fmt]
+            rate = matched / total if total else 0
+            print(f"{fmt:<8} 实际提示词token平均 {actual[fmt] / count:.0f}，字段准确率 {rate:.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+发票文字坐标的紧凑编码
+
+pdf_read_text 的输出直接用 str() 发送给AI时，每个文字框都带有方括号、
+引号和四个坐标，"购""买""方"这类竖排的装饰性标签还会被拆成单字逐个发送。
+这里提供按行排列的紧凑格式：
+
+    行top|left@文字 left@文字 ...
+
+- 同一行的文字框合并为一行，只保留top和每段文字的left
+- 被拆开的"标签：值"（如"银行账号"和"：7066..."）合并为一段
+- 被拆成单字的表头标签（如"单""位"）合并为完整标签
+- 竖排的装饰性标签（购买方信息、销售方信息、备注）直接去掉
+"""
+
+from typing import List
+
+from local_extractor import group_rows
+
+# "标签"与"：值"两个文字框拼接的最大间距
+JOIN_GAP = 8
+
+# 单字标签合并的最大间距
+LABEL_GAP = 14
+
+# 竖排装饰性标签使用的单字
+VERTICAL_LABEL_CHARS = {"购", "买", "销", "售", "方", "信", "息", "备", "注"}
+
+# 竖排标签中上下相邻两字的最大间距
+VERTICAL_LABEL_GAP = 20
+
+
+def _vertical_labels(boxes) -> set:
+    """找出竖排装饰性标签的文字框：同一left上下相邻的装饰性单字"""
+    candidates = [b for b in boxes if b[4] in VERTICAL_LABEL_CHARS]
+    labels = set()
+    for box in candidates:
+        for other in candidates:
+            if other is box:
+                continue
+            if abs(other[0] - box[0]) <= 2 and 0 < abs(other[1] - box[1]) <= VERTICAL_LABEL_GAP:
+                labels.add(id(box))
+                break
+    return labels
+
+
+def encode_boxes_compact(boxes) -> str:
+    """
+    将 [[left, top, right, bottom, text], ...] 编码为按行排列的紧凑文本
+
+    Args:
+        boxes: pdf_read_text 返回的文字坐标列表
+
+    Returns:
+        每行形如 "160|12@*服装*净化服 198@件 281@24" 的多行文本
+    """
+    vertical = _vertical_labels(boxes)
+    lines: List[str] = []
+    for row in group_rows([b for b in boxes if id(b) not in vertical]):
+        segments: List[list] = []
+        for left, _, right, _, text in row:
+            if segments:
+                gap = left - segments[-1][1]
+                is_label = len(text) == 1 and len(segments[-1][2]) == 1
+                is_key_value = text.startswith(("：", ":")) or segments[-1][2].endswith(("：", ":"))
+                if (is_key_value and gap <= JOIN_GAP) or (is_label and gap <= LABEL_GAP):
+                    segments[-1][1] = right
+                    segments[-1][2] += text
+                    continue
+            segments.append([left, right, text])
+        lines.append(f"{row[0][1]}|" + " ".join(f"{left}@{text}" for left, _, text in segments))
+    return "\n".join(lines)
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+流式响应的增量JSON解析
+
+流式调用AI时，响应的JSON对象是分成许多小段陆续到达的。
+JsonObjectStream 每收到一段就继续扫描，顶层的某个字段一结束就立即产出：
+发票号码、销方名称等表头字段排在货物列表之前，往往在整个响应完成前很久就能拿到。
+顶层数组（货物列表 items）中每个已完整的元素也可以随时取出，
+生成被中途取消时仍能保留已经识别出的部分。
+"""
+
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class JsonObjectStream:
+    """
+    逐段解析一个JSON对象
+
+    用法：
+        stream = JsonObjectStream()
+        for delta in chunks:
+            for key, value in stream.feed(delta):
+                ...  # 顶层字段 key 已完整
+        stream.partial()  # 已完整的字段，以及正在生成的数组中已完整的元素
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.fields: Dict[str, Any] = {}
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._key: Optional[str] = None
+        self._key_start: Optional[int] = None
+        self._value_start: Optional[int] = None
+        self._array_items: List[Any] = []
+        self._element_start: Optional[int] = None
+        self._array_open = False  # 正在扫描当前字段的数组元素
+        self._array_value = False  # 当前字段的值是数组（数组结束后、字段提交前仍为 True）
+
+    def feed(self, delta: str) -> List[Tuple[str, Any]]:
+        """追加一段响应文本，返回本段中完成的顶层字段 [(key, value), ...]"""
+        self.text += delta
+        completed = []
+        text = self.text
+        for pos in range(self._pos, len(text)):
+            char = text[pos]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._depth == 1 and self._key is None and self._key_start is not None:
+                        self._key = json.loads(text[self._key_start:pos + 1])
+                        self._key_start = None
+                continue
+
+            if char == '"':
+                self._in_string = True
+                if self._depth == 1 and self._key is None and self._value_start is None:
+                    self._key_start = pos
+                elif self._depth == 2 and self._array_open and self._element_start is None:
+                    self._element_start = pos
+            elif char in "{[":
+                if self._depth == 1 and self._key is not None and self._value_start is not None:
+                    self._array_open = self._array_value = char == "["
+                    self._array_items = []
+                elif self._depth == 2 and self._array_open and self._element_start is None:
+                    self._element_start = pos
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 1 and self._array_open and char == "]":
+                    self._finish_element(pos)
+                    self._array_open = False
+                elif self._depth == 0:
+                    self._finish_field(pos, completed)
+            elif char == ":" and self._depth == 1 and self._key is not None and self._value_start is None:
+                self._value_start = pos + 1
+            elif char == ",":
+                if self._depth == 1:
+                    self._finish_field(pos, completed)
+                elif self._depth == 2 and self._array_open:
+                    self._finish_element(pos)
+            elif not char.isspace() and self._depth == 2 and self._array_open and self._element_start is None:
+                # 数字、true/false/null 等非字符串标量元素
+                self._element_start = pos
+        self._pos = len(text)
+        return completed
+
+    def _finish_element(self, end: int):
+        if self._element_start is None:
+            return
+        try:
+            self._array_items.append(json.loads(self.text[self._element_start:end]))
+        except ValueError:
+            pass
+        self._element_start = None
+
+    def _finish_field(self, end: int, completed: list):
+        if self._key is not None and self._value_start is not None:
+            try:
+                value = json.loads(self.text[self._value_start:end])
+            except ValueError:
+                value = None
+            else:
+                self.fields[self._key] = value
+                completed.append((self._key, value))
+        self._key = None
+        self._key_start = None
+        self._value_start = None
+        self._array_items = []
+        self._array_open = False
+        self._array_value = False
+
+    def partial(self) -> Dict[str, Any]:
+        """
+        已完整的顶层字段；正在生成的数组字段只包含已完整的元素
+
+        数组的 "]" 已到达、但字段还未以 "," 或 "}" 结束时，返回完整的数组：
+
+        >>> stream = JsonObjectStream()
+        >>> stream.feed('{"invoice_number": "123", "items": [1, 2')
+        [('invoice_number', '123')]
+        >>> stream.partial()
+        {'invoice_number': '123', 'items': [1]}
+        >>> stream.feed(', 3]')
+        []
+        >>> stream.partial()
+        {'invoice_number': '123', 'items': [1, 2, 3]}
+        >>> stream.feed('}')
+        [('items', [1, 2, 3])]
+        >>> stream.partial()
+        {'invoice_number': '123', 'items': [1, 2, 3]}
+        """
+        result = dict(self.fields)
+        if self._array_value and self._key is not None:
+            result[self._key] = list(self._array_items)
+        return result
@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+监视文件夹：持续识别新放入的发票
+
+长时间运行，发现目录中新增的PDF后自动识别，并定期把结果追加到汇总表：
+- 安装了 watchdog 时使用系统文件事件（Linux inotify / Windows / macOS），
+  否则每隔 --poll-interval 秒扫描一次目录
+- 文件大小和修改时间连续 --settle 秒不变才开始识别，避免读到正在复制的半个文件
+- 识别在有上限的线程池中进行，同时进行的文件数不超过 --workers
+- 每隔 --flush-interval 秒把已完成的结果写入汇总表，并更新清单
+  （与 incremental.py 共用 .invoice_manifest.json，已导出的文件不会重复处理）；
+  master 模式下汇总表在两次写入之间保持打开，只在文件被外部修改时重新读取
+- 每次写入后打印这段时间的运行汇总并重新统计，长时间运行时指标不会无限增长
+
+识别结果会写入全局缓存，程序在两次写入之间退出时，
+重新启动后这些文件可以直接从缓存读取，不会重复调用AI。
+
+使用方法：
+python watch_folder.py ./inbox                         # 追加到 ./inbox/发票数据汇总.xlsx
+python watch_folder.py ./inbox --mode delta            # 每次写入生成一个增量表
+python watch_folder.py ./inbox --workers 8 --flush-interval 30
+按 Ctrl+C 退出（退出前会写入已完成的结果）
+"""
+
+import argparse
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import entry
+from incremental import MASTER_FILE, MODES, Manifest, open_master_workbook, replace_master_rows
+from invoice_export import InvoiceExporter, XlsxSink, summary_invoice_numbers
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:
+    FileSystemEventHandler = object
+    Observer = None
+
+# 文件保持不变多少秒后才开始识别
+DEFAULT_SETTLE_SECONDS = 2.0
+
+# 轮询模式下扫描目录的间隔（秒）
+DEFAULT_POLL_INTERVAL = 2.0
+
+# 写入汇总表的间隔（秒）
+DEFAULT_FLUSH_INTERVAL = 10.0
+
+
+class _PdfEventHandler(FileSystemEventHandler):
+    """把新建、修改、移入的PDF交给监视器"""
+
+    def __init__(self, watcher: "FolderWatcher"):
+        super().__init__()
+        self.watcher = watcher
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self.watcher.notify(event.src_path)
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self.watcher.notify(event.src_path)
+
+    def on_moved(self, event):
+        if not event.is_directory:
+            self.watcher.notify(event.dest_path)
+
+
+class FolderWatcher:
+    """
+    监视一个目录并持续识别新增的PDF
+
+    Args:
+        directory_path: 监视的目录
+        mode: "master" 追加到汇总表，"delta" 每次写入生成一个增量表
+        master_file: master 模式的汇总表文件名（位于监视目录下）
+        max_workers: 同时识别的文件数量
+        settle_seconds: 文件保持不变多少秒后才开始识别
+        poll_interval: 轮询模式下扫描目录的间隔（秒）
+        flush_interval: 写入汇总表的间隔（秒）
+        use_events: 是否使用 watchdog 文件事件（未安装时自动改用轮询）
+    """
+
+    def __init__(
+            self,
+            directory_path: str,
+            mode: str = "master",
+            master_file: str = MASTER_FILE,
+            max_workers: int = entry.DEFAULT_MAX_WORKERS,
+            settle_seconds: float = DEFAULT_SETTLE_SECONDS,
+            poll_interval: float = DEFAULT_POLL_INTERVAL,
+            flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+            use_events: bool = True,
+    ):
+        if mode not in MODES:
+            raise ValueError(f"未知的输出方式: {mode}")
+        self.directory_path = directory_path
+        self.mode = mode
+        self.master_file = master_file
+        self.max_workers = max(1, int(max_workers))
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+        self.flush_interval = flush_interval
+        self.use_events = use_events and Observer is not None
+
+        self.manifest = Manifest.for_directory(directory_path)
+        self._lock = threading.Lock()
+        # 等待稳定的文件：{文件名: (大小, 修改时间, 最近一次变化的时间)}
+        self._candidates: Dict[str, Tuple[int, int, float]] = {}
+        # 正在识别的文件：{文件名: (内容哈希, (大小, 修改时间), Future)}
+        self._running: Dict[str, Tuple[str, Tuple[int, int], Future]] = {}
+        # 识别失败的文件及其大小和修改时间，文件变化前不再重试
+        self._failed: Dict[str, Tuple[int, int]] = {}
+        # 已完成、等待写入汇总表的结果：[(文件名, 内容哈希, (大小, 修改时间), invoices, error)]
+        self._completed: List[tuple] = []
+        # 已完成但尚未写入汇总表的文件，期间不再重新登记
+        self._unflushed: set = set()
+        # master 模式下保持打开的汇总表：(wb, exporter, 上次保存后的修改时间)
+        self._master: Optional[tuple] = None
+
+    # ------------------------------------------------------------ 发现文件
+
+    def notify(self, file_path: str):
+        """登记一个可能新增或变化的文件（文件事件和目录扫描都调用此方法）"""
+        name = os.path.basename(file_path)
+        if not name.lower().endswith(".pdf") or os.path.dirname(os.path.abspath(file_path)) != os.path.abspath(
+                self.directory_path):
+            return
+        with self._lock:
+            if name in self._running or name in self._unflushed:
+                return
+            if name not in self._candidates:
+                self._candidates[name] = (-1, -1, time.monotonic())
+
+    def scan(self):
+        """扫描目录，登记所有PDF（启动时和轮询模式下使用）"""
+        with os.scandir(self.directory_path) as it:
+            for item in it:
+                if item.is_file() and item.name.lower().endswith(".pdf"):
+                    self.notify(item.path)
+
+    def _ready_files(self) -> List[Tuple[str, str, Tuple[int, int]]]:
+        """
+        检查等待中的文件，返回已稳定且需要识别的 [(文件名, 内容哈希, (大小, 修改时间))]
+
+        文件大小或修改时间变化时重新计时；已导出且内容未变的文件直接移出。
+        """
+        now = time.monotonic()
+        ready = []
+        with self._lock:
+            names = list(self._candidates)
+        for name in names:
+            file_path = os.path.join(self.directory_path, name)
+            try:
+                stat = os.stat(file_path)
+            except OSError:
+                # 文件已被删除或移走
+                with self._lock:
+                    self._candidates.pop(name, None)
+                continue
+
+            signature = (stat.st_size, stat.st_mtime_ns)
+            with self._lock:
+                size, mtime_ns, changed_at = self._candidates[name]
+                if (size, mtime_ns) != signature:
+                    self._candidates[name] = (*signature, now)
+                    continue
+                if stat.st_size == 0 or now - changed_at < self.settle_seconds:
+                    continue
+                if len(self._running) + len(ready) >= self.max_workers * 2:
+                    # 线程池已满，留到下次再提交
+                    continue
+                del self._candidates[name]
+                if self._failed.get(name) == signature:
+                    continue
+
+            try:
+                checked = self.manifest.check(name, file_path)
+            except OSError as e:
+                print(f"读取文件失败 ({name}): {e}")
+                continue
+            if checked is not None:
+                # 使用计算哈希前的 (大小, 修改时间)，识别期间文件被修改时之后会重新识别
+                ready.append((name, *checked))
+        return ready
+
+    # ------------------------------------------------------------ 识别与写入
+
+    def _parse(self, name: str, digest: str):
+        """在工作线程中识别一个文件，异常作为返回值带回"""
+        try:
+            return entry.parse_invoices_from_pdf(os.path.join(self.directory_path, name), digest), None
+        except Exception as e:
+            return None, e
+
+    def _collect_finished(self):
+        with self._lock:
+            finished = [name for name, (_, _, future) in self._running.items() if future.done()]
+            for name in finished:
+                digest, signature, future = self._running.pop(name)
+                invoices, error = future.result()
+                self._completed.append((name, digest, signature, invoices, error))
+                self._unflushed.add(name)
+
+    def _master_workbook(self, output_path: str):
+        """
+        返回保持打开的汇总表 (wb, exporter)
+
+        首次写入时读取汇总表；之后沿用内存中的工作簿，序号和已有发票号码接着累计，
+        汇总表被外部修改（修改时间与上次保存后不同）时重新读取。
+        """
+        mtime_ns = os.stat(output_path).st_mtime_ns if os.path.exists(output_path) else None
+        if self._master is None or self._master[2] != mtime_ns:
+            wb, ws, serial_number = open_master_workbook(output_path)
+            exporter = InvoiceExporter(
+                XlsxSink(ws), serial_number=serial_number, duplicates=entry.DUPLICATE_INVOICES,
+                seen_numbers=summary_invoice_numbers(ws),
+            )
+            self._master = (wb, exporter, mtime_ns)
+        return self._master[0], self._master[1]
+
+    def flush(self) -> Optional[str]:
+        """把已完成的结果写入汇总表并更新清单，返回写入的表格路径（没有结果时返回 None）"""
+        self._collect_finished()
+        with self._lock:
+            completed, self._completed = self._completed, []
+        if not completed:
+            return None
+
+        if self.mode == "master":
+            output_path = os.path.join(self.directory_path, self.master_file)
+            wb, exporter = self._master_workbook(output_path)
+        else:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            output_path = os.path.join(self.directory_path, f"发票数据增量_{timestamp}.xlsx")
+            wb, ws = entry.create_summary_workbook(entry.SUMMARY_HEADERS, streaming=True)
+            exporter = InvoiceExporter(XlsxSink(ws), duplicates=entry.DUPLICATE_INVOICES)
+
+        rows_before, duplicates_before = exporter.rows_written, exporter.duplicate_count
+        exported = []
+        for name, digest, signature, invoices, error in completed:
+            file_path = os.path.join(self.directory_path, name)
+            if error is not None:
+                print(f"处理文件 {name} 时出错: {error}")
+                # 汇总表中不保留错误行，文件被替换或修改后重试
+                with self._lock:
+                    self._failed[name] = signature
+                if self.mode == "master":
+                    continue
+            if self.mode == "master":
+                # 修改过的文件替换汇总表中原来的行
+                replace_master_rows(exporter.sink.ws, exporter, self.manifest.master_rows(name))
+            first_serial = exporter.serial_number
+            count = exporter.write(file_path, invoices, error)
+            if error is None:
+                rows = (first_serial, count) if self.mode == "master" else None
+                exported.append((name, digest, signature, rows))
+
+        try:
+            wb.save(output_path)
+        except Exception:
+            # 保存失败时内存中的工作簿已含这批结果，下次写入前重新读取汇总表
+            self._master = None
+            raise
+        if self.mode == "master":
+            self._master = (wb, exporter, os.stat(output_path).st_mtime_ns)
+        for name, digest, signature, rows in exported:
+            # 记录识别时的大小和修改时间：识别期间文件又被修改的话，之后会重新识别
+            self.manifest.update(name, digest, signature, rows=rows)
+        self.manifest.save()
+        with self._lock:
+            self._unflushed.difference_update(item[0] for item in completed)
+        print(f"已写入 {len(exported)} 个文件的识别结果（{exporter.rows_written - rows_before} 行）: {output_path}")
+        if exporter.duplicate_count > duplicates_before:
+            print(f"其中 {exporter.duplicate_count - duplicates_before} 张发票与之前的文件重复（发票号码相同）")
+        # 输出这段时间的运行汇总并重新统计
+        print(entry.run_metrics.rotate().format_summary())
+        return output_path
+
+    def run(self, stop_event: Optional[threading.Event] = None):
+        """
+        开始监视，直到 stop_event 被设置或按下 Ctrl+C；退出前写入已完成的结果
+        """
+        stop_event = stop_event or threading.Event()
+        observer = None
+        if self.use_events:
+            observer = Observer()
+            observer.schedule(_PdfEventHandler(self), self.directory_path, recursive=False)
+            observer.start()
+            print(f"开始监视目录（文件事件）: {self.directory_path}")
+        else:
+            print(f"开始监视目录（每 {self.poll_interval:g} 秒扫描一次）: {self.directory_path}")
+
+        # 启动前已存在的文件也要处理
+        self.scan()
+        last_scan = last_flush = time.monotonic()
+        tick = min(0.5, self.poll_interval, self.settle_seconds or 0.5)
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                try:
+                    while not stop_event.is_set():
+                        now = time.monotonic()
+                        if observer is None and now - last_scan >= self.poll_interval:
+                            self.scan()
+                            last_scan = now
+
+                        for name, digest, signature in self._ready_files():
+                            print(f"发现新发票: {name}")
+                            future = executor.submit(self._parse, name, digest)
+                            with self._lock:
+                                self._running[name] = (digest, signature, future)
+
+                        if now - last_flush >= self.flush_interval:
+                            self.flush()
+                            last_flush = now
+                        stop_event.wait(tick)
+                except KeyboardInterrupt:
+                    print("正在退出，等待进行中的识别完成...")
+        finally:
+            if observer is not None:
+                observer.stop()
+                observer.join()
+            self.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="监视文件夹，持续识别新放入的发票")
+    parser.add_argument("directory", help="监视的目录")
+    parser.add_argument("--mode", choices=MODES, default="master",
+                        help="master：追加到汇总表；delta：每次写入生成一个增量表")
+    parser.add_argument("--master-file", default=MASTER_FILE, help="master 模式的汇总表文件名")
+    parser.add_argument("--workers", type=int, default=entry.DEFAULT_MAX_WORKERS, help="同时识别的文件数量")
+    parser.add_argument("--settle", type=float, default=DEFAULT_SETTLE_SECONDS,
+                        help="文件保持不变多少秒后开始识别")
+    parser.add_argument("--poll-interval", type=float, default=DEFAULT_POLL_INTERVAL,
+                        help="轮询模式下扫描目录的间隔（秒）")
+    parser.add_argument("--flush-interval", type=float, default=DEFAULT_FLUSH_INTERVAL,
+                        help="写入汇总表的间隔（秒）")
+    parser.add_argument("--poll", action="store_true", help="不使用文件事件，始终轮询")
+    args = parser.parse_args()
+
+    FolderWatcher(
+        args.directory,
+        mode=args.mode,
+        master_file=args.master_file,
+        max_workers=args.workers,
+        settle_seconds=args.settle,
+        poll_interval=args.poll_interval,
+        flush_interval=args.flush_interval,
+        use_events=not args.poll,
+    ).run()
+
+
+if __name__ == "__main__":
+    main()